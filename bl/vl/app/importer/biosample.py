@@ -139,12 +139,8 @@ class Recorder(core.Core):
 
   def do_consistency_checks_plate_well(self, records):
     def preload_vessels():
-      self.logger.info('start preloading vessels')
-      objs = self.kb.get_objects(self.vessel_klass)
-      for o in objs:
-        assert not o.containerSlotLabelUK in self.preloaded_vessels
-        self.preloaded_vessels[o.containerSlotLabelUK] = o
-      self.logger.info('done preloading vessels')
+      self.preload_keys('vessels', 'containerSlotLabelUK', self.vessel_klass,
+                        self.preloaded_vessels)
     def build_key(r):
       plate = self.preloaded_plates[r['plate']]
       return make_unique_key(plate.label, r['label'])
@@ -209,12 +205,8 @@ class Recorder(core.Core):
 
   def do_consistency_checks_tube(self, records):
     def preload_vessels():
-      self.logger.info('start preloading vessels')
-      objs = self.kb.get_objects(self.vessel_klass)
-      for o in objs:
-        assert not o.label in self.preloaded_vessels
-        self.preloaded_vessels[o.label] = o
-      self.logger.info('done preloading vessels')
+      self.preload_keys('vessels', 'label', self.vessel_klass,
+                        self.preloaded_vessels)
     preload_vessels()
     good_records = []
     bad_records = []
@@ -90,8 +90,9 @@ class Recorder(core.Core):
 
     def preload_locations(self):
         self.logger.info('Start preloading locations')
-        locs = self.kb.get_objects(self.kb.Location)
-        self.preloaded_locations = [l.istatCode for l in locs]
+        self.preloaded_locations = set(
+            c for (c,) in self.kb.get_fields(self.kb.Location, ['istatCode'])
+            )
         self.logger.info('Done preloading birth data records')
 
     def append_birth_place_data(self, atype_fields, record):
@@ -105,6 +105,21 @@ class Core(object):
       assert not getattr(o, key_field) in preloaded
       preloaded[getattr(o, key_field)] = o
 
+  def __preload_keys__(self, key_field, klass, preloaded):
+    for k, vid in self.kb.get_fields(klass, [key_field, 'id']):
+      assert not k in preloaded
+      preloaded[k] = vid
+
+  def preload_keys(self, name, key_field, klass, preloaded):
+    """
+    Fill preloaded with a key_field -> id map for all klass objects,
+    without fetching the objects themselves. Use this instead of
+    preload_by_type when only membership checks are needed.
+    """
+    self.logger.info('start preloading %s' % name)
+    self.__preload_keys__(key_field, klass, preloaded)
+    self.logger.info('done preloading %s' % name)
+
   def preload_by_type(self, name, klass, preloaded):
     self.logger.info('start preloading %s' % name)
     self.__preload_items__('id', klass, preloaded)
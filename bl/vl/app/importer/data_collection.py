@@ -50,12 +50,8 @@ class Recorder(core.Core):
   @property
   def preloaded_items(self):
     if not self.__preloaded_items:
-      self.logger.info('start preloading data collection items')
-      objs = self.kb.get_objects(self.kb.DataCollectionItem)
-      for o in objs:
-        assert not o.dataCollectionItemUK in self.__preloaded_items
-        self.__preloaded_items[o.dataCollectionItemUK] = o
-      self.logger.info('done preloading data collection items')
+      self.preload_keys('data collection items', 'dataCollectionItemUK',
+                        self.kb.DataCollectionItem, self.__preloaded_items)
     return self.__preloaded_items
 
   def record(self, records, otsv, rtsv, blocking_validation):
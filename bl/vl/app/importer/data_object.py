@@ -68,9 +68,8 @@ class Recorder(core.Core):
 
   def preload_data_objects(self):
     self.logger.info('start preloading data objects')
-    ds = self.kb.get_objects(self.kb.DataObject)
-    for d in ds:
-      self.preloaded_data_objects[d.path] = d
+    for path, vid in self.kb.get_fields(self.kb.DataObject, ['path', 'id']):
+      self.preloaded_data_objects[path] = vid
     self.logger.info('there are %d DataObject(s) in the kb'
                      % (len(self.preloaded_data_objects)))
 
@@ -188,12 +188,8 @@ class Recorder(core.Core):
     self.preload_by_type('sources', self.source_klass, self.preloaded_sources)
 
   def preload_data_samples(self):
-    self.logger.info('start preloading data_samples')
-    objs = self.kb.get_objects(self.kb.DataSample)
-    for o in objs:
-      assert not o.label in self.preloaded_data_samples
-      self.preloaded_data_samples[o.label] = o
-    self.logger.info('done preloading data_samples')
+    self.preload_keys('data_samples', 'label', self.kb.DataSample,
+                      self.preloaded_data_samples)
 
   def do_consistency_checks(self, records):
     self.logger.info('start consistency checks')
@@ -94,9 +94,9 @@ class Recorder(core.Core):
         self.preload_by_type('lanes', self.kb.Lane, self.preloaded_lanes)
 
     def preload_laneslots(self):
-        ls = self.kb.get_objects(self.kb.LaneSlot)
-        for x in ls:
-            self.preloaded_laneslots[x.laneSlotUK] = x
+        for uk, vid in self.kb.get_fields(self.kb.LaneSlot,
+                                          ['laneSlotUK', 'id']):
+            self.preloaded_laneslots[uk] = vid
 
     def do_consistency_checks(self, records):
         def build_key(r):
@@ -177,14 +177,8 @@ class Recorder(core.Core):
         pass
 
     def do_consistency_checks_common_fields(self, records):
-        def preload_data_samples():
-            self.logger.info('start preloading data samples')
-            objs = self.kb.get_objects(self.kb.DataSample)
-            for o in objs:
-                assert not o.label in self.preloaded_data_samples
-                self.preloaded_data_samples[o.label] = o
-            self.logger.info('done preloading data samples')
-        preload_data_samples()
+        self.preload_keys('data samples', 'label', self.kb.DataSample,
+                          self.preloaded_data_samples)
         good_records = []
         bad_records = []
         grecs_labels = {}
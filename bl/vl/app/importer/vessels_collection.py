@@ -120,12 +120,8 @@ class Recorder(core.Core):
 
   def do_consistency_checks(self, vessels_collection, records):
     def preload_vessels_collection_items():
-      self.logger.info('start preloading vessels collection items')
-      objs = self.kb.get_objects(self.kb.VesselsCollectionItem)
-      for o in objs:
-        assert not o.vesselsCollectionItemUK in self.preloaded_items
-        self.preloaded_items[o.vesselsCollectionItemUK] = o
-      self.logger.info('done preloading vessels collection items')
+      self.preload_keys('vessels collection items', 'vesselsCollectionItemUK',
+                        self.kb.VesselsCollectionItem, self.preloaded_items)
     self.logger.info('start consistency checks on %s' % vessels_collection.label)
     def build_key(vc, r):
       vessels_collection = vc
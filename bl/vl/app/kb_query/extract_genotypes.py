@@ -48,26 +48,36 @@ class Writer(object):
         if len(dsamples) > 0:
             if self.igd:
                 dsamples = dsamples[:1]
-            for ds in dsamples:
+            # resolve_many needs samples with the same number of
+            # markers, so samples are fetched by marker set
+            by_mset = {}
+            for i, ds in enumerate(dsamples):
+                by_mset.setdefault(ds.snpMarkersSet.id, []).append(i)
+            probs = [None] * len(dsamples)
+            for indices in by_mset.itervalues():
+                batch = [dsamples[i] for i in indices]
                 start = time.time()
-                probs, _ = ds.resolve_to_data()
-                end = time.time() - start
-                self.counter['total_fetch_time'] += end
-                if end < self.counter['faster_fetch'] or 'faster_fetch' not in self.counter:
-                    self.counter['faster_fetch'] = end
-                if end > self.counter['slower_fetch']:
-                    self.counter['slower_fetch'] = end
-                self.logger.debug('Retrieved data for %s in %f seconds' %
-                                  (ds.label, end))
-                if probs is not None:
-                    self.counter['fetched_samples'] += 1
-                    self.out_ds_csvw.writerow([ds.id])
-                    disc_probs = [allele_patterns[x]
-                                  for x in project_to_discrete_genotype(probs)]
-                    if self.tro:
-                        self.out_gt_csvw.writerow(disc_probs)
-                    else:
-                        self.out_data.append(disc_probs)
+                batch_probs, _ = batch[0].resolve_many(batch)
+                elapsed = time.time() - start
+                self.counter['total_fetch_time'] += elapsed
+                self.counter['fetched_batches'] += 1
+                if elapsed < self.counter['faster_fetch'] or 'faster_fetch' not in self.counter:
+                    self.counter['faster_fetch'] = elapsed
+                if elapsed > self.counter['slower_fetch']:
+                    self.counter['slower_fetch'] = elapsed
+                self.logger.debug('Retrieved data for %d samples of %s in %f seconds' %
+                                  (len(batch), individual.id, elapsed))
+                for i, p in zip(indices, batch_probs):
+                    probs[i] = p
+            for ds, p in zip(dsamples, probs):
+                self.counter['fetched_samples'] += 1
+                self.out_ds_csvw.writerow([ds.id])
+                disc_probs = [allele_patterns[x]
+                              for x in project_to_discrete_genotype(p)]
+                if self.tro:
+                    self.out_gt_csvw.writerow(disc_probs)
+                else:
+                    self.out_data.append(disc_probs)
 
     def close(self):
         if len(self.out_data) > 0:
@@ -81,8 +91,10 @@ class Writer(object):
                                                                  self.counter['total_fetch_time']))
         self.logger.debug('Average sample fetch time: %f seconds' % 
                           (self.counter['total_fetch_time'] / self.counter['fetched_samples']))
-        self.logger.debug('Faster fetch: %f seconds' % self.counter['faster_fetch'])
-        self.logger.debug('Slower fetch: %f seconds' % self.counter['slower_fetch'])
+        self.logger.debug('%d fetch batches (one per individual and markers set)' %
+                          self.counter['fetched_batches'])
+        self.logger.debug('Faster batch fetch: %f seconds' % self.counter['faster_fetch'])
+        self.logger.debug('Slower batch fetch: %f seconds' % self.counter['slower_fetch'])
         self.logger.debug('#################################################')
 
 
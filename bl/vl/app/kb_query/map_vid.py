@@ -74,11 +74,11 @@ class MapVIDApp(Core):
     back_to_label = dict(it.izip(slot_labels, labels))
     mapping = {}
     self.logger.info('start selecting %s' % source_type.get_ome_table())
-    # FIXME this is not going to scale
-    objs = self.kb.get_objects(source_type)
-    for o in objs:
-      if o.containerSlotLabelUK in slot_labels:
-        mapping[back_to_label[o.containerSlotLabelUK]] = o.id
+    for slot_label, vid in self.kb.get_fields(
+      source_type, ['containerSlotLabelUK', 'id']
+      ):
+      if slot_label in back_to_label:
+        mapping[back_to_label[slot_label]] = vid
     self.logger.info('done selecting %s' % source_type.get_ome_table())
     return mapping
 
@@ -107,13 +107,11 @@ class MapVIDApp(Core):
   def resolve_mapping_object(self, source_type, labels):
     mapping = {}
     self.logger.info('start selecting %s' % source_type.get_ome_table())
-    # FIXME this is not going to scale
     self.logger.debug('\tlabels: %s' % labels)
-    objs = self.kb.get_objects(source_type)
-    for o in objs:
-      self.logger.debug('\t-> %s' % o.label)
-      if o.label in labels:
-        mapping[o.label] = o.id
+    labels = set(labels)
+    for label, vid in self.kb.get_fields(source_type, ['label', 'id']):
+      if label in labels:
+        mapping[label] = vid
     self.logger.info('done selecting %s' % source_type.get_ome_table())
     self.logger.debug('mapping: %s' % mapping)
     return mapping
@@ -0,0 +1,156 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Genotype data object encodings
+==============================
+
+GDO tables store, for each data sample, the AA and BB homozygous
+probabilities of all markers in a set, plus one confidence value per
+marker. With the default ``float32`` encoding this takes 12 bytes per
+marker. The fixed point encodings below trade precision for space:
+
+* ``uint16``: probabilities and confidence are stored as 16 bit
+  integers (resolution 1/65534): 6.25 bytes per marker;
+
+* ``uint8``: 8 bit integers (resolution 1/254): 3.25 bytes per
+  marker.
+
+Values are clipped to [0, 1], while NaN is mapped to the highest
+code. Fixed point encodings also store the discrete genotype of each
+marker (see :func:`~bl.vl.genotype.algo.project_to_discrete_genotype`)
+in 2 bits. Since OMERO.tables has no array column type for small
+integers, encoded values are packed into int64 words.
+
+.. code-block:: python
+
+  row = encode(probs, confs, UINT8)
+  probs, confs = decode(row['probs'], row['confidence'], UINT8, len(confs))
+  calls = unpack_calls(row['calls'], len(confs))
+"""
+
+import numpy as np
+
+from bl.vl.genotype.algo import project_to_discrete_genotype
+
+
+FLOAT32 = 'float32'
+UINT16 = 'uint16'
+UINT8 = 'uint8'
+ENCODINGS = {
+  FLOAT32: None,
+  UINT16: np.dtype('<u2'),
+  UINT8: np.dtype('<u1'),
+  }
+
+WORD = np.dtype('<i8')
+CALL_BITS = 2
+
+
+def get_dtype(encoding):
+  """
+  Return the integer dtype used by a fixed point encoding, or None
+  for float32.
+  """
+  try:
+    return ENCODINGS[encoding]
+  except KeyError:
+    raise ValueError('unknown gdo encoding: %r' % (encoding,))
+
+
+def n_words(n_values, bits):
+  """
+  Number of int64 words needed to store n_values values of the given
+  number of bits.
+  """
+  return (n_values * bits + 63) // 64
+
+
+def pack(a, dtype):
+  """
+  Pack the last axis of integer array a, cast to dtype, into int64
+  words.
+  """
+  n = a.shape[-1]
+  out = np.zeros(a.shape[:-1] + (n_words(n, 8 * dtype.itemsize),),
+                 dtype=WORD)
+  out.view(dtype)[..., :n] = a
+  return out
+
+
+def unpack(words, dtype, n):
+  """
+  Inverse of :func:`pack`: return the first n values of dtype stored
+  along the last axis of words.
+  """
+  return np.ascontiguousarray(words, dtype=WORD).view(dtype)[..., :n]
+
+
+def quantize(x, dtype):
+  top = np.iinfo(dtype).max
+  nan = np.isnan(x)
+  q = np.rint(np.clip(np.where(nan, 0, x), 0, 1) * (top - 1)).astype(dtype)
+  q[nan] = top
+  return q
+
+
+def dequantize(q, dtype):
+  top = np.iinfo(dtype).max
+  x = q.astype(np.float32) / np.float32(top - 1)
+  x[q == top] = np.nan
+  return x
+
+
+def pack_calls(calls):
+  """
+  Pack an array of discrete genotypes (values in [0, 3]) into int64
+  words, 2 bits per genotype.
+  """
+  n = len(calls)
+  c = np.zeros(4 * ((n + 3) // 4), dtype=np.uint8)
+  c[:n] = calls
+  c = c.reshape(-1, 4)
+  b = c[:, 0] | (c[:, 1] << 2) | (c[:, 2] << 4) | (c[:, 3] << 6)
+  return pack(b, np.dtype(np.uint8))
+
+
+def unpack_calls(words, n):
+  """
+  Inverse of :func:`pack_calls`, along the last axis of words.
+  """
+  b = unpack(words, np.dtype(np.uint8), (n + 3) // 4)
+  c = np.empty(b.shape + (4,), dtype=np.uint8)
+  for i in xrange(4):
+    c[..., i] = (b >> (CALL_BITS * i)) & 3
+  return c.reshape(b.shape[:-1] + (-1,))[..., :n]
+
+
+def encode(probs, confidence, encoding):
+  """
+  Return a dict with the values of the probs, confidence and, for
+  fixed point encodings, calls columns of a GDO row.
+  """
+  dtype = get_dtype(encoding)
+  if dtype is None:
+    return {'probs': probs.reshape(-1), 'confidence': confidence}
+  probs = probs.reshape(2, -1)
+  return {
+    'probs': pack(quantize(probs.reshape(-1), dtype), dtype),
+    'confidence': pack(quantize(confidence, dtype), dtype),
+    'calls': pack_calls(project_to_discrete_genotype(probs)),
+    }
+
+
+def decode(probs, confidence, encoding, n_markers):
+  """
+  Inverse of :func:`encode`, for one or more rows: return float32
+  probs and confidence arrays with shapes (..., 2, n_markers) and
+  (..., n_markers).
+  """
+  dtype = get_dtype(encoding)
+  lead = probs.shape[:-1]
+  if dtype is None:
+    return probs.reshape(lead + (2, n_markers)), confidence
+  p = dequantize(unpack(probs, dtype, 2 * n_markers), dtype)
+  c = dequantize(unpack(confidence, dtype, n_markers), dtype)
+  return p.reshape(lead + (2, n_markers)), c
@@ -188,23 +188,16 @@ class VCFWriter(object):
     self.mset.load_markers()
     self.mset.load_alignments(self.ref_genome)
 
-  def __initialize_marker_selector(self, d):
-    if self.marker_selector is None:
-      probs, _ = d.resolve_to_data()
-      self.marker_selector = np.arange(probs.shape[1], dtype=np.uint32)
-
-  def __load_data(self, data_samples):
-    self.__initialize_marker_selector(data_samples[0])
-    N = len(data_samples)
-    M = len(self.marker_selector)
-    data = np.zeros((N, M), dtype=np.uint8)
-    labels = []
-    for i, d in enumerate(data_samples):
-      labels.append(d.label)
-      # FIXME: it would be better if we could directly tell resolve_to_data
-      # to fetch only as selected by marker_selector
-      probs, _ = d.resolve_to_data()
-      data[i, :] = project_to_discrete_genotype(probs[:, self.marker_selector])
+  def __load_data(self, data_samples, batch_size=100):
+    data, labels = None, []
+    for start in xrange(0, len(data_samples), batch_size):
+      batch = data_samples[start:start+batch_size]
+      probs, _ = batch[0].resolve_many(batch, self.marker_selector)
+      if data is None:
+        data = np.zeros((len(data_samples), probs.shape[2]), dtype=np.uint8)
+      for i, d in enumerate(batch):
+        labels.append(d.label)
+        data[start+i, :] = project_to_discrete_genotype(probs[i])
     return labels, data
 
   def __write_header(self, fobj, labels):
@@ -335,18 +328,25 @@ class PedWriter(object):
     if not phenotype_by_id:
       phenotype_by_id = {None: 0}
     allele_patterns = {0: 'A A', 1: 'B B', 2: 'A B', 3: '0 0'}
-    def dump_genotype(fo, data_sample):
-      if data_sample is None:
-        probs = self.null_probs
-      else:
-        probs, _ = data_sample.resolve_to_data()
-      if self.selected_markers:
-        probs = probs[:, self.selected_markers]
+    def dump_genotype(fo, probs):
       fo.write('\t'.join([allele_patterns[x]
                           for x in project_to_discrete_genotype(probs)]))
       fo.write('\n')
     if self.ped_file is None:
       self.ped_file = open(self.base_path+'.ped', 'w')
+    family_members = list(family_members)
+    self.mset.proxy.prefetch(family_members, ['father', 'mother'])
+    probs_by_id = {}
+    null_probs = self.null_probs
+    if self.selected_markers is not None:
+      null_probs = null_probs[:, self.selected_markers]
+    if data_sample_by_id:
+      samples = [(i.id, data_sample_by_id.get(i.id)) for i in family_members]
+      samples = [(k, d) for k, d in samples if d is not None]
+      if samples:
+        probs, _ = samples[0][1].resolve_many([d for _, d in samples],
+                                              self.selected_markers)
+        probs_by_id = dict((k, probs[j]) for j, (k, _) in enumerate(samples))
     for i in family_members:
       # Family ID, IndividualID, paternalID, maternalID, sex, phenotype
       fat_id = 0 if not i.father else i.father.id
@@ -356,7 +356,7 @@ class PedWriter(object):
       self.ped_file.write('%s\t%s\t%s\t%s\t%s\t%s\t' %
                           (family_label, i.id, fat_id, mot_id, gender, pheno))
       if data_sample_by_id:
-        dump_genotype(self.ped_file, data_sample_by_id.get(i.id))
+        dump_genotype(self.ped_file, probs_by_id.get(i.id, null_probs))
 
   def close(self):
     if self.ped_file:
@@ -32,13 +32,19 @@ class PygraphDriver(object):
         }
         self.graph = None
         self.objects_map_by_id = None
+        self.base_ome_classes = {}
 
     def __base_ome_class__(self, klass):
-        kbase = klass.__bases__[0]
-        if not kbase.OME_TABLE:
-            return klass.OME_TABLE
-        else:
-            return self.__base_ome_class__(kbase)
+        try:
+            return self.base_ome_classes[klass]
+        except KeyError:
+            kbase = klass.__bases__[0]
+            if not kbase.OME_TABLE:
+                base = intern(klass.OME_TABLE)
+            else:
+                base = self.__base_ome_class__(kbase)
+            self.base_ome_classes[klass] = base
+            return base
 
     def __okey__(self, o):
         return self.__base_ome_class__(o.__class__), o.omero_id
@@ -47,6 +53,7 @@ class PygraphDriver(object):
         self.logger.info('start pre-fetching graph data')
         self.logger.info('-- start pre-fetching action data')
         actions = self.kb.get_objects(self.kb.Action)
+        self.kb.prefetch(actions, ['target'])
         self.logger.debug('-- fetched %d actions' % len(actions))
         action_by_oid = {}
         for a in actions:
@@ -60,6 +67,7 @@ class PygraphDriver(object):
             objs.extend(self.kb.get_objects(k))
             self.logger.info('-- -- done pre-fetching %s and subclasses' % k)
             self.logger.debug('-- -- fetched %d objects' % (len(objs) - old_len))
+        self.kb.prefetch(objs, ['action'])
         self.logger.info('-- done pre-fetching objs data')
         nodes, edges = [], []
         obj_by_oid = {}
@@ -109,6 +117,9 @@ class PygraphDriver(object):
     def create_edge(self, act, source, dest):
         pass
 
+    def create_batch(self, objs, edges):
+        pass
+
     def destroy_node(self, obj):
         pass
 
@@ -118,5 +129,8 @@ class PygraphDriver(object):
     def destroy_edges(self, act):
         pass
 
+    def destroy_batch(self, objs, edges, acts):
+        pass
+
     def modify_edge(self, act, source, dest):
         pass
\ No newline at end of file
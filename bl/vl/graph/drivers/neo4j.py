@@ -46,6 +46,8 @@ class Neo4JDriver(object):
         'delete_node',
         'delete_edge',
         'update_edge',
+        'save_batch',
+        'delete_batch',
     )
 
     DIRECTION_INCOMING = 1
@@ -139,6 +141,22 @@ class Neo4JDriver(object):
                                                               'bl_dest_obj': dest})
         self.kb.events_sender.send_event(event)
 
+    def create_batch(self, objs, edges):
+        event = events.build_event(events.BatchCreationEvent, {'bl_objs': objs,
+                                                               'edges': edges})
+        self.kb.events_sender.send_event(event)
+
+    def save_batch(self, nodes_conf, edges_conf):
+        """
+        Save all nodes, then all edges. Return the number of saved items.
+        """
+        for node_conf in nodes_conf:
+            self.save_node(node_conf)
+        for edge_conf in edges_conf:
+            self.save_edge(edge_conf['details'], edge_conf['source_node'],
+                           edge_conf['dest_node'])
+        return len(nodes_conf) + len(edges_conf)
+
     def save_edge(self, action_conf, source_hash, dest_hash):
         edge = self.__get_edge_by_nodes__(source_hash, dest_hash)
         if not edge:
@@ -195,6 +213,35 @@ class Neo4JDriver(object):
         else:
             raise MissingEdgeError('Unable to find edges with hash %s. Delete failed.' % edge_hash)
 
+    def destroy_batch(self, objs, edges, acts):
+        event = events.build_event(events.BatchDeletionEvent, {'bl_objs': objs,
+                                                               'edges': edges,
+                                                               'bl_acts': acts})
+        self.kb.events_sender.send_event(event)
+
+    def delete_batch(self, node_hashes, edge_ids, edge_hashes):
+        """
+        Delete edges, then edges by action, then nodes; missing ones
+        are skipped. Return the number of missing items.
+        """
+        missing = 0
+        for edge_id in edge_ids:
+            try:
+                self.delete_edge(edge_id)
+            except MissingEdgeError:
+                missing += 1
+        for edge_hash in edge_hashes:
+            try:
+                self.delete_edges(edge_hash)
+            except MissingEdgeError:
+                missing += 1
+        for node_hash in node_hashes:
+            try:
+                self.delete_node(node_hash)
+            except MissingNodeError:
+                missing += 1
+        return missing
+
     def modify_edge(self, act, source=None, dest=None):
         if source is None and dest is None:
             raise ValueError('no new source or destination specified, no edge update can be triggered')
@@ -211,14 +258,14 @@ class Neo4JDriver(object):
 
     def __get_ome_obj__(self, node):
         try:
-            return self.kb._CACHE[node.obj_hash]
+            return self.kb.cache[node.obj_hash]
         except KeyError:
             return self.kb.get_by_vid(getattr(self.kb, node.obj_class),
                                       str(node.obj_id))
 
     def __get_ome_obj_by_info__(self, obj_info):
         try:
-            return self.kb._CACHE[obj_info['object_hash']]
+            return self.kb.cache[obj_info['object_hash']]
         except KeyError:
             return self.kb.get_by_vid(getattr(self.kb, obj_info['object_type']),
                                       obj_info['object_id'])
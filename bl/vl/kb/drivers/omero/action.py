@@ -112,7 +112,8 @@ class Action(wp.OmeroWrapper):
   def __preprocess_conf__(self, conf):
     return assign_vid_and_timestamp(conf, time_stamp_field='beginTime')
 
-  def __cleanup__(self):
+  def __graph_cleanup__(self):
     # destroy all the edges related to this action
     if hasattr(self, 'target'):
-      self.proxy.dt.destroy_edges(self)
\ No newline at end of file
+      return [], [], [self]
+    return [], [], []
\ No newline at end of file
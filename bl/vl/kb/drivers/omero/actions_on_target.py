@@ -30,8 +30,8 @@ class ActionOnAction(Action):
   OME_TABLE = 'ActionOnAction'
   __fields__ = [('target', Action, 'required')]
 
-  def __cleanup__(self):
-    pass
+  def __graph_cleanup__(self):
+    return [], [], []
 
 
 class ActionOnCollection(Action):
@@ -1,6 +1,10 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
+import itertools as it
+
+import numpy as np
+
 from bl.vl.kb import mimetypes
 import wrapper as wp
 from action import Action, OriginalFile
@@ -63,17 +67,60 @@ class GenotypeDataSample(DataSample):
   __fields__ = [('snpMarkersSet', SNPMarkersSet, wp.REQUIRED)]
 
   def resolve_to_data(self):
-    dos = self.proxy.get_data_objects(self)
-    if not dos:
-      raise ValueError('no connected DataObject(s)')
-    for do in dos:
-      do.reload()
-      if do.mimetype == mimetypes.GDO_TABLE:
-        set_vid, vid, index = self.proxy.parse_gdo_path(do.path)
-        mset = self.snpMarkersSet
-        assert mset.id == set_vid
-        mset.reload()
-        res = self.proxy.get_gdo(mset, vid, index)
-        return res['probs'], res['confidence']
-    else:
-      raise ValueError('DataObject is not a %s' % mimetypes.GDO_TABLE)
+    probs, confs = self.resolve_many([self])
+    return probs[0], confs[0]
+
+  @classmethod
+  def resolve_many(klass, data_samples, marker_indices=None, out=None,
+                   batch_size=100):
+    """
+    Bulk version of :meth:`resolve_to_data`. Return a (probs, confs)
+    pair of arrays with shapes (n_samples, 2, n_markers) and
+    (n_samples, n_markers), where row i holds the genotype of
+    data_samples[i], restricted to marker_indices if not None.
+
+    DataObjects are resolved with a few bulk queries and GDO rows are
+    read in batches of batch_size, grouped by marker set. Results are
+    written into the out (probs, confs) pair if given, e.g., to fill
+    memory-mapped arrays:
+
+    .. code-block:: python
+
+      probs = np.memmap('probs.dat', np.float32, 'w+', shape=(n, 2, m))
+      confs = np.memmap('confs.dat', np.float32, 'w+', shape=(n, m))
+      kb.GenotypeDataSample.resolve_many(data_samples, out=(probs, confs))
+    """
+    data_samples = list(data_samples)
+    if not data_samples:
+      raise ValueError('no data samples')
+    kb = data_samples[0].proxy
+    kb.prefetch(data_samples, ['snpMarkersSet'])
+    dos = kb.get_data_objects_by_samples(data_samples)
+    refs = []
+    for d in data_samples:
+      if not dos.get(d.omero_id):
+        raise ValueError('no connected DataObject(s)')
+      for do in dos[d.omero_id]:
+        if do.mimetype == mimetypes.GDO_TABLE:
+          ref = kb.parse_gdo_path(do.path)
+          assert d.snpMarkersSet.id == ref[0]
+          refs.append(ref)
+          break
+      else:
+        raise ValueError('DataObject is not a %s' % mimetypes.GDO_TABLE)
+    order = sorted(xrange(len(refs)), key=lambda i: (refs[i][0], refs[i][2]))
+    gdos = kb.gadpt.get_gdos((refs[i] for i in order), marker_indices,
+                             batch_size)
+    probs, confs = out or (None, None)
+    for i, r in it.izip(order, gdos):
+      if probs is None:
+        m = len(r['confidence'])
+        probs = np.empty((len(refs), 2, m), dtype=np.float32)
+        confs = np.empty((len(refs), m), dtype=np.float32)
+      if r['probs'].shape != probs.shape[1:]:
+        raise ValueError('data sample %s has %d markers instead of %d' %
+                         (data_samples[i].id, r['probs'].shape[1],
+                          probs.shape[2]))
+      probs[i] = r['probs']
+      confs[i] = r['confidence']
+    return probs, confs
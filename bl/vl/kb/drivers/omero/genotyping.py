@@ -24,6 +24,7 @@ if the Illumina strand detection algorithm yields a result (see
 :func:`~bl.vl.utils.snp.convert_to_top`).
 """
 
+import re
 import itertools as it
 from operator import itemgetter
 from collections import Counter
@@ -33,19 +34,27 @@ import numpy as np
 import bl.vl.utils as vlu
 import bl.vl.utils.snp as vlu_snp
 import bl.vl.utils.np_ext as np_ext
+import bl.vl.genotype.codec as codec
 
 from utils import assign_vid, make_unique_key
 import wrapper as wp
 
 
 BATCH_SIZE = 5000
+# max payload of each addData call on GDO tables: gdo rows can be
+# several MB wide, so batches are sized in bytes rather than rows to
+# stay well below Ice.MessageSizeMax (64 MB by default)
+GDO_BATCH_BYTES = 16 * 2**20
+# markers per row of the blocked GDO tables
+GDO_BLOCK_SIZE = 4096
 VID_SIZE = vlu.DEFAULT_VID_LEN
 
 # mset tables
 ALIGN_TABLE = 'align'
 GDO_TABLE = 'gdo'
+GDO_BLOCKS_TABLE = 'gdoblk'
 MSET_TABLE = 'mset'
-MS_TABLES = frozenset([ALIGN_TABLE, GDO_TABLE, MSET_TABLE])
+MS_TABLES = frozenset([ALIGN_TABLE, GDO_TABLE, GDO_BLOCKS_TABLE, MSET_TABLE])
 
 
 class Marker(object):
@@ -69,6 +78,7 @@ class Marker(object):
 class SNPMarkersSet(wp.OmeroWrapper):
 
   OME_TABLE = 'SNPMarkersSet'
+  ID_FIELD = 'markersSetVID'
 
   __fields__ = [('label', wp.STRING, wp.REQUIRED),
                 ('maker', wp.STRING, wp.REQUIRED),
@@ -270,21 +280,49 @@ class GenotypingAdapter(object):
     ('string', 'op_vid', 'Last operation that modified this row',
      VID_SIZE, None),
     ]
-  @staticmethod
-  def SNP_GDO_REPO_COLS(N):
+  # the encoding of fixed point gdo tables is recorded in the
+  # description of their probs column
+  GDO_ENCODING_DESC = '%s-encoded probs of %d markers'
+  GDO_ENCODING_RE = re.compile(r'^(\w+)-encoded probs of (\d+) markers')
+  @classmethod
+  def SNP_GDO_REPO_COLS(klass, N, encoding=codec.FLOAT32):
     cols = [
       ('string', 'vid', 'gdo VID', VID_SIZE, None),
       ('string', 'op_vid', 'Last operation that modified this row',
        VID_SIZE, None),
-      ('float_array', 'probs', 'np.zeros((2,N), dtype=np.float32)',
-       2*N, None),
-      ('float_array', 'confidence', 'np.zeros((N,), dtype=np.float32)',
-       N, None),
+      ]
+    dtype = codec.get_dtype(encoding)
+    if dtype is None:
+      cols.extend([
+        ('float_array', 'probs', 'np.zeros((2,N), dtype=np.float32)',
+         2*N, None),
+        ('float_array', 'confidence', 'np.zeros((N,), dtype=np.float32)',
+         N, None),
+        ])
+    else:
+      bits = 8 * dtype.itemsize
+      cols.extend([
+        ('long_array', 'probs', klass.GDO_ENCODING_DESC % (encoding, N),
+         codec.n_words(2*N, bits), None),
+        ('long_array', 'confidence', '%s-encoded confidence' % encoding,
+         codec.n_words(N, bits), None),
+        ('long_array', 'calls', '2-bit discrete genotypes',
+         codec.n_words(N, codec.CALL_BITS), None),
+        ])
+    return cols
+  @classmethod
+  def SNP_GDO_BLOCKS_COLS(klass, B, encoding=codec.FLOAT32):
+    cols = klass.SNP_GDO_REPO_COLS(B, encoding)
+    cols[2:2] = [
+      ('long', 'gdo_row', 'Index of the gdo row in the gdo table', None),
+      ('long', 'block', 'Block index: markers [block*B, (block+1)*B)', None),
       ]
     return cols
 
   def __init__(self, kb):
     self.kb = kb
+    self.gdo_layouts = {}
+    self.gdo_formats = {}
 
   @classmethod
   def snp_markers_set_table_name(klass, table_name_root, set_vid):
@@ -317,15 +355,26 @@ class GenotypingAdapter(object):
     table_name = self.snp_markers_set_table_name(table_name_root, set_vid)
     return self.kb.get_table_rows(table_name, selector, batch_size=batch_size)
 
-  def create_snp_markers_set_tables(self, set_vid, N):
+  def create_snp_markers_set_tables(self, set_vid, N,
+                                    gdo_block_size=GDO_BLOCK_SIZE,
+                                    gdo_encoding=codec.FLOAT32):
     """
-    Create all tables needed by a SNPMarkersSet.
+    Create all tables needed by a SNPMarkersSet. Unless
+    gdo_block_size is None, this includes the blocked copy of the
+    GDO table (see :meth:`create_gdo_blocks_table`). Genotypes are
+    stored with gdo_encoding (see :mod:`bl.vl.genotype.codec`).
     """
-    snp_gdo_repo_cols = self.SNP_GDO_REPO_COLS(N)
+    snp_gdo_repo_cols = self.SNP_GDO_REPO_COLS(N, gdo_encoding)
     for table, cols in ((MSET_TABLE, self.SNP_SET_COLS),
                         (ALIGN_TABLE, self.SNP_ALIGNMENT_COLS),
                         (GDO_TABLE, snp_gdo_repo_cols)):
       self._create_snp_markers_set_table(table, cols, set_vid)
+    if gdo_block_size:
+      self._create_snp_markers_set_table(
+        GDO_BLOCKS_TABLE,
+        self.SNP_GDO_BLOCKS_COLS(gdo_block_size, gdo_encoding), set_vid
+        )
+    self.gdo_layouts.pop(set_vid, None)
 
   def delete_snp_markers_set_tables(self, set_vid):
     """
@@ -333,6 +382,9 @@ class GenotypingAdapter(object):
     """
     for table in MS_TABLES:
       self._delete_snp_markers_set_table(table, set_vid)
+      self.gdo_formats.pop(self.snp_markers_set_table_name(table, set_vid),
+                           None)
+    self.gdo_layouts.pop(set_vid, None)
 
   def define_snp_markers_set(self, set_vid, stream, op_vid,
                              batch_size=BATCH_SIZE):
@@ -423,36 +475,297 @@ class GenotypingAdapter(object):
                                             batch_size=batch_size)
 
   def add_gdo(self, set_vid, probs, confidence, op_vid):
-    probs.shape = probs.size
+    return self.add_gdos(set_vid, [(probs, confidence)], op_vid)[0]
+
+  def add_gdos(self, set_vid, gdos, op_vid, max_bytes=GDO_BATCH_BYTES):
+    """
+    Append a stream of (probs, confidence) pairs to the GDO table of
+    a SNPMarkersSet, and to its blocked copy, if any. Each addData
+    call sends as many rows as fit in max_bytes (at least one). Values
+    are encoded as recorded in the table. Return the (vid, row_index)
+    pairs of the new rows, in input order.
+    """
     table_name = self.snp_markers_set_table_name(GDO_TABLE, set_vid)
-    row = {'op_vid': op_vid, 'probs': probs, 'confidence': confidence}
-    assign_vid(row)
-    row_indices = self.kb.add_table_row(table_name, row)
-    assert len(row_indices) == 1
-    probs.shape = (2, probs.size/2)
-    return row['vid'], row_indices[0]
-
-  def _unwrap_gdo(self, row, indices):
+    encoding, n_markers = self.gdo_format(table_name)
+    batch_size = self.gdo_batch_rows(table_name, max_bytes)
+    layout = self.gdo_blocks_layout(set_vid, refresh=True)
+    res = []
+    gdos = iter(gdos)
+    while True:
+      batch, rows = [], []
+      for probs, confidence in it.islice(gdos, batch_size):
+        if probs.size != 2 * n_markers or confidence.size != n_markers:
+          raise ValueError('gdo size does not match %d markers' % n_markers)
+        row = assign_vid({'op_vid': op_vid})
+        batch.append((row['vid'], op_vid, probs, confidence))
+        row.update(codec.encode(probs, confidence, encoding))
+        rows.append(row)
+      if not rows:
+        break
+      row_indices = self.kb.add_table_rows_from_stream(table_name,
+                                                       iter(rows),
+                                                       batch_size)
+      assert len(row_indices) == len(rows)
+      if layout is not None:
+        self.__add_gdo_blocks(set_vid, layout, batch, row_indices[0],
+                              max_bytes)
+      res.extend((r['vid'], i) for r, i in it.izip(rows, row_indices))
+    return res
+
+  def gdo_batch_rows(self, table_name, max_bytes=GDO_BATCH_BYTES):
+    """
+    Return the number of rows of a GDO table that fit in max_bytes,
+    and at least one.
+    """
+    row_size = np.dtype(self.kb.get_table_headers(table_name)).itemsize
+    return max(1, max_bytes // row_size)
+
+  def gdo_format(self, table_name):
+    """
+    Return the (encoding, n_markers) pair of a GDO table (or of its
+    blocked copy, where n_markers is the block size).
+    """
+    if table_name not in self.gdo_formats:
+      desc = self.kb.get_table_descriptions(table_name)['probs']
+      m = self.GDO_ENCODING_RE.match(desc or '')
+      if m:
+        fmt = m.group(1), int(m.group(2))
+      else:
+        headers = dict(self.kb.get_table_headers(table_name))
+        fmt = codec.FLOAT32, np.dtype(headers['confidence']).shape[0]
+      self.gdo_formats[table_name] = fmt
+    return self.gdo_formats[table_name]
+
+  # Blocked GDO tables
+  # ------------------
+  # The blocked copy of a GDO table splits each gdo row into blocks of
+  # block_size consecutive markers, stored as consecutive rows. Block
+  # b of gdo row r is thus expected at row r * n_blocks + b; rows
+  # that are not where expected (e.g., written by concurrent loaders)
+  # are read from the GDO table instead.
+
+  def create_gdo_blocks_table(self, set_vid, block_size=GDO_BLOCK_SIZE,
+                              max_bytes=GDO_BATCH_BYTES):
+    """
+    Create and fill the blocked copy of the GDO table of a
+    SNPMarkersSet created without one. Once the copy exists, it is
+    kept up to date by :meth:`add_gdos` and used to read marker
+    subsets without transferring whole gdo rows. Both reads from the
+    GDO table and writes to its copy move at most max_bytes per call;
+    the GDO table is read through a session of its own (see
+    :meth:`ProxyCore.get_table_rows_iterator`).
+    """
+    if self.gdo_blocks_layout(set_vid, refresh=True) is not None:
+      raise ValueError('%s already has a blocked gdo table' % set_vid)
+    table_name = self.snp_markers_set_table_name(GDO_TABLE, set_vid)
+    encoding, n_markers = self.gdo_format(table_name)
+    batch_size = self.gdo_batch_rows(table_name, max_bytes)
+    self._create_snp_markers_set_table(
+      GDO_BLOCKS_TABLE, self.SNP_GDO_BLOCKS_COLS(block_size, encoding),
+      set_vid
+      )
+    layout = self.gdo_blocks_layout(set_vid, refresh=True)
+    stream = self.kb.get_table_rows_iterator(table_name, batch_size,
+                                             batches=True)
+    try:
+      first_row = 0
+      for rows in stream:
+        probs, confidence = codec.decode(rows['probs'], rows['confidence'],
+                                         encoding, n_markers)
+        batch = it.izip(rows['vid'], rows['op_vid'], probs, confidence)
+        self.__add_gdo_blocks(set_vid, layout, batch, first_row, max_bytes)
+        first_row += len(rows)
+    finally:
+      stream.close()
+
+  def gdo_blocks_layout(self, set_vid, refresh=False):
+    """
+    Return the (n_markers, block_size) layout of the blocked copy of
+    the GDO table of a SNPMarkersSet, or None if there is no such
+    copy.
+    """
+    if refresh or set_vid not in self.gdo_layouts:
+      layout = None
+      blk_table = self.snp_markers_set_table_name(GDO_BLOCKS_TABLE, set_vid)
+      if self.kb.table_exists(blk_table):
+        table_name = self.snp_markers_set_table_name(GDO_TABLE, set_vid)
+        layout = (self.gdo_format(table_name)[1],
+                  self.gdo_format(blk_table)[1])
+      self.gdo_layouts[set_vid] = layout
+    return self.gdo_layouts[set_vid]
+
+  def __add_gdo_blocks(self, set_vid, layout, gdos, first_row, max_bytes):
+    # gdos must yield (vid, op_vid, probs, confidence) tuples
+    n_markers, block_size = layout
+    n_blocks = -(-n_markers // block_size)
+    pad = n_blocks * block_size - n_markers
+    blk_table = self.snp_markers_set_table_name(GDO_BLOCKS_TABLE, set_vid)
+    encoding = self.gdo_format(blk_table)[0]
+    n_rows = self.kb.get_number_of_rows(blk_table)
+    if n_rows != first_row * n_blocks:
+      self.kb.logger.warning('%s is out of step with gdo rows, not extended' %
+                             blk_table)
+      return
+    def blocks():
+      for i, (vid, op_vid, p, c) in enumerate(gdos):
+        p = np.asarray(p).reshape(2, n_markers)
+        c = np.asarray(c)
+        if pad:
+          p = np.hstack((p, np.zeros((2, pad), dtype=p.dtype)))
+          c = np.concatenate((c, np.zeros(pad, dtype=c.dtype)))
+        p = p.reshape(2, n_blocks, block_size).transpose(1, 0, 2)
+        c = c.reshape(n_blocks, block_size)
+        for b in xrange(n_blocks):
+          row = {'vid': vid, 'op_vid': op_vid, 'gdo_row': first_row + i,
+                 'block': b}
+          row.update(codec.encode(p[b], c[b], encoding))
+          yield row
+    self.kb.add_table_rows_from_stream(
+      blk_table, blocks(), self.gdo_batch_rows(blk_table, max_bytes)
+      )
+
+  def __read_gdo_blocks(self, set_vid, row_indices, indices, batch_size):
+    # Return a dict that maps row indices to gdos read from the blocks
+    # that contain indices; rows that are missing, or not where they
+    # should be, in the blocked table are left out
+    layout = None if indices is None else self.gdo_blocks_layout(set_vid)
+    if layout is None:
+      return {}
+    n_markers, block_size = layout
+    n_blocks = -(-n_markers // block_size)
+    idx = np.arange(n_markers)[indices]
+    blocks = np.unique(idx // block_size)
+    if not 0 < len(blocks) < n_blocks:
+      return {}
+    pos = (np.searchsorted(blocks, idx // block_size) * block_size +
+           idx % block_size)
+    blk_table = self.snp_markers_set_table_name(GDO_BLOCKS_TABLE, set_vid)
+    encoding = self.gdo_format(blk_table)[0]
+    n_rows = self.kb.get_number_of_rows(blk_table)
+    row_indices = [r for r in row_indices if (r + 1) * n_blocks <= n_rows]
+    if not row_indices:
+      return {}
+    wanted = [r * n_blocks + b for r in row_indices for b in blocks]
+    data = self.kb.get_table_rows_by_indices(
+      blk_table, wanted, batch_size=batch_size * len(blocks)
+      )
+    res = {}
+    for k, r in enumerate(row_indices):
+      d = data[k*len(blocks):(k+1)*len(blocks)]
+      if not ((d['gdo_row'] == r).all() and (d['block'] == blocks).all()):
+        continue
+      p, c = codec.decode(d['probs'], d['confidence'], encoding, block_size)
+      res[r] = {'vid': d['vid'][0], 'op_vid': d['op_vid'][0],
+                'probs': p.transpose(1, 0, 2).reshape(2, -1)[:, pos],
+                'confidence': c.reshape(-1)[pos]}
+      if encoding != codec.FLOAT32:
+        calls = codec.unpack_calls(d['calls'], block_size)
+        res[r]['calls'] = calls.reshape(-1)[pos]
+    return res
+
+  def __read_gdo_rows(self, set_vid, row_indices, indices, batch_size):
+    # row_indices must be sorted
+    res = self.__read_gdo_blocks(set_vid, row_indices, indices, batch_size)
+    missing = [r for r in row_indices if r not in res]
+    if missing:
+      table_name = self.snp_markers_set_table_name(GDO_TABLE, set_vid)
+      fmt = self.gdo_format(table_name)
+      rows = self.kb.get_table_rows_by_indices(table_name, missing,
+                                               batch_size=batch_size)
+      for r, row in it.izip(missing, rows):
+        res[r] = self._unwrap_gdo(row, indices, fmt)
+    return res
+
+  def _unwrap_gdo(self, row, indices, fmt=None):
+    # fmt is the (encoding, n_markers) pair of the gdo table; float32
+    # rows can be decoded without it
+    encoding, n_markers = fmt or (codec.FLOAT32, row['confidence'].size)
     r = {'vid': row['vid'], 'op_vid': row['op_vid']}
-    p = row['probs']
-    p.shape = (2, p.size/2)
+    p, c = codec.decode(row['probs'], row['confidence'], encoding, n_markers)
     r['probs'] = p[:, indices] if indices is not None else p
-    c = row['confidence']
     r['confidence'] = c[indices] if indices is not None else c
+    if encoding != codec.FLOAT32:
+      calls = codec.unpack_calls(row['calls'], n_markers)
+      r['calls'] = calls[indices] if indices is not None else calls
     return r
 
   def get_gdo(self, set_vid, vid, row_index, indices=None):
+    return self.get_gdos([(set_vid, vid, row_index)], indices).next()
+
+  def get_gdos(self, gdos, indices=None, batch_size=100):
+    """
+    Read the GDO rows referenced by gdos, a stream of (set_vid, vid,
+    row_index) tuples, and yield them in the same order. gdos are
+    processed batch_size at a time: within a batch, the wanted row
+    indices are grouped by table, sorted and fetched with multi-row
+    slice calls. If not None, indices is applied to each row as soon
+    as it has been read; if the marker set has a blocked GDO table,
+    only the blocks that contain indices are read.
+    """
+    gdos = iter(gdos)
+    while True:
+      batch = list(it.islice(gdos, batch_size))
+      if not batch:
+        break
+      by_set = {}
+      for k, (set_vid, _, _) in enumerate(batch):
+        by_set.setdefault(set_vid, []).append(k)
+      res = [None] * len(batch)
+      for set_vid, ks in by_set.iteritems():
+        wanted = sorted(set(batch[k][2] for k in ks))
+        by_index = self.__read_gdo_rows(set_vid, wanted, indices, batch_size)
+        for k in ks:
+          _, vid, row_index = batch[k]
+          r = by_index[row_index]
+          if r['vid'] != vid:
+            raise ValueError('row %d of the %s gdo table is not gdo %s' %
+                             (row_index, set_vid, vid))
+          res[k] = r
+      for r in res:
+        yield r
+
+  def get_gdo_table(self, set_vid, indices=None, n_workers=None,
+                    batch_size=100):
+    """
+    Read the whole GDO table of a SNPMarkersSet in parallel. Return a
+    dict of arrays, with probs reshaped to (n_gdos, 2, n_markers).
+    """
     table_name = self.snp_markers_set_table_name(GDO_TABLE, set_vid)
-    rows = self.kb.get_table_rows_by_indices(table_name, [row_index])
-    assert len(rows) == 1
-    assert rows[0]['vid'] == vid
-    return self._unwrap_gdo(rows[0], indices)
-
-  def get_gdo_iterator(self, set_vid, indices=None, batch_size=100):
-    def iterator(stream):
-      for d in stream:
-        yield self._unwrap_gdo(d, indices)
+    encoding, n_markers = self.gdo_format(table_name)
+    cols = self.kb.get_table_rows_parallel(table_name, n_workers=n_workers,
+                                           batch_size=batch_size,
+                                           columnar=True)
+    p, c = codec.decode(cols['probs'], cols['confidence'], encoding,
+                        n_markers)
+    cols['probs'], cols['confidence'] = p, c
+    if encoding != codec.FLOAT32:
+      cols['calls'] = codec.unpack_calls(cols['calls'], n_markers)
+    if indices is not None:
+      cols['probs'], cols['confidence'] = p[:, :, indices], c[:, indices]
+      if 'calls' in cols:
+        cols['calls'] = cols['calls'][:, indices]
+    return cols
+
+  def get_gdo_iterator(self, set_vid, indices=None, batch_size=100,
+                       prefetch=2):
+    def iterator(stream, fmt):
+      try:
+        for d in stream:
+          yield self._unwrap_gdo(d, indices, fmt)
+      finally:
+        stream.close()
+    def blocks_iterator(n_rows):
+      for start in xrange(0, n_rows, batch_size):
+        rows = range(start, min(start + batch_size, n_rows))
+        res = self.__read_gdo_rows(set_vid, rows, indices, batch_size)
+        for r in rows:
+          yield res[r]
     table_name = self.snp_markers_set_table_name(GDO_TABLE, set_vid)
+    if indices is not None and self.gdo_blocks_layout(set_vid) is not None:
+      stream = blocks_iterator(self.kb.get_number_of_rows(table_name))
+      return vlu.prefetch(stream, prefetch) if prefetch > 0 else stream
     return iterator(
-      self.kb.get_table_rows_iterator(table_name, batch_size=batch_size)
+      self.kb.get_table_rows_iterator(table_name, batch_size=batch_size,
+                                      prefetch=prefetch),
+      self.gdo_format(table_name)
       )
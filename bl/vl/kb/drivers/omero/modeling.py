@@ -1,7 +1,15 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
+import re
+
+import omero.rtypes as ort
+
 import wrapper as wp
+from utils import make_unique_key
+
+
+IN_CHUNK_SIZE = 1000  # max number of values in a single 'in' clause
 
 
 class ModelingAdapter(object):
@@ -9,6 +17,97 @@ class ModelingAdapter(object):
   def __init__(self, kb):
     self.kb = kb
 
+  def __run_in_chunks(self, query, name, values, wtype, n_workers):
+    values = list(set(values))
+    chunks = [values[i:i+IN_CHUNK_SIZE]
+              for i in xrange(0, len(values), IN_CHUNK_SIZE)]
+    def run(chunk):
+      pars = self.kb.ome_query_params({
+        name: ort.rlist([wp.ome_wrap(v, wtype) for v in chunk]),
+        })
+      return self.kb.ome_operation('getQueryService', 'findAllByQuery',
+                                   query, pars)
+    for result in self.kb.parallel_map(run, chunks, n_workers):
+      for o in result or []:
+        yield o
+
+  def find_in_chunks(self, query, name, values, key, wtype=wp.STRING,
+                     n_workers=None):
+    """
+    Run query, whose ``name`` parameter is a list, on chunks of at
+    most IN_CHUNK_SIZE values, with chunks processed at the same
+    time. Return a dict that maps key(obj) to each wrapped result.
+    """
+    res = {}
+    for o in self.__run_in_chunks(query, name, values, wtype, n_workers):
+      w = self.kb.factory.wrap(o)
+      res[key(w)] = w
+    return res
+
+  def reload_by_ids(self, table, ids, fetch=None, n_workers=None):
+    """
+    Load the table objects with the given omero ids, joining in the
+    fields listed in fetch, and return a dict that maps omero ids to
+    wrapped objects. Unlike :meth:`find_in_chunks`, objects that are
+    already in the cache get their omero object replaced by the one
+    just loaded, as with :meth:`ProxyCore.reload_object`.
+    """
+    query = "select o from %s o %s where o.id in (:ids)" % (
+      table, " ".join("join fetch o.%s" % f for f in fetch or [])
+      )
+    res = {}
+    for o in self.__run_in_chunks(query, 'ids', ids, wp.LONG, n_workers):
+      w = self.kb.factory.wrap(o)
+      if w.ome_obj is not o:
+        w.ome_obj = o
+      res[o.id.val] = w
+    return res
+
+  def prefetch(self, objects, fields, n_workers=None):
+    """
+    Load the objects referenced by the given fields of objects, with
+    one chunked query per referenced class, and link them into the
+    omero objects of their referrers, so that accessing those fields
+    does not need a further RPC per object. Dotted fields (e.g.,
+    'action.target') are followed level by level.
+    """
+    tree = {}
+    for f in fields:
+      node = tree
+      for k in f.split('.'):
+        node = node.setdefault(k, {})
+    self.__prefetch(objects, tree, n_workers)
+
+  def __prefetch(self, objects, tree, n_workers):
+    table = lambda v: v.__class__.__name__[:-1]
+    for field, subtree in tree.iteritems():
+      refs, to_load = [], {}
+      for o in objects:
+        v = getattr(o.ome_obj, field, None)
+        if v is None:
+          continue
+        refs.append((o, v))
+        if not v.loaded and self.kb.get_from_cache(v) is None:
+          to_load.setdefault(table(v), []).append(v.id._val)
+      loaded = {}
+      for t, ids in to_load.iteritems():
+        query = "select o from %s o where o.id in (:ids)" % t
+        for x in self.__run_in_chunks(query, 'ids', ids, wp.LONG, n_workers):
+          loaded[(t, x.id._val)] = self.kb.factory.wrap(x)
+      targets = {}
+      for o, v in refs:
+        if v.loaded:
+          w = getattr(o, field) if subtree else None
+        else:
+          w = (loaded.get((table(v), v.id._val)) or
+               self.kb.get_from_cache(v))
+          if w is not None:
+            setattr(o.ome_obj, field, w.ome_obj)
+        if w is not None:
+          targets[id(w)] = w
+      if subtree:
+        self.__prefetch(targets.values(), subtree, n_workers)
+
   def get_device(self, label):
     """
     Return the Device object labeled 'label' or None if nothing
@@ -42,18 +141,20 @@ class ModelingAdapter(object):
                                    query, pars)
     return None if result is None else self.kb.factory.wrap(result)
 
+  @staticmethod
+  def split_vessel_label(label):
+    if re.match(r'^.*::+.*$', label):
+      # Labels like SAMPLE::PROTOCOL must be considered as a single label
+      return [label]
+    return label.split(':')
+
   def get_vessel(self, label):
     """
     Return the Vessel object labeled 'label' or None if nothing
     matches 'label'. A label 'foo:A1' is interpreted as well 'A1' of
     plate 'foo'.
     """
-    import re
-    if re.match(r'^.*::+.*$', label):
-      # Labels like SAMPLE::PROTOCOL must be considered as a single label
-      parts = [label]
-    else:
-      parts = label.split(':')
+    parts = self.split_vessel_label(label)
     if len(parts) == 1:
       query = 'select t from Tube t where t.label = :label'
       pars = self.kb.ome_query_params({'label': wp.ome_wrap(label, wp.STRING)})
@@ -74,6 +175,46 @@ class ModelingAdapter(object):
     else:
       raise ValueError('Bad label %s value' % label)
 
+  def get_vessels_by_labels(self, labels, n_workers=None):
+    """
+    Bulk version of :meth:`get_vessel`: return a dict that maps each
+    label in labels to the corresponding Vessel object. Labels that
+    do not match any vessel are not included.
+    """
+    tube_labels, well_labels = [], {}
+    for label in labels:
+      parts = self.split_vessel_label(label)
+      if len(parts) == 1:
+        tube_labels.append(label)
+      elif len(parts) == 2:
+        well_labels[make_unique_key(*parts)] = label
+      else:
+        raise ValueError('Bad label %s value' % label)
+    res = self.find_in_chunks(
+      'select t from Tube t where t.label in (:labels)', 'labels',
+      tube_labels, lambda t: t.label, n_workers=n_workers
+      )
+    wells = self.find_in_chunks(
+      """select pw from PlateWell pw join fetch pw.container as ct
+      where pw.containerSlotLabelUK in (:uks)
+      """, 'uks', well_labels, lambda w: w.containerSlotLabelUK,
+      n_workers=n_workers
+      )
+    for uk, w in wells.iteritems():
+      res[well_labels[uk]] = w
+    return res
+
+  def get_objects_by_labels(self, klass, labels, n_workers=None):
+    """
+    Return a dict that maps each label in labels to the klass object
+    with that label. Labels that do not match any object are not
+    included.
+    """
+    query = 'select o from %s o where o.label in (:labels)' % \
+            klass.get_ome_table()
+    return self.find_in_chunks(query, 'labels', labels, lambda o: o.label,
+                               n_workers=n_workers)
+
   def get_data_sample(self, label):
     """
     Return the DataSample object labeled 'label' or None if nothing
@@ -114,6 +255,26 @@ class ModelingAdapter(object):
                                     query, pars)
     return [self.kb.factory.wrap(o) for o in results]
 
+  def get_fields(self, klass, fields, dtype=None):
+    """
+    Return the values of the given fields for all klass objects, as a
+    list of tuples or, if dtype is not None, as a numpy structured
+    array. The special field name 'id' stands for klass.ID_FIELD.
+    """
+    fields = [klass.ID_FIELD if f == 'id' else f for f in fields]
+    query = "select %s from %s o" % (", ".join("o.%s" % f for f in fields),
+                                     klass.get_ome_table())
+    return self.kb.projection(query, None, dtype)
+
+  def get_objects_iterator(self, klass, page_size, prefetch=1):
+    """
+    Iterate over all klass objects, fetching them page_size at a time
+    (see :meth:`ProxyCore.find_all_by_query_iterator`).
+    """
+    query = "select o from %s o order by o.id" % klass.get_ome_table()
+    return self.kb.find_all_by_query_iterator(query, None, page_size,
+                                              prefetch)
+
   def get_enrolled(self, study):
     query = """select e
     from Enrollment e
@@ -141,6 +302,25 @@ class ModelingAdapter(object):
                                    query, pars)
     return [self.kb.factory.wrap(i) for i in result]
 
+  def get_data_objects_by_samples(self, sample_ids, n_workers=None):
+    """
+    Bulk version of :meth:`get_data_objects`: return a dict that maps
+    each of the given DataSample omero ids to the list of its
+    DataObjects, sorted by omero id.
+    """
+    query = """select do
+    from DataObject do
+    join fetch do.sample as s
+    where s.id in (:ids)
+    """
+    res = {}
+    for o in self.__run_in_chunks(query, 'ids', sample_ids, wp.LONG,
+                                  n_workers):
+      res.setdefault(o.sample.id._val, []).append(self.kb.factory.wrap(o))
+    for dos in res.itervalues():
+      dos.sort(key=lambda do: do.omero_id)
+    return res
+
   def get_data_collection_items(self, dc):
     query = """select i
     from DataCollectionItem i
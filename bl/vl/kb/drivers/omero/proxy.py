@@ -1,20 +1,26 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
-import hashlib, time, pwd, json, os
+import hashlib, time, pwd, json, os, threading
 from importlib import import_module
+from contextlib import contextmanager
 
+import omero
 # This is actually used in the metaclass magic
 import omero.model as om
+import numpy as np
 
 import bl.vl.utils as vlu
 import bl.vl.kb.config as blconf
+import bl.vl.genotype.codec as gdo_codec
 from bl.vl.kb.messages import get_events_sender
 from bl.vl.kb.dependency import DependencyTree
-from bl.vl.kb import mimetypes
+from bl.vl.kb import mimetypes, KBError
+from bl.vl.utils.ome_utils import ome_key
 
-from proxy_core import ProxyCore
-from wrapper import ObjectFactory, MetaWrapper
+from proxy_core import ProxyCore, SESSION_POOL_SIZE, SESSION_MAX_IDLE, \
+     SESSION_ACQUIRE_TIMEOUT, PAGE_SIZE
+from wrapper import ObjectFactory, MetaWrapper, OmeroWrapper
 import action
 import vessels
 import objects_collections
@@ -25,7 +31,8 @@ import location
 import demographic
 import sequencing
 
-from genotyping import GenotypingAdapter
+from genotyping import GenotypingAdapter, MSET_TABLE, ALIGN_TABLE, \
+     GDO_BATCH_BYTES, GDO_BLOCK_SIZE
 from modeling import ModelingAdapter
 from eav import EAVAdapter
 from ehr import EHR
@@ -43,10 +50,20 @@ class Proxy(ProxyCore):
   """
   An OMERO driver for the knowledge base.
   """
+  IMMUTABLE_TABLES = [r'(%s|%s)-.+\.h5$' % (MSET_TABLE, ALIGN_TABLE)]
+
   def __init__(self, host, user, passwd, group=None, session_keep_tokens=1,
-               check_ome_version=True, extra_modules=None):
+               check_ome_version=True, extra_modules=None,
+               pool_size=SESSION_POOL_SIZE, session_max_idle=SESSION_MAX_IDLE,
+               session_max_uses=None, cache=None, table_cache=None,
+               session_acquire_timeout=SESSION_ACQUIRE_TIMEOUT):
     super(Proxy, self).__init__(host, user, passwd, group, session_keep_tokens,
-                                check_ome_version)
+                                check_ome_version, pool_size=pool_size,
+                                session_max_idle=session_max_idle,
+                                session_max_uses=session_max_uses,
+                                cache=cache, table_cache=table_cache,
+                                session_acquire_timeout=
+                                session_acquire_timeout)
     if extra_modules is not None:
       if isinstance(extra_modules, basestring):
         extra_modules = [extra_modules]
@@ -71,6 +88,7 @@ class Proxy(ProxyCore):
     self.admin = Admin(self)
     self.events_sender = get_events_sender(self.logger)
     self.dt = DependencyTree(self)
+    self.__graph_local = threading.local()
 
   def __check_type(self, fname, ftype, val):
     if not isinstance(val, ftype):
@@ -86,11 +104,106 @@ class Proxy(ProxyCore):
       avid = action
     return avid
 
+  # Dependency graph updates
+  # ========================
+  def dump_to_graph(self, objs, updates):
+    """
+    Update the dependency graph after objs have been saved. The
+    actions of all objs and their targets are loaded with one query
+    per class, then new nodes and edges are sent to the graph driver
+    as a single batch event. Within a
+    :meth:`deferred_graph_updates` block, updates are only collected.
+    """
+    pending = getattr(self.__graph_local, 'pending', None)
+    if pending is not None:
+      pending.extend(zip(objs, updates))
+    else:
+      self.__flush_graph_updates(zip(objs, updates))
+
+  @contextmanager
+  def deferred_graph_updates(self):
+    """
+    Send the graph updates for all objects saved within the block at
+    once, when the block exits:
+
+    .. code-block:: python
+
+      with kb.deferred_graph_updates():
+        for chunk in chunks:
+          kb.save_array(chunk)
+
+    Nested blocks are flushed by the outermost one.
+    """
+    if getattr(self.__graph_local, 'pending', None) is not None:
+      yield
+      return
+    self.__graph_local.pending = []
+    try:
+      yield
+    finally:
+      pending = self.__graph_local.pending
+      self.__graph_local.pending = None
+      self.__flush_graph_updates(pending)
+
+  def __flush_graph_updates(self, saved):
+    relationships = {
+      self.DataCollectionItem: 'dataSample',
+      self.VesselsCollectionItem: 'vessel',
+      }
+    saved = [(o, u) for o, u in saved
+             if getattr(o.ome_obj, 'action', None) is not None]
+    if not saved:
+      return
+    actions = self.madpt.reload_by_ids(
+      'Action', [o.ome_obj.action.id.val for o, _ in saved]
+      )
+    target_ids = {}
+    for a in actions.itervalues():
+      t = getattr(a.ome_obj, 'target', None)
+      if t is not None:
+        target_ids.setdefault(t.__class__.__name__[:-1], []).append(t.id.val)
+    targets = {}
+    for table, ids in target_ids.iteritems():
+      klass = getattr(self, table, None)
+      fetch = [relationships[klass]] if klass in relationships else None
+      for oid, t in self.madpt.reload_by_ids(table, ids, fetch).iteritems():
+        targets[(table, oid)] = t
+    nodes, edges = [], []
+    for o, is_update in saved:
+      if not is_update:
+        nodes.append(o)
+      a = actions.get(o.ome_obj.action.id.val)
+      if a is None:
+        raise ValueError('cannot load action for %s' % o.id)
+      t = getattr(a.ome_obj, 'target', None)
+      if t is not None:
+        target = targets[(t.__class__.__name__[:-1], t.id.val)]
+        if type(target) in relationships:
+          target = getattr(target, relationships[type(target)])
+        edges.append((a, target, o))
+    if nodes or edges:
+      self.dt.create_batch(nodes, edges)
+
+  def refresh_enums(self):
+    """
+    Reload all enum tables from the server (see
+    :meth:`OmeroWrapper.map_enums_values`).
+    """
+    for klass in set(KOK.itervalues()):
+      if klass.is_enum():
+        klass.map_enums_values(self, refresh=True)
+
   # High level ops
   # ==============
   def find_all_by_query(self, query, params):
     return super(Proxy, self).find_all_by_query(query, params, self.factory)
 
+  def find_all_by_query_iterator(self, query, params, page_size=PAGE_SIZE,
+                                 prefetch=1):
+    return super(Proxy, self).find_all_by_query_iterator(
+      query, params, self.factory, page_size, prefetch
+      )
+
   def get_by_vid(self, klass, vid):
     query = "from %s o where o.vid = :vid" % klass.get_ome_table()
     params = {"vid": vid}
@@ -99,6 +212,28 @@ class Proxy(ProxyCore):
       raise ValueError("%d kb objects map to %s" % (len(res), vid))
     return res[0]
 
+  def get_by_vids(self, klass, vids, n_workers=None):
+    """
+    Bulk version of :meth:`get_by_vid`: return a dict that maps each
+    vid in vids to the corresponding klass object. Vids are resolved
+    with a few large queries run at the same time; vids that do not
+    match any object are not included.
+    """
+    query = "select o from %s o where o.vid in (:vids)" % klass.get_ome_table()
+    return self.madpt.find_in_chunks(query, 'vids', vids, lambda o: o.vid,
+                                     n_workers=n_workers)
+
+  def get_by_labels(self, klass, labels, n_workers=None):
+    """
+    Return a dict that maps each label in labels to the klass object
+    with that label (see :meth:`get_by_vids`). For vessels, labels
+    such as 'plate:well' are resolved as in :meth:`get_vessel`.
+    """
+    if issubclass(klass, vessels.Vessel):
+      res = self.madpt.get_vessels_by_labels(labels, n_workers)
+      return dict((k, v) for k, v in res.iteritems() if isinstance(v, klass))
+    return self.madpt.get_objects_by_labels(klass, labels, n_workers)
+
   def create_global_tables(self, destructive=False):
     self.eadpt.create_ehr_table(destructive=destructive)
 
@@ -129,6 +264,36 @@ class Proxy(ProxyCore):
   def get_objects(self, klass):
     return self.madpt.get_objects(klass)
 
+  def get_objects_iterator(self, klass, page_size=PAGE_SIZE, prefetch=1):
+    return self.madpt.get_objects_iterator(klass, page_size, prefetch)
+
+  def get_fields(self, klass, fields, dtype=None):
+    """
+    Return the values of the given fields for all klass objects, as a
+    list of tuples (one per object) or as a numpy structured array if
+    dtype is given. Much cheaper than :meth:`get_objects` when only a
+    few scalar fields are needed:
+
+    .. code-block:: python
+
+      label_to_vid = dict(kb.get_fields(kb.Tube, ['label', 'id']))
+    """
+    return self.madpt.get_fields(klass, fields, dtype)
+
+  def prefetch(self, objects, fields, n_workers=None):
+    """
+    Load the objects referenced by the given fields of all objects in
+    bulk, so that following those references is served locally:
+
+    .. code-block:: python
+
+      inds = kb.get_objects(kb.Individual)
+      kb.prefetch(inds, ['father', 'mother', 'action.target'])
+      for i in inds:
+        print i.father, i.action.target  # no RPC here
+    """
+    self.madpt.prefetch(objects, fields, n_workers)
+
   def get_enrolled(self, study):
     return self.madpt.get_enrolled(study)
 
@@ -153,14 +318,35 @@ class Proxy(ProxyCore):
   def get_data_objects(self, sample):
     return self.madpt.get_data_objects(sample)
 
+  def get_data_objects_by_samples(self, samples, n_workers=None):
+    """
+    Return a dict that maps the omero id of each sample in samples to
+    the list of its DataObjects. DataObjects are looked up with a few
+    large queries run at the same time; samples with no DataObjects
+    are not included.
+    """
+    return self.madpt.get_data_objects_by_samples(
+      [s.omero_id for s in samples], n_workers
+      )
+
   # Genotyping-related utility functions
   # ====================================
 
   def create_snp_markers_set(self, label, maker, model, release,
-                             N, stream, action):
+                             N, stream, action, gdo_block_size=GDO_BLOCK_SIZE,
+                             gdo_encoding=gdo_codec.FLOAT32):
     """
     Given a stream of (label, mask, index, allele_flip) tuples,
     build and save a new marker set.
+
+    Genotypes are also stored in a copy of the GDO table split into
+    blocks of gdo_block_size markers, so that marker subsets can be
+    read without fetching whole rows; pass gdo_block_size=None to
+    disable it.
+
+    gdo_encoding selects how genotypes are stored: besides the
+    default float32, fixed point uint16 and uint8 encodings are
+    available (see :mod:`bl.vl.genotype.codec`).
     """
     assert type(N) == int and N > 0
     if not action.is_loaded():
@@ -183,7 +369,8 @@ class Proxy(ProxyCore):
     mset.save()
     # TODO: add better exception handling to the following code
     try:
-      self.gadpt.create_snp_markers_set_tables(mset.id, N)
+      self.gadpt.create_snp_markers_set_tables(mset.id, N, gdo_block_size,
+                                               gdo_encoding)
       count = self.gadpt.define_snp_markers_set(set_vid, mod_stream(), op_vid)
       if count != N:
         raise ValueError('there are %d records in stream (expected %d)' %
@@ -193,6 +380,104 @@ class Proxy(ProxyCore):
       raise
     return mset
 
+  def __delete_levels(self, objs):
+    """
+    Split objs into lists that can be deleted one after the other:
+    objects referenced by other objects in objs come after them.
+    References are matched by identity key (see :func:`ome_key`),
+    since omero ids are only unique within a table.
+    """
+    by_key = {}
+    for o in objs:
+      by_key.setdefault(ome_key(o.ome_obj), []).append(o)
+    refs, n_referrers = {}, dict((id(o), 0) for o in objs)
+    for o in objs:
+      keys = set()
+      for klass in type(o).__mro__:
+        for name, t in (klass.__dict__.get('__fields__') or {}).iteritems():
+          v = getattr(o.ome_obj, name, None) if isinstance(t[0], type) else None
+          if v is not None and v.id is not None:
+            keys.add(ome_key(v))
+      refs[id(o)] = [r for k in keys for r in by_key.get(k, [])
+                     if r is not o]
+      for r in refs[id(o)]:
+        n_referrers[id(r)] += 1
+    levels, todo = [], objs
+    while todo:
+      level = [o for o in todo if n_referrers[id(o)] == 0]
+      if not level:
+        # reference cycle: fall back to deleting in the given order
+        levels.extend([o] for o in todo)
+        break
+      for o in level:
+        for r in refs[id(o)]:
+          n_referrers[id(r)] -= 1
+      done = set(id(o) for o in level)
+      todo = [o for o in todo if id(o) not in done]
+      levels.append(level)
+    return levels
+
+  def delete_array(self, objects, n_workers=None, ignore_errors=False):
+    """
+    Delete all objects. Objects referenced by other objects in the
+    array are deleted after them, while deletes that do not depend on
+    each other run concurrently (see :meth:`parallel_map`). Deleted
+    objects are dropped from the cache and their dependency graph
+    nodes and edges are removed with a single batch event.
+
+    If any object cannot be deleted, a KBError is raised once all
+    deletes have been tried, unless ignore_errors is True: in this
+    case, a list of (object, exception) pairs for the objects that
+    were not deleted is returned. Graph cleanup is always sent for the
+    objects that were actually deleted, even if the call is
+    interrupted.
+    """
+    objs, seen = [], set()
+    for o in objects:
+      k = ome_key(o.ome_obj)
+      if k not in seen:
+        seen.add(k)
+        objs.append(o)
+    # graph cleanup needs the targets, which could be deleted as well
+    self.prefetch(objs, ['action.target', 'target'])
+    default_cleanup = OmeroWrapper.__cleanup__.im_func
+    graph_cleanup = {}
+    for o in objs:
+      if type(o).__cleanup__.im_func is default_cleanup:
+        graph_cleanup[id(o)] = o.__graph_cleanup__()
+    deleted, errors = [], {}
+    def delete_one(o):
+      try:
+        self.ome_operation("getUpdateService", "deleteObject", o.ome_obj)
+      except Exception, e:
+        self.logger.debug('cannot delete %s: %s' % (o.id, e))
+        errors[id(o)] = e
+      else:
+        deleted.append(o)
+    try:
+      for level in self.__delete_levels(objs):
+        self.parallel_map(delete_one, level, n_workers)
+    finally:
+      nodes, edges, acts, custom = [], [], [], []
+      for o in deleted:
+        self.del_from_cache(o.ome_obj)
+        if id(o) in graph_cleanup:
+          n, e, a = graph_cleanup[id(o)]
+          nodes.extend(n)
+          edges.extend(e)
+          acts.extend(a)
+        else:
+          custom.append(o)
+      if nodes or edges or acts:
+        self.dt.destroy_batch(nodes, edges, acts)
+      for o in custom:
+        o.__cleanup__()
+    failed = [(o, errors[id(o)]) for o in objs if id(o) in errors]
+    if failed and not ignore_errors:
+      raise KBError('%d out of %d objects could not be deleted (%s: %s)' %
+                    (len(failed), len(objs), failed[0][0].id, failed[0][1]))
+    return failed
+
   def delete_snp_markers_set(self, mset):
     self.gadpt.delete_snp_markers_set_tables(mset.id)
     self.delete(mset)
@@ -243,6 +528,17 @@ class Proxy(ProxyCore):
     index = int(index[len('row_index='):])
     return set_vid, vid, index
 
+  @staticmethod
+  def __gdo_digest(probs, confs):
+    # hash the array buffers directly, without tostring() copies
+    size = 0
+    sha1 = hashlib.sha1()
+    for a in probs, confs:
+      a = np.ascontiguousarray(a)
+      size += a.nbytes
+      sha1.update(a.data)
+    return sha1.hexdigest(), size
+
   def add_gdo_data_object(self, action, sample, probs, confs):
     """
     Syntactic sugar to simplify adding genotype data objects.
@@ -255,58 +551,103 @@ class Proxy(ProxyCore):
       probabilities.
     :type probs: numpy.darray
 
+    """
+    return self.add_gdo_data_objects(action, [(sample, probs, confs)])[0]
+
+  def add_gdo_data_objects(self, action, gdos, max_bytes=GDO_BATCH_BYTES):
+    """
+    Add many genotype data objects at once. gdos is a sequence of
+    (sample, probs, confs) tuples, with the same meaning as the
+    arguments of :meth:`add_gdo_data_object`. Genotype rows are
+    appended to the GDO table of each marker set in batches of at most
+    max_bytes (but at least one row), and all DataObjects are saved
+    with a single call.
+
+    .. code-block:: python
+
+      gdos = [(sample, probs, confs) for ...]
+      data_objects = kb.add_gdo_data_objects(action, gdos)
+
+    Return the new DataObjects, in the same order as gdos.
     """
     avid = self.__resolve_action_id(action)
-    if not isinstance(sample, self.GenotypeDataSample):
-      raise ValueError('sample should be an instance of GenotypeDataSample')
-    mset = sample.snpMarkersSet
-    # FIXME doesn't check that probs and confs have the right dtype and size
-    gdo_vid, row_index = self.gadpt.add_gdo(mset.id, probs, confs, avid)
-    size = 0
-    sha1 = hashlib.sha1()
-    s = probs.tostring();  size += len(s) ; sha1.update(s)
-    s = confs.tostring();  size += len(s) ; sha1.update(s)
-    conf = {
-      'sample': sample,
-      'path': self.make_gdo_path(mset, gdo_vid, row_index),
-      'mimetype': mimetypes.GDO_TABLE,
-      'sha1': sha1.hexdigest(),
-      'size': size,
-      }
-    gds = self.factory.create(self.DataObject, conf).save()
-    return gds
+    gdos = list(gdos)
+    by_mset = {}
+    for i, (sample, probs, confs) in enumerate(gdos):
+      if not isinstance(sample, self.GenotypeDataSample):
+        raise ValueError('sample should be an instance of GenotypeDataSample')
+      mset = sample.snpMarkersSet
+      by_mset.setdefault(mset.id, (mset, []))[1].append(i)
+    data_objects = [None] * len(gdos)
+    for mset, idx in by_mset.itervalues():
+      # FIXME doesn't check that probs and confs have the right dtype and size
+      rows = self.gadpt.add_gdos(mset.id, ((gdos[i][1], gdos[i][2])
+                                           for i in idx), avid, max_bytes)
+      for i, (gdo_vid, row_index) in zip(idx, rows):
+        sample, probs, confs = gdos[i]
+        sha1, size = self.__gdo_digest(probs, confs)
+        conf = {
+          'sample': sample,
+          'path': self.make_gdo_path(mset, gdo_vid, row_index),
+          'mimetype': mimetypes.GDO_TABLE,
+          'sha1': sha1,
+          'size': size,
+          }
+        data_objects[i] = self.factory.create(self.DataObject, conf)
+    if data_objects:
+      self.save_array(data_objects)
+    return data_objects
+
+  def create_gdo_blocks_table(self, mset, block_size=GDO_BLOCK_SIZE):
+    """
+    Add a blocked copy of the GDO table to a marker set created
+    without one, see :meth:`GenotypingAdapter.create_gdo_blocks_table`.
+    """
+    self.gadpt.create_gdo_blocks_table(mset.id, block_size)
 
   def get_gdo(self, mset, vid, row_index, indices=None):
     return self.gadpt.get_gdo(mset.id, vid, row_index, indices)
 
+  def get_gdo_table(self, mset, indices=None, n_workers=None, batch_size=100):
+    """
+    Read all GDOs stored for mset at once, fetching batches of rows
+    over n_workers concurrent sessions. See
+    :meth:`GenotypingAdapter.get_gdo_table`.
+    """
+    return self.gadpt.get_gdo_table(mset.id, indices, n_workers, batch_size)
 
   #FIXME this is the basic object, we should have some support for selections
   def get_gdo_iterator(self, mset, data_samples=None, indices = None,
-                       batch_size=100):
-    def get_gdo_iterator_on_list(dos):
-      seen_data_samples = set([])
-      for do in dos:
-        # FIXME we could, in principle, handle other mimetypes too
-        if do.mimetype == mimetypes.GDO_TABLE:
-          self.logger.debug(do.path)
-          mset_vid, vid, row_index = self.parse_gdo_path(do.path)
-          self.logger.debug('%r' % [vid, row_index])
-          if mset_vid != mset.id:
-            raise ValueError(
-              'DataObject %s map to data with a wrong SNPMarkersSet' % do.path
-              )
-          yield self.get_gdo(mset, vid, row_index, indices)
-        else:
-          pass
+                       batch_size=100, prefetch=2):
+    """
+    Iterate over the GDOs of mset. If data_samples is given, only
+    yield the GDOs of those samples, in the same order; rows are
+    fetched batch_size at a time, see
+    :meth:`GenotypingAdapter.get_gdos`.
+    """
+    def gdo_refs(dos):
+      for d in data_samples:
+        for do in dos.get(d.omero_id, []):
+          # FIXME we could, in principle, handle other mimetypes too
+          if do.mimetype == mimetypes.GDO_TABLE:
+            self.logger.debug(do.path)
+            mset_vid, vid, row_index = self.parse_gdo_path(do.path)
+            if mset_vid != mset.id:
+              raise ValueError(
+                'DataObject %s map to data with a wrong SNPMarkersSet' % do.path
+                )
+            yield mset_vid, vid, row_index
     if data_samples is None:
-      return self.gadpt.get_gdo_iterator(mset.id, indices, batch_size)
+      return self.gadpt.get_gdo_iterator(mset.id, indices, batch_size,
+                                         prefetch)
     for d in data_samples:
       if d.snpMarkersSet != mset:
         raise ValueError('data_sample %s snpMarkersSet != mset' % d.id)
-    ids = ','.join('%s' % ds.omero_id for ds in data_samples)
-    query = 'from DataObject do where do.sample.id in (%s)' % ids
-    dos = self.find_all_by_query(query, None)
-    return get_gdo_iterator_on_list(dos)
+    dos = self.get_data_objects_by_samples(data_samples)
+    stream = self.gadpt.get_gdos(gdo_refs(dos), indices, batch_size)
+    if prefetch > 0:
+      return vlu.prefetch(stream, prefetch)
+    return stream
 
   def get_snp_markers_set(self, label=None,
                           maker=None, model=None, release=None):
@@ -1,11 +1,15 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
+import bl.vl.utils as vlu
 from bl.vl.utils import get_logger
 
 import itertools as it
+import os, threading, time, copy, re
+from contextlib import contextmanager
 import numpy as np
 
+import Ice
 import omero
 from omero_version import omero_version
 import omero.rtypes as ort
@@ -15,12 +19,37 @@ import omero_Tables_ice
 import omero_SharedResources_ice
 
 import bl.vl.kb as kb
+import bl.vl.utils.np_ext as np_ext
 from bl.vl.utils.ome_utils import ome_hash
+from bl.vl.utils.cache import LRUCache
+from bl.vl.utils.table_cache import TableDiskCache
+from bl.vl.utils.instrumentation import HookRegistry, CallStats
 
 from wrapper import ome_wrap
 
 
 BATCH_SIZE = 5000
+PAGE_SIZE = 1000  # objects fetched by each query in paged mode
+SELECTION_WINDOW = 1000000  # rows scanned by a single getWhereList call
+MIN_READ_RUN = 16  # shorter runs of selected rows are fetched with slice
+
+# session pool defaults
+SESSION_POOL_SIZE = 4  # max open sessions per (user, group)
+SESSION_MAX_IDLE = 300  # seconds before an idle session is closed
+SESSION_CHECK_INTERVAL = 60  # seconds before an idle session is pinged
+SESSION_ACQUIRE_TIMEOUT = 600  # seconds to wait for a free session
+SESSION_ERRORS = (Ice.LocalException, omero.SessionException)
+
+CACHE_SIZE = 100000  # max number of wrapped objects kept by each proxy
+TABLE_CACHE_SIZE = 16  # max number of open tables kept by each session
+
+# process-wide registry of hooks notified of all remote calls; if the
+# environment variable below is set, call statistics are collected and
+# printed at exit, and calls slower than its value (in seconds, if
+# numeric) are logged; see parse_rpc_stats_env
+RPC_HOOKS = HookRegistry()
+RPC_STATS_ENV = 'BL_VL_RPC_STATS'
+RPC_STATS_OFF = frozenset(['no', 'off', 'false'])
 
 
 def convert_type(o):
@@ -42,9 +71,8 @@ def convert_type(o):
 
 def convert_coordinates_to_np(d):
   record_type = [(c.name, convert_type(c)) for c in d.columns]
-  npd = np.zeros(len(d.columns[0].values), dtype=record_type)
-  for c in d.columns:
-    npd[c.name] = c.values
+  npd = np.empty(len(d.columns[0].values), dtype=record_type)
+  fill_from_coordinates(npd, d)
   return npd
 
 
@@ -52,6 +80,111 @@ def convert_to_numpy_record_type(d):
   return [(c.name, convert_type(c)) for c in d]
 
 
+def allocate_table_buffer(col_objs, n_rows, columnar=False):
+  """
+  Allocate room for n_rows rows of the given columns, either as a
+  structured array or, if columnar is True, as a dict that maps each
+  column name to a contiguous array. In the latter case, array
+  columns of size N yield (n_rows, N) arrays.
+  """
+  record_type = convert_to_numpy_record_type(col_objs)
+  if columnar:
+    return dict((name, np.empty(n_rows, dtype=t)) for name, t in record_type)
+  return np.empty(n_rows, dtype=record_type)
+
+
+def fill_from_coordinates(buf, d, offset=0):
+  """
+  Copy the contents of the omero.grid.Data object d into buf (as
+  returned by allocate_table_buffer), starting from row offset.
+  Return the number of rows copied.
+  """
+  if not d or not d.columns:
+    return 0
+  n = len(d.columns[0].values)
+  for c in d.columns:
+    buf[c.name][offset:offset+n] = c.values
+  return n
+
+
+def data_size(d):
+  """
+  Return the approximate size in bytes of the values held by the
+  omero.grid.Data object (or list of columns) d.
+  """
+  columns = getattr(d, 'columns', d) or []
+  return sum(np.dtype(convert_type(c)).itemsize * len(c.values or [])
+             for c in columns)
+
+
+def enable_rpc_stats(slow_threshold=None, logger=None, at_exit=True):
+  """
+  Register a :class:`~bl.vl.utils.instrumentation.CallStats` hook
+  that collects statistics on all remote calls and return it.
+  """
+  stats = CallStats(slow_threshold, logger)
+  RPC_HOOKS.register(stats)
+  if at_exit:
+    stats.report_at_exit()
+  return stats
+
+
+def parse_rpc_stats_env(value, logger=None):
+  """
+  Parse the value of ``BL_VL_RPC_STATS``. Return a (enabled,
+  slow_threshold) pair: numbers are slow call thresholds in seconds,
+  while other values just enable statistics (without a threshold),
+  unless they are one of ``RPC_STATS_OFF``.
+  """
+  if value is None:
+    return False, None
+  value = value.strip()
+  if value.lower() in RPC_STATS_OFF:
+    return False, None
+  if value.lower() in ('', 'yes', 'on', 'true'):
+    return True, None
+  try:
+    return True, float(value)
+  except ValueError:
+    if logger is not None:
+      logger.warning('%s=%r is not a number, enabling rpc stats with no '
+                     'slow call threshold' % (RPC_STATS_ENV, value))
+    return True, None
+
+
+class InstrumentedTable(object):
+  """
+  Wrap an OMERO.tables table proxy, reporting data transfer calls to
+  the hooks in registry.
+  """
+  TIMED = {
+    'read': lambda args, r: data_size(r),
+    'slice': lambda args, r: data_size(r),
+    'readCoordinates': lambda args, r: data_size(r),
+    'getWhereList': lambda args, r: 8 * len(r),
+    'addData': lambda args, r: data_size(args[0]),
+    'update': lambda args, r: data_size(args[0]),
+    'getNumberOfRows': lambda args, r: 0,
+    'getHeaders': lambda args, r: 0,
+    }
+
+  def __init__(self, table, registry):
+    self.table = table
+    self.registry = registry
+
+  def __getattr__(self, name):
+    method = getattr(self.table, name)
+    size = self.TIMED.get(name)
+    if size is None:
+      return method
+    def timed(*args):
+      with self.registry.timed('table.%s' % name) as call:
+        r = method(*args)
+        call.size = size(args, r)
+      return r
+    return timed
+
+
 def convert_from_numpy(x):
   if isinstance(x, np.int64):
     return int(x)
@@ -59,6 +192,387 @@ def convert_from_numpy(x):
     return x
 
 
+class TableSelection(object):
+  """
+  Single-pass selection of rows from an open OMERO.tables table.
+
+  A list of selectors is combined into a single 'or' condition, whose
+  matching row ids are retrieved with one getWhereList call every
+  ``window`` rows. Runs of at least ``min_run`` consecutive ids are
+  then fetched with read, the remaining ones with slice, in batches
+  of at most ``batch_size`` rows; only the requested columns are
+  transferred. The number of calls made to the table service is
+  available as ``round_trips``.
+  """
+  def __init__(self, table, window=SELECTION_WINDOW, min_run=MIN_READ_RUN,
+               batch_size=BATCH_SIZE):
+    self.table = table
+    self.window = window
+    self.min_run = min_run
+    self.batch_size = batch_size
+    self.round_trips = 0
+
+  @staticmethod
+  def combine(selector):
+    if isinstance(selector, basestring):
+      return selector
+    if len(selector) == 1:
+      return selector[0]
+    return ' | '.join('(%s)' % s for s in selector)
+
+  def where(self, selector):
+    """
+    Return the sorted array of the ids of the rows matching selector.
+    """
+    condition = self.combine(selector)
+    n_rows = self.table.getNumberOfRows()
+    self.round_trips += 1
+    hits = []
+    for start in xrange(0, n_rows, self.window):
+      stop = min(start + self.window, n_rows)
+      hits.extend(self.table.getWhereList(condition, {}, start, stop, 1))
+      self.round_trips += 1
+    return np.unique(np.array(hits, dtype=np.int64))
+
+  def fetch(self, ids, col_objs, col_numbers, columnar=False):
+    """
+    Read rows with the given sorted ids into a newly allocated buffer.
+    """
+    buf = allocate_table_buffer(col_objs, len(ids), columnar)
+    starts, stops = np_ext.contiguous_runs(ids)
+    offsets = np.r_[0, np.cumsum(stops - starts)[:-1]]
+    scattered = []
+    for start, stop, offset in it.izip(starts, stops, offsets):
+      if stop - start < self.min_run:
+        scattered.append((start, stop, offset))
+        continue
+      for i in xrange(start, stop, self.batch_size):
+        j = min(i + self.batch_size, stop)
+        d = self.table.read(col_numbers, int(i), int(j))
+        self.round_trips += 1
+        fill_from_coordinates(buf, d, offset + i - start)
+    if scattered:
+      idx = np.concatenate([np.arange(b, e) for b, e, _ in scattered])
+      pos = np.concatenate([np.arange(o, o + e - b) for b, e, o in scattered])
+      for i in xrange(0, len(idx), self.batch_size):
+        d = self.table.slice(col_numbers,
+                             map(int, idx[i:i+self.batch_size]))
+        self.round_trips += 1
+        self.__fill_positions(buf, d, pos[i:i+self.batch_size])
+    return buf
+
+  def __fill_positions(self, buf, d, positions):
+    # scattered runs come in ascending order, so positions are
+    # contiguous unless some long run was read in between
+    if positions[-1] - positions[0] + 1 == len(positions):
+      fill_from_coordinates(buf, d, positions[0])
+    else:
+      for c in d.columns:
+        buf[c.name][positions] = c.values
+
+
+def close_table(t):
+  try:
+    t.close()
+  except (omero.ServerError, Ice.LocalException):
+    pass
+
+
+class PooledSession(object):
+  """
+  An OMERO session owned by a :class:`SessionPool`.
+
+  Tables opened through the session are kept in ``tables``, together
+  with their headers and the pool's epoch for the table name at the
+  time they were opened: see :meth:`SessionPool.invalidate_table`.
+  """
+  def __init__(self, client, session, key, max_tables=TABLE_CACHE_SIZE):
+    self.client = client
+    self.session = session
+    self.key = key
+    self.created = self.last_used = time.time()
+    self.uses = 0
+    self.tables = LRUCache(max_tables,
+                           on_evict=lambda name, entry: close_table(entry[0]))
+
+  def get_table(self, table_name, epoch):
+    entry = self.tables.get(table_name)
+    if entry is None:
+      return None
+    if entry[2] != epoch:
+      self.drop_table(table_name)
+      return None
+    return entry[0], entry[1]
+
+  def put_table(self, table_name, t, headers, epoch):
+    self.tables[table_name] = (t, headers, epoch)
+
+  def drop_table(self, table_name):
+    entry = self.tables.pop(table_name)
+    if entry is not None:
+      close_table(entry[0])
+
+  def close(self):
+    for entry in self.tables.values():
+      close_table(entry[0])
+    self.tables.clear()
+    try:
+      self.client.closeSession()
+    except SESSION_ERRORS:
+      pass
+
+
+class SessionPool(object):
+  """
+  A bounded, thread-safe pool of OMERO sessions.
+
+  Sessions are kept separately for each (user, group) pair, with at
+  most ``max_size`` open sessions per pair: when all of them are busy,
+  :meth:`acquire` blocks until one is released, raising a KBError if
+  none is available within ``acquire_timeout`` seconds (None means
+  wait forever). Sessions that have
+  been idle for more than ``max_idle`` seconds, or that have served
+  ``max_uses`` operations, are closed instead of being reused: as
+  explained in :class:`ProxyCore`, closing a session is the only way
+  to make the server release the memory allocated to it.
+  """
+  def __init__(self, host, max_size=SESSION_POOL_SIZE,
+               max_idle=SESSION_MAX_IDLE, max_uses=None,
+               check_interval=SESSION_CHECK_INTERVAL,
+               acquire_timeout=SESSION_ACQUIRE_TIMEOUT, logger=None):
+    if max_size < 1:
+      raise ValueError('max_size must be a positive integer')
+    self.host = host
+    self.max_size = max_size
+    self.max_idle = max_idle
+    self.max_uses = max_uses
+    self.check_interval = check_interval
+    self.acquire_timeout = acquire_timeout
+    self.logger = logger or get_logger('bl.vl.kb.drivers.omero.proxy_core')
+    self.closed = False
+    self.__cond = threading.Condition(threading.Lock())
+    self.__idle = {}
+    self.__n_open = {}
+    self.__table_epochs = {}
+    self.__table_locks = {}
+
+  def __open(self, key, passwd):
+    user, group_name = key
+    client = omero.client(self.host)
+    session = client.createSession(user, passwd)
+    if group_name:
+      a = session.getAdminService()
+      try:
+        g = a.lookupGroup(group_name)
+        session.setSecurityContext(g)
+      except omero.ApiUsageException, aue:
+        client.closeSession()
+        raise ValueError(aue.message)
+    self.logger.debug('opened new session for %r' % (key,))
+    return PooledSession(client, session, key)
+
+  def __is_alive(self, ps):
+    if time.time() - ps.last_used < self.check_interval:
+      return True
+    try:
+      ps.session.keepAlive(None)
+    except SESSION_ERRORS:
+      return False
+    return True
+
+  def __expired(self, ps, now):
+    return ((self.max_idle is not None and now - ps.last_used > self.max_idle)
+            or (self.max_uses is not None and ps.uses >= self.max_uses))
+
+  def __reap(self, now):
+    # must be called with the lock held; returns sessions to be closed
+    dead = []
+    for key, idle in self.__idle.iteritems():
+      alive = []
+      for ps in idle:
+        (dead if self.__expired(ps, now) else alive).append(ps)
+      idle[:] = alive
+    for ps in dead:
+      self.__n_open[ps.key] -= 1
+    return dead
+
+  def acquire(self, user, passwd, group_name=None):
+    """
+    Get an open session for (user, group_name), creating it if needed.
+
+    The returned :class:`PooledSession` must be given back with
+    :meth:`release`.
+    """
+    key = (user, group_name)
+    deadline = None
+    if self.acquire_timeout is not None:
+      deadline = time.time() + self.acquire_timeout
+    while True:
+      self.__cond.acquire()
+      try:
+        dead = self.__reap(time.time())
+        ps = None
+        while True:
+          if self.closed:
+            raise kb.KBError('session pool has been closed')
+          idle = self.__idle.get(key)
+          if idle:
+            ps = idle.pop()
+            break
+          if self.__n_open.get(key, 0) < self.max_size:
+            self.__n_open[key] = self.__n_open.get(key, 0) + 1
+            break
+          if deadline is None:
+            self.__cond.wait()
+            continue
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            raise kb.KBError('no session available for %r after %s seconds'
+                             % (key, self.acquire_timeout))
+          self.__cond.wait(remaining)
+      finally:
+        self.__cond.release()
+      for x in dead:
+        x.close()
+      if ps is None:
+        try:
+          return self.__open(key, passwd)
+        except:
+          self.__forget(key)
+          raise
+      if self.__is_alive(ps):
+        return ps
+      self.logger.debug('discarding stale session for %r' % (key,))
+      self.__forget(key)
+      ps.close()
+
+  def open_detached(self, user, passwd, group_name=None):
+    """
+    Open a session for (user, group_name) that is not counted against
+    ``max_size``, for long-lived consumers such as table iterators.
+    The caller is responsible for closing it.
+    """
+    return self.__open((user, group_name), passwd)
+
+  def __forget(self, key):
+    self.__cond.acquire()
+    try:
+      self.__n_open[key] -= 1
+      self.__cond.notify()
+    finally:
+      self.__cond.release()
+
+  def release(self, ps, discard=False):
+    """
+    Give a session back to the pool. If ``discard`` is True, or if
+    the session has served ``max_uses`` operations, it is closed.
+    """
+    ps.uses += 1
+    ps.last_used = time.time()
+    self.__cond.acquire()
+    try:
+      discard = discard or self.closed or self.__expired(ps, ps.last_used)
+      if discard:
+        self.__n_open[ps.key] -= 1
+      else:
+        self.__idle.setdefault(ps.key, []).append(ps)
+      self.__cond.notify()
+    finally:
+      self.__cond.release()
+    if discard:
+      ps.close()
+
+  def recycle(self):
+    """
+    Close all idle sessions, e.g., to let the server reclaim memory
+    after a heavy job.
+    """
+    self.__cond.acquire()
+    try:
+      dead = []
+      for idle in self.__idle.itervalues():
+        dead.extend(idle)
+        del idle[:]
+      for ps in dead:
+        self.__n_open[ps.key] -= 1
+      self.__cond.notify_all()
+    finally:
+      self.__cond.release()
+    for ps in dead:
+      ps.close()
+
+  def close(self):
+    self.closed = True
+    self.recycle()
+
+  def table_epoch(self, table_name):
+    return self.__table_epochs.get(table_name, 0)
+
+  def invalidate_table(self, table_name):
+    """
+    Make all sessions forget any open handle for table_name. Handles
+    held by idle sessions are closed immediately, the ones held by
+    busy sessions when they are looked up again.
+    """
+    self.__cond.acquire()
+    try:
+      self.__table_epochs[table_name] = self.table_epoch(table_name) + 1
+      idle = [ps for v in self.__idle.itervalues() for ps in v]
+    finally:
+      self.__cond.release()
+    for ps in idle:
+      ps.drop_table(table_name)
+
+  def table_lock(self, table_name):
+    """
+    Return the lock that serializes appends to table_name by the
+    sessions of this pool.
+    """
+    self.__cond.acquire()
+    try:
+      return self.__table_locks.setdefault(table_name, threading.Lock())
+    finally:
+      self.__cond.release()
+
+  def stats(self):
+    self.__cond.acquire()
+    try:
+      return dict((k, {'open': n, 'idle': len(self.__idle.get(k, []))})
+                  for k, n in self.__n_open.iteritems())
+    finally:
+      self.__cond.release()
+
+
+class _PinnedIterator(object):
+  """
+  Iterate over ``gen`` while holding a detached session (see
+  :meth:`SessionPool.open_detached`), which is closed as soon as the
+  iteration is over or abandoned.
+  """
+  def __init__(self, ps, gen):
+    self.ps = ps
+    self.gen = gen
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    try:
+      return self.gen.next()
+    except:
+      self.close()
+      raise
+
+  def close(self):
+    if self.ps is not None:
+      ps, self.ps = self.ps, None
+      self.gen.close()
+      ps.close()
+
+  def __del__(self):
+    self.close()
+
+
 class ProxyCore(object):
   """
   A knowledge base implemented as a driver for OMERO.
@@ -80,76 +594,202 @@ class ProxyCore(object):
     'double_array': omero.grid.DoubleArrayColumn,
     'long_array': omero.grid.LongArrayColumn,
     }
-  _CACHE = {}
+
+  rpc_hooks = RPC_HOOKS
+
+  # regular expressions matching the names of tables that are never
+  # modified once filled in, and can thus be served by the table cache
+  IMMUTABLE_TABLES = []
 
   def store_to_cache(self, obj):
-    self.__class__._CACHE[ome_hash(obj.ome_obj)] = obj
+    self.cache[ome_hash(obj.ome_obj)] = obj
 
   def del_from_cache(self, ome_obj):
     try:
-      del self.__class__._CACHE[ome_hash(ome_obj)]
+      del self.cache[ome_hash(ome_obj)]
     except KeyError:
       pass
 
   def get_from_cache(self, ome_obj):
-    return self._CACHE.get(ome_hash(ome_obj))
+    return self.cache.get(ome_hash(ome_obj))
 
   def clear_cache(self):
-    self.__class__._CACHE.clear()
+    self.cache.clear()
 
   def __check_omero_version(self):
-    s = self.connect()
-    conf = s.getConfigService()
-    server_version = conf.getConfigValue('omero.version')
+    with self.session() as s:
+      conf = s.getConfigService()
+      server_version = conf.getConfigValue('omero.version')
     client_version = omero_version
-    self.disconnect()
     if server_version != client_version:
       raise kb.KBError('OMERO client version %s doesn\'t match server version %s' %
                        (client_version, server_version))
 
   def __init__(self, host, user, passwd, group=None, session_keep_tokens=1,
-               check_ome_version=True):
+               check_ome_version=True, pool_size=SESSION_POOL_SIZE,
+               session_max_idle=SESSION_MAX_IDLE, session_max_uses=None,
+               cache=None, table_cache=None,
+               session_acquire_timeout=SESSION_ACQUIRE_TIMEOUT):
+    """
+    Sessions are borrowed from a :class:`SessionPool` holding at most
+    ``pool_size`` sessions per (user, group): a single ProxyCore can
+    thus be shared by several threads. Waiting more than
+    ``session_acquire_timeout`` seconds for a free session raises a
+    KBError. ``session_keep_tokens`` is
+    only kept for backwards compatibility, use ``session_max_uses``
+    to limit the number of operations served by a single session.
+
+    Wrapped objects are kept in ``cache``, which can be any of the
+    caches from :mod:`bl.vl.utils.cache`; by default, an LRU cache
+    holding up to ``CACHE_SIZE`` objects is used. Each proxy has its
+    own cache: ``self.cache.stats`` reports hits, misses and evictions.
+
+    If ``table_cache`` is given (either a
+    :class:`~bl.vl.utils.table_cache.TableDiskCache` or a directory
+    path), reads from tables matching ``IMMUTABLE_TABLES`` through
+    :meth:`get_table_rows` are served from local disk when possible.
+    """
     self.logger = get_logger('bl.vl.kb.drivers.omero.proxy_core')
     self.user = user
     self.passwd = passwd
     self.group_name = group
-    self.client = omero.client(host)
     for h in self.logger.root.handlers:
       self.logger.root.removeHandler(h)
     self.session_keep_tokens = session_keep_tokens
-    self.transaction_tokens = 0
-    self.current_session = None
+    self.cache = LRUCache(CACHE_SIZE) if cache is None else cache
+    if isinstance(table_cache, basestring):
+      table_cache = TableDiskCache(table_cache)
+    self.table_cache = table_cache
+    self.pool = SessionPool(host, max_size=pool_size,
+                            max_idle=session_max_idle,
+                            max_uses=session_max_uses,
+                            acquire_timeout=session_acquire_timeout,
+                            logger=self.logger)
+    self.__local = threading.local()
+    enabled, slow_threshold = parse_rpc_stats_env(os.getenv(RPC_STATS_ENV),
+                                                  self.logger)
+    if enabled and not any(isinstance(h, CallStats) for h in RPC_HOOKS.hooks):
+      enable_rpc_stats(slow_threshold, self.logger)
     if check_ome_version:
         self.__check_omero_version()
 
   def __del__(self):
-    if self.current_session:
-      self.client.closeSession()
+    pool = getattr(self, 'pool', None)
+    if pool:
+      pool.close()
 
   def change_group(self, group_name):
     self.group_name = group_name
-    self.transaction_tokens = 0
-    # self.disconnect()
+
+  def __holds(self):
+    try:
+      return self.__local.holds
+    except AttributeError:
+      self.__local.holds = {}
+      return self.__local.holds
+
+  def __hold(self, key):
+    holds = self.__holds()
+    if key not in holds:
+      ps = self.pool.acquire(self.user, self.passwd, key[1])
+      holds[key] = {'ps': ps, 'depth': 0, 'discard': False, 'pinned': False}
+    h = holds[key]
+    h['depth'] += 1
+    return h
+
+  def __unhold(self, key):
+    holds = self.__holds()
+    h = holds[key]
+    h['depth'] -= 1
+    if h['depth'] <= 0:
+      del holds[key]
+      self.pool.release(h['ps'], discard=h['discard'])
+
+  @contextmanager
+  def session(self):
+    """
+    Borrow an OMERO session from the pool for the duration of a
+    ``with`` block:
+
+    .. code-block:: python
+
+      with kb.session() as s:
+        qs = s.getQueryService()
+
+    Nested blocks (and ``ome_operation`` calls) in the same thread
+    share the same session. Sessions that raise connection errors are
+    closed rather than given back to the pool.
+    """
+    key = (self.user, self.group_name)
+    h = self.__hold(key)
+    try:
+      yield h['ps'].session
+    except SESSION_ERRORS:
+      h['discard'] = True
+      raise
+    finally:
+      self.__unhold(key)
 
   def connect(self):
-    if not self.current_session:
-      self.current_session = self.client.createSession(self.user, self.passwd)
-      self.transaction_tokens = self.session_keep_tokens
-      if self.group_name:
-        a = self.current_session.getAdminService()
-        try:
-          g = a.lookupGroup(self.group_name)
-          self.current_session.setSecurityContext(g)
-        except omero.ApiUsageException, aue:
-          raise ValueError(aue.message)
-    self.transaction_tokens -= 1
-    return self.current_session
+    """
+    Pin a session to the calling thread until :meth:`disconnect` is
+    called. New code should use :meth:`session` instead.
+    """
+    key = (self.user, self.group_name)
+    h = self.__holds().get(key)
+    if h is None or not h['pinned']:
+      h = self.__hold(key)
+      h['pinned'] = True
+    return h['ps'].session
 
   def disconnect(self):
-    if self.transaction_tokens <= 0:
-      self.client.closeSession()
-      self.current_session = None
-      self.transaction_tokens = 0
+    """
+    Close the session pinned by :meth:`connect`, forcing the server to
+    release the memory allocated to it.
+    """
+    key = (self.user, self.group_name)
+    h = self.__holds().get(key)
+    if h is not None and h['pinned']:
+      h['pinned'] = False
+      h['discard'] = True
+      self.__unhold(key)
+
+  def parallel_map(self, f, items, n_workers=None):
+    """
+    Return [f(x) for x in items], running up to n_workers calls at the
+    same time (by default, as many as the session pool can serve).
+    Each call that uses :meth:`session` or :meth:`ome_operation` gets
+    its own pooled session.
+    """
+    items = list(items)
+    if n_workers is None:
+      n_workers = self.pool.max_size
+    n_workers = min(n_workers, len(items))
+    if n_workers <= 1:
+      return map(f, items)
+    results = [None] * len(items)
+    indices = iter(xrange(len(items)))
+    lock = threading.Lock()
+    errors = []
+    def worker():
+      while True:
+        with lock:
+          i = None if errors else next(indices, None)
+        if i is None:
+          return
+        try:
+          results[i] = f(items[i])
+        except Exception, e:
+          with lock:
+            errors.append(e)
+    threads = [threading.Thread(target=worker) for _ in xrange(n_workers)]
+    for th in threads:
+      th.start()
+    for th in threads:
+      th.join()
+    if errors:
+      raise errors[0]
+    return results
 
   def ome_query_params(self, conf):
     params = osp.ParametersI()
@@ -158,33 +798,83 @@ class ProxyCore(object):
     return params
 
   def ome_operation(self, operation, action, *action_args):
-    session = self.connect()
-    # try:
-    try:
-      service = getattr(session, operation)()
-    except AttributeError:
-      raise kb.KBError("%r kb operation not supported" % operation)
-    try:
-      result = getattr(service, action)(*action_args)
-    except AttributeError:
-      raise kb.KBError("%r kb action not supported on operation %r" %
-                       (action, operation))
-    # finally:
-    #   self.disconnect()
+    with self.session() as session:
+      try:
+        service = getattr(session, operation)()
+      except AttributeError:
+        raise kb.KBError("%r kb operation not supported" % operation)
+      try:
+        method = getattr(service, action)
+      except AttributeError:
+        raise kb.KBError("%r kb action not supported on operation %r" %
+                         (action, operation))
+      with self.rpc_hooks.timed('%s.%s' % (operation, action)) as call:
+        result = method(*action_args)
+        if isinstance(result, list):
+          call.size = len(result)
     return result
 
+  def __query_params(self, params):
+    xpars = {}
+    for k,v in (params or {}).iteritems():
+      xpars[k] = ome_wrap(*v) if type(v) == tuple else ome_wrap(v)
+    return self.ome_query_params(xpars)
+
   def find_all_by_query(self, query, params, factory):
-    if params:
-      xpars = {}
-      for k,v in params.iteritems():
-        xpars[k] = ome_wrap(*v) if type(v) == tuple else ome_wrap(v)
-      pars = self.ome_query_params(xpars)
-    else:
-      pars = None
+    pars = self.__query_params(params) if params else None
     result = self.ome_operation("getQueryService", "findAllByQuery",
                                 query, pars)
     return [] if result is None else [factory.wrap(r) for r in result]
 
+  def projection(self, query, params=None, dtype=None):
+    """
+    Run a projection query (e.g., 'select o.label, o.vid from Tube o')
+    and return its rows as plain tuples of unwrapped values, without
+    building omero model objects. If dtype is given, rows are returned
+    as a numpy structured array with that record type.
+    """
+    pars = self.__query_params(params) if params else None
+    result = self.ome_operation("getQueryService", "projection",
+                                query, pars) or []
+    rows = [tuple(ort.unwrap(r)) for r in result]
+    if dtype is not None:
+      return np.array(rows, dtype=dtype)
+    return rows
+
+  def find_all_by_query_iterator(self, query, params, factory,
+                                 page_size=PAGE_SIZE, prefetch=1):
+    """
+    Like :meth:`find_all_by_query`, but fetch results page_size at a
+    time and wrap them only as they are consumed, so that memory usage
+    is bounded by the page size. If prefetch is greater than zero, up
+    to prefetch pages are fetched in the background while the current
+    one is consumed.
+
+    Since pages are retrieved by offset, the query should have an
+    'order by' clause on a unique field (e.g., the object id).
+    """
+    def pages():
+      offset = 0
+      while True:
+        pars = self.__query_params(params)
+        pars.page(offset, page_size)
+        result = self.ome_operation("getQueryService", "findAllByQuery",
+                                    query, pars) or []
+        if result:
+          yield result
+        if len(result) < page_size:
+          return
+        offset += len(result)
+    stream = pages()
+    if prefetch > 0:
+      stream = vlu.prefetch(stream, prefetch)
+    try:
+      for page in stream:
+        for r in page:
+          yield factory.wrap(r)
+    finally:
+      stream.close()
+
   def update_by_example(self, o):
     res = self.ome_operation('getQueryService', 'findByExample', o.ome_obj)
     if not res:
@@ -225,7 +915,7 @@ class ProxyCore(object):
       raise kb.KBError(msg)
     obj.ome_obj = result
     self.store_to_cache(obj)
-    obj.__dump_to_graph__(obj_update)
+    self.dump_to_graph([obj], [obj_update])
     return obj
 
   def save_array(self, array):
@@ -242,12 +932,20 @@ class ProxyCore(object):
       raise kb.KBError(msg)
     if len(result) != len(array):
       raise kb.KBError('bad return array len')
-    for o, v, u in it.izip(array, result, update):
+    for o, v in it.izip(array, result):
       o.ome_obj = v
       self.store_to_cache(o)
-      o.__dump_to_graph__(u)
+    self.dump_to_graph(array, update)
     return array
 
+  def dump_to_graph(self, objs, updates):
+    """
+    Update the dependency graph after objs have been saved; updates[i]
+    is True if objs[i] was already persistent before saving.
+    """
+    for o, u in it.izip(objs, updates):
+      o.__dump_to_graph__(u)
+
   def delete(self, kb_obj):
     """
     Delete a KB object.
@@ -299,13 +997,16 @@ class ProxyCore(object):
 
       ${OMERO_HOME}/bin/omero admin cleanse ${OMERO_DATA_DIR}
     """
-    # try:
-    self.connect()
-    ofiles = self._list_table_copies(table_name)
-    for o in ofiles:
-      self.ome_operation('getUpdateService' , 'deleteObject', o)
-    # finally:
-    #   self.disconnect()
+    self.pool.invalidate_table(table_name)
+    if self.table_cache is not None:
+      self.table_cache.purge(table_name)
+    with self.session() as s:
+      ps = self.__pooled_session(s)
+      if ps is not None:
+        ps.drop_table(table_name)
+      ofiles = self._list_table_copies(table_name)
+      for o in ofiles:
+        self.ome_operation('getUpdateService' , 'deleteObject', o)
 
   def table_exists(self, table_name):
     # try:
@@ -316,18 +1017,16 @@ class ProxyCore(object):
 
   def create_table(self, table_name, fields):
     ofields = [self.OME_TABLE_COLUMN[f[0]](*f[1:]) for f in fields]
-    s = self.connect()
-    # try:
-    r = s.sharedResources()
-    m = r.repositories()
-    i = m.descriptions[0].id.val
-    t = r.newTable(i, table_name)
-    t.initialize(ofields)
-    # finally:
-    #   self.disconnect()
+    with self.session() as s:
+      r = s.sharedResources()
+      m = r.repositories()
+      i = m.descriptions[0].id.val
+      t = r.newTable(i, table_name)
+      t.initialize(ofields)
+    self.pool.invalidate_table(table_name)
     return t
 
-  def _get_table(self, session, table_name):
+  def __open_table(self, session, table_name):
     s = session
     qs = s.getQueryService()
     ofile = qs.findByString('OriginalFile', 'name', table_name, None)
@@ -339,25 +1038,80 @@ class ProxyCore(object):
       raise ValueError("failed to retrieve table '%s'" % table_name)
     return t
 
-  def get_table_rows_iterator(self, table_name, batch_size=100):
-    # TODO add error checking
-    def iter_on_rows(t, n_cols):
+  def __pooled_session(self, session):
+    for h in self.__holds().itervalues():
+      if h['ps'].session is session:
+        return h['ps']
+
+  def _get_table_and_headers(self, session, table_name, ps=None):
+    """
+    Return an open table and a copy of its headers. Tables are cached
+    by name within each pooled session, so that repeated calls do not
+    go through the server again.
+    """
+    ps = ps or self.__pooled_session(session)
+    if ps is None:
+      t = self.__open_table(session, table_name)
+      return t, t.getHeaders()
+    epoch = self.pool.table_epoch(table_name)
+    cached = ps.get_table(table_name, epoch)
+    if cached is None:
+      with self.rpc_hooks.timed('table.open'):
+        t = self.__open_table(ps.session, table_name)
+        cached = t, t.getHeaders()
+      ps.put_table(table_name, t, cached[1], epoch)
+    t, headers = cached
+    if self.rpc_hooks.hooks:
+      t = InstrumentedTable(t, self.rpc_hooks)
+    return t, [copy.copy(o) for o in headers]
+
+  def _get_table(self, session, table_name):
+    return self._get_table_and_headers(session, table_name)[0]
+
+  def get_table_rows_iterator(self, table_name, batch_size=100, prefetch=2,
+                              batches=False, col_names=None):
+    """
+    Iterate over all rows of a table, reading batch_size rows at a
+    time. If prefetch is greater than zero, batches are read by a
+    background thread up to prefetch batches ahead of the consumer,
+    so that network transfers overlap with processing. If batches is
+    True, yield whole numpy arrays of up to batch_size rows instead
+    of single rows.
+
+    The returned iterator holds a session of its own, opened outside
+    the pool, until it is exhausted or discarded: open iterators never
+    prevent other calls from getting a pooled session.
+    """
+    def iter_on_batches(t, col_objs, col_numbers):
       i, N = 0, t.getNumberOfRows()
       while i < N:
         j = min(N, i + batch_size)
-        v = t.read(range(n_cols), i, j)
-        Z = convert_coordinates_to_np(v)
-        for k in range(j - i):
-          yield Z[k]
+        buf = allocate_table_buffer(col_objs, j - i)
+        fill_from_coordinates(buf, t.read(col_numbers, i, j))
+        yield buf
         i = j
-      # self.disconnect()  # this closes the connect() below
-    s = self.connect()
-    t = self._get_table(s, table_name)
-    col_objs = t.getHeaders()
-    return iter_on_rows(t, len(col_objs))
-
-  def __convert_col_names_to_indices(self, table, col_names):
-    col_objs = table.getHeaders()
+    def iter_on_rows(stream):
+      try:
+        for buf in stream:
+          for r in buf:
+            yield r
+      finally:
+        stream.close()
+    ps = self.pool.open_detached(self.user, self.passwd, self.group_name)
+    try:
+      t, col_objs = self._get_table_and_headers(ps.session, table_name, ps)
+      col_objs, col_numbers = self.__get_columns(col_objs, col_names)
+    except:
+      ps.close()
+      raise
+    stream = iter_on_batches(t, col_objs, col_numbers)
+    if prefetch > 0:
+      stream = vlu.prefetch(stream, prefetch)
+    if not batches:
+      stream = iter_on_rows(stream)
+    return _PinnedIterator(ps, stream)
+
+  def __convert_col_names_to_indices(self, col_objs, col_names):
     if col_names:
       col_numbers = []
       by_name = dict(((c.name, i) for i, c in enumerate(col_objs)))
@@ -371,138 +1125,239 @@ class ProxyCore(object):
     return col_numbers
 
   def get_table_rows(self, table_name, selector, col_names=None,
-                     batch_size=BATCH_SIZE):
+                     batch_size=BATCH_SIZE, columnar=False):
     """
     selector can be either a selection or a list of selections. In
     the latter case, it is interpreted as an 'or' condition between
     the list elements.
+
+    The result is allocated once and filled in place batch by batch.
+    If columnar is True, return a dict that maps each column name to
+    a contiguous numpy array instead of a structured array.
     """
-    s = self.connect()
-    # try:
-    t = self._get_table(s, table_name)
-    col_numbers = self.__convert_col_names_to_indices(t, col_names)
-    if selector:
-      res = self.__get_table_rows_selected(t, selector, col_numbers,
-                                           batch_size)
-    else:
-      res = self.__get_table_rows_bulk(t, col_numbers, batch_size)
-    # finally:
-    #   self.disconnect()
+    with self.session() as s:
+      t, col_objs = self._get_table_and_headers(s, table_name)
+      col_objs, col_numbers = self.__get_columns(col_objs, col_names)
+      use_cache = not columnar and self.__is_cacheable(table_name)
+      if use_cache:
+        key = TableDiskCache.make_key(table_name, selector and
+                                      TableSelection.combine(selector),
+                                      col_names)
+        n_rows = t.getNumberOfRows()
+        signature = repr(convert_to_numpy_record_type(col_objs))
+        cached = self.table_cache.get(key, n_rows, signature)
+        if cached is not None:
+          self.logger.debug('%s: read from table cache' % table_name)
+          return cached
+      if selector:
+        res = self.__get_table_rows_selected(t, selector, col_objs,
+                                             col_numbers, batch_size,
+                                             columnar)
+      else:
+        res = self.__get_table_rows_bulk(t, col_objs, col_numbers,
+                                         batch_size, columnar)
+    if use_cache and len(res):
+      self.table_cache.put(key, n_rows, signature, res)
     return res
 
+  def __is_cacheable(self, table_name):
+    return self.table_cache is not None and any(
+      re.match(p, table_name) for p in self.IMMUTABLE_TABLES
+      )
+
   def get_table_rows_by_indices(self, table_name, indices, col_names=None,
-                                batch_size=BATCH_SIZE):
+                                batch_size=BATCH_SIZE, columnar=False):
     """
     indices must be a list of integer values.
     """
-    s = self.connect()
-    # try:
-    t = self._get_table(s, table_name)
-    col_numbers = self.__convert_col_names_to_indices(t, col_names)
-    res = self.__get_table_rows_by_indices(t, indices, col_numbers,
-                                           batch_size)
-    # finally:
-    #   self.disconnect()
+    with self.session() as s:
+      t, col_objs = self._get_table_and_headers(s, table_name)
+      col_objs, col_numbers = self.__get_columns(col_objs, col_names)
+      res = self.__get_table_rows_slice(t, indices, col_objs, col_numbers,
+                                        batch_size, columnar)
     return res
 
-  def __get_table_rows_by_indices(self, table, row_indices, col_numbers,
-                                  batch_size):
-    d = table.slice(col_numbers, row_indices)
-    res = [convert_coordinates_to_np(d)]
-    return np.concatenate(tuple(res)) if res else []
-    
-  def __get_table_rows_selected(self, table, selector, col_numbers, batch_size):
-    res, row_read, max_row = [], 0, table.getNumberOfRows()
-    if isinstance(selector, str):
-      selector = [selector]
-    while row_read < max_row:
-      for s in selector:
-        ids = table.getWhereList(s, {}, row_read, row_read + batch_size, 1)
-        if ids:
-          d = table.slice(col_numbers, ids)
-          res.append(convert_coordinates_to_np(d))
-      row_read += batch_size
-    return np.concatenate(tuple(res)) if res else []
+  def __get_columns(self, col_objs, col_names):
+    col_numbers = self.__convert_col_names_to_indices(col_objs, col_names)
+    return [col_objs[i] for i in col_numbers], col_numbers
+
+  def __finalize(self, buf, n_rows, columnar):
+    if columnar:
+      return buf
+    return buf if n_rows else []
+
+  def __get_table_rows_selected(self, table, selector, col_objs, col_numbers,
+                                batch_size, columnar=False):
+    sel = TableSelection(table, batch_size=batch_size)
+    ids = sel.where(selector)
+    buf = sel.fetch(ids, col_objs, col_numbers, columnar)
+    self.logger.debug('selected %d rows in %d round trips' %
+                      (len(ids), sel.round_trips))
+    return self.__finalize(buf, len(ids), columnar)
 
-  def __get_table_rows_bulk(self, table, col_numbers, batch_size=BATCH_SIZE):
-    res, row_read, max_row = [], 0, table.getNumberOfRows()
+  def __get_table_rows_bulk(self, table, col_objs, col_numbers,
+                            batch_size=BATCH_SIZE, columnar=False):
+    row_read, max_row = 0, table.getNumberOfRows()
+    buf = allocate_table_buffer(col_objs, max_row, columnar)
     while row_read < max_row:
-      d = table.read(col_numbers, row_read, row_read + batch_size)
-      if d:
-        res.append(convert_coordinates_to_np(d))
+      d = table.read(col_numbers, row_read, min(row_read + batch_size, max_row))
+      fill_from_coordinates(buf, d, row_read)
       row_read += batch_size
-    return np.concatenate(tuple(res)) if res else []
+    return self.__finalize(buf, max_row, columnar)
 
-  def __get_table_rows_slice(self, table, row_numbers, col_numbers, batch_size):
-    res, n_rows, row_read = [], len(row_numbers), 0
+  def __get_table_rows_slice(self, table, row_numbers, col_objs, col_numbers,
+                             batch_size, columnar=False):
+    n_rows, row_read = len(row_numbers), 0
+    buf = allocate_table_buffer(col_objs, n_rows, columnar)
     while row_read < n_rows:
-      ids = row_numbers[row_read:(row_read+batch_size)]
-      if ids:
-        d = table.slice(col_numbers, ids)
-        res.append(convert_coordinates_to_np(d))
+      ids = map(int, row_numbers[row_read:(row_read+batch_size)])
+      fill_from_coordinates(buf, table.slice(col_numbers, ids), row_read)
       row_read += batch_size
-    return np.concatenate(tuple(res)) if res else []
+    return self.__finalize(buf, n_rows, columnar)
+
+  def get_table_rows_parallel(self, table_name, col_names=None,
+                              n_workers=None, batch_size=BATCH_SIZE,
+                              columnar=False):
+    """
+    Read all rows of a table, splitting the row range in batch_size
+    chunks that are fetched concurrently by n_workers threads, each
+    one with its own pooled session (by default, as many as the pool
+    can hold). Results are written in place, so the returned array is
+    in table order exactly as with :meth:`get_table_rows`.
+    """
+    if n_workers is None:
+      n_workers = self.pool.max_size
+    with self.session() as s:
+      t, col_objs = self._get_table_and_headers(s, table_name)
+      col_objs, col_numbers = self.__get_columns(col_objs, col_names)
+      max_row = t.getNumberOfRows()
+    buf = allocate_table_buffer(col_objs, max_row, columnar)
+    starts = iter(xrange(0, max_row, batch_size))
+    lock = threading.Lock()
+    errors = []
+    def next_start():
+      with lock:
+        if errors:
+          return None
+        return next(starts, None)
+    def worker():
+      try:
+        with self.session() as s:
+          t = self._get_table(s, table_name)
+          start = next_start()
+          while start is not None:
+            d = t.read(col_numbers, start, min(start + batch_size, max_row))
+            fill_from_coordinates(buf, d, start)
+            start = next_start()
+      except Exception, e:
+        with lock:
+          errors.append(e)
+    n_workers = max(1, min(n_workers, (max_row + batch_size - 1) / batch_size))
+    threads = [threading.Thread(target=worker) for _ in xrange(n_workers)]
+    for th in threads:
+      th.start()
+    for th in threads:
+      th.join()
+    if errors:
+      raise errors[0]
+    self.logger.debug('read %d rows from %s with %d workers' %
+                      (max_row, table_name, n_workers))
+    return self.__finalize(buf, max_row, columnar)
 
   def get_table_slice(self, table_name, row_numbers, col_names=None,
-                      batch_size=BATCH_SIZE):
-    s = self.connect()
-    # try:
-    t = self._get_table(s, table_name)
-    col_numbers = self.__convert_col_names_to_indices(t, col_names)
-    res = self.__get_table_rows_slice(t, row_numbers, col_numbers, batch_size)
-    # finally:
-    #   self.disconnect()
+                      batch_size=BATCH_SIZE, columnar=False):
+    with self.session() as s:
+      t, col_objs = self._get_table_and_headers(s, table_name)
+      col_objs, col_numbers = self.__get_columns(col_objs, col_names)
+      res = self.__get_table_rows_slice(t, row_numbers, col_objs,
+                                        col_numbers, batch_size, columnar)
     return res
   
   def get_table_headers(self, table_name):
     col_objs = None
-    s = self.connect()
-    # try:
-    t = self._get_table(s, table_name)
-    col_objs = t.getHeaders()
-    # finally:
-    #   self.disconnect()
+    with self.session() as s:
+      col_objs = self._get_table_and_headers(s, table_name)[1]
     if col_objs:
       return convert_to_numpy_record_type(col_objs)
 
+  def get_table_descriptions(self, table_name):
+    """
+    Return a dict that maps the name of each column to its description.
+    """
+    with self.session() as s:
+      col_objs = self._get_table_and_headers(s, table_name)[1]
+    return dict((c.name, c.description) for c in col_objs)
+
+  def get_number_of_rows(self, table_name):
+    with self.session() as s:
+      return self._get_table(s, table_name).getNumberOfRows()
+
   def add_table_row(self, table_name, row):
     if hasattr(row, 'dtype'):
-      dtype = row.dtype
-      row = dict([(k, convert_from_numpy(row[k])) for k in dtype.names])
+      return self.add_table_rows(table_name, np.array([row], dtype=row.dtype))
     return self.add_table_rows_from_stream(table_name, iter([row]), 10)
 
   def add_table_rows(self, table_name, rows, batch_size=BATCH_SIZE):
-    dtype = rows.dtype
-    def stream(rows):
-      for r in rows:
-        yield dict([(k, convert_from_numpy(r[k])) for k in dtype.names])
-    return self.add_table_rows_from_stream(table_name, stream(rows),
-                                           batch_size=batch_size)
+    """
+    Append rows to a table. rows can be either a numpy structured
+    array or a dict that maps each column name to an array (as
+    returned by the columnar mode of :meth:`get_table_rows`): in both
+    cases, column values are sliced out directly, without building
+    per-row dicts.
+
+    Return the indices of the new rows. Appends by threads sharing
+    this proxy are serialized, but a table written by more than one
+    process at a time needs a single writer for indices to be right.
+    """
+    if hasattr(rows, 'dtype'):
+      names = rows.dtype.names
+    else:
+      names = rows.keys()
+    n_rows = len(rows[names[0]]) if names else 0
+    for k in names:
+      if len(rows[k]) != n_rows:
+        raise ValueError('column %s has %d rows instead of %d' %
+                         (k, len(rows[k]), n_rows))
+    def batches(col_objs):
+      for o in col_objs:
+        if o.name not in names:
+          raise ValueError('missing values for column %s' % o.name)
+      for start in xrange(0, n_rows, batch_size):
+        for o in col_objs:
+          o.values = np.asarray(rows[o.name][start:start+batch_size]).tolist()
+        yield col_objs
+    return self.__extend_table(table_name, batches)
 
   def add_table_rows_from_stream(self, table_name, stream,
                                  batch_size=BATCH_SIZE):
-    return self.__extend_table(table_name, self.__load_batch, stream,
-                               batch_size=batch_size)
+    """
+    Append rows, read from a stream of dicts, to a table, and return
+    their indices (see the note on concurrent writers in
+    :meth:`add_table_rows`).
+    """
+    def batches(col_objs):
+      return iter(lambda: self.__load_batch(stream, col_objs, batch_size),
+                  None)
+    return self.__extend_table(table_name, batches)
 
-  def __extend_table(self, table_name, batch_loader, records_stream,
-                     batch_size=BATCH_SIZE):
-    s = self.connect()
+  def __extend_table(self, table_name, batches):
+    # batches(col_objs) must yield col_objs filled with the values of
+    # each new batch; headers are only fetched once. Appends from
+    # threads sharing this pool are serialized, and the indices of
+    # each batch are computed from the number of rows right after it
+    # has been added: returned indices are only guaranteed to be
+    # right if no other process writes to the same table at the same
+    # time
     indices = []
-    # try:
-    t = self._get_table(s, table_name)
-    col_objs = t.getHeaders()
-    batch = batch_loader(records_stream, col_objs, batch_size)
-    # First index of the new batch of rows is the number of rows
-    # already stored into the table
-    first_index = t.getNumberOfRows()
-    while batch:
-      t.addData(batch)
-      indices.extend(range(first_index, t.getNumberOfRows()))
-      col_objs = t.getHeaders()
-      batch = batch_loader(records_stream, col_objs, batch_size)
-      first_index = t.getNumberOfRows()
-    # finally:
-    #   self.disconnect()
+    lock = self.pool.table_lock(table_name)
+    with self.session() as s:
+      t, col_objs = self._get_table_and_headers(s, table_name)
+      for batch in batches(col_objs):
+        n = len(batch[0].values)
+        with lock:
+          t.addData(batch)
+          last_index = t.getNumberOfRows()
+        indices.extend(xrange(last_index - n, last_index))
     return indices
 
   def __load_batch(self, records_stream, col_objs, chunk_size):
@@ -517,52 +1372,67 @@ class ProxyCore(object):
     return col_objs
 
   def update_table_row(self, table_name, selector, row):
-    s = self.connect()
-    # try:
-    t = self._get_table(s, table_name)
-    idxs = t.getWhereList(selector, {}, 0, t.getNumberOfRows(), 1)
-    self.logger.debug('\tselector %s results in %s' % (selector, idxs))
-    if not len(idxs) == 1:
-      raise ValueError('selector %s does not yield a single row' % selector)
-    self.logger.debug('\tselected idx: %s' % idxs)
-    data = t.readCoordinates(idxs)
-    self.__update_data_contents(data, row)
-    t.update(data)
-    # finally:
-    #   self.disconnect()
+    if hasattr(row, 'dtype'):
+      row = dict((k, row[k]) for k in row.dtype.names)
+    with self.session() as s:
+      t, col_objs = self._get_table_and_headers(s, table_name)
+      idxs = TableSelection(t).where(selector)
+      self.logger.debug('\tselector %s results in %s' % (selector, idxs))
+      if not len(idxs) == 1:
+        raise ValueError('selector %s does not yield a single row' % selector)
+      self.__update_rows(t, col_objs, idxs, row)
 
-  def update_table_rows(self, table_name, selector, update_items):
-    s = self.connect()
-    # try:
-    t = self._get_table(s, table_name)
-    idxs = t.getWhereList(selector, {}, 0, t.getNumberOfRows(), 1)
-    self.logger.debug('\tselector %s results in %s' % (selector, idxs))
-    if len(idxs) == 0:
-      self.logger.debug('\tno rows to update') 
-      return
-    data = t.readCoordinates(idxs)
-    cols = [c.name for c in data.columns]
-    for x in update_items.keys():
-      if x not in cols:
-        raise ValueError('%s is not a valid field for table %s' % (x, table_name))
-    for dc in data.columns:
-      if dc.name in update_items.keys():
-        for x in range(0, len(dc.values)):
-          self.logger.debug('\tcolumn :%s  -> setting value to %s (old value %s)' % (dc.name,
-                                                                                     update_items[dc.name],
-                                                                                     dc.values[x]))
-          dc.values[x] = update_items[dc.name]
-    self.logger.debug('\trecords have been modified')
-    t.update(data)
-    self.logger.debug('\tdata update complete')
-    # finally:
-    #   self.disconnect()
+  def update_table_rows(self, table_name, selector, update_items,
+                        batch_size=BATCH_SIZE):
+    """
+    Set the columns listed in update_items for all rows that match
+    selector (a selection or a list of selections, see
+    :meth:`get_table_rows`). See :meth:`update_table_rows_by_indices`
+    for the meaning of update_items. Return the number of updated rows.
+    """
+    with self.session() as s:
+      t, col_objs = self._get_table_and_headers(s, table_name)
+      idxs = TableSelection(t).where(selector)
+      self.logger.debug('\tselector %s results in %d rows' %
+                        (selector, len(idxs)))
+      if len(idxs) == 0:
+        self.logger.debug('\tno rows to update')
+        return 0
+      return self.__update_rows(t, col_objs, idxs, update_items, batch_size)
 
-  def __update_data_contents(self, data, row):
-    assert len(data.rowNumbers) == 1
-    if hasattr(row, 'dtype'):
-      dtype = row.dtype
-      row = dict([(k, convert_from_numpy(row[k])) for k in dtype.names])
-    for o in data.columns:
-      if row.has_key(o.name):
-        o.values[0] = row[o.name]
+  def update_table_rows_by_indices(self, table_name, indices, update_items,
+                                   batch_size=BATCH_SIZE):
+    """
+    Set the columns listed in update_items for the rows with the given
+    indices. update_items maps column names to either a single value,
+    assigned to all rows, or an array with one value per row (in the
+    same order as indices). Rows are updated batch_size at a time.
+    Return the number of updated rows.
+    """
+    with self.session() as s:
+      t, col_objs = self._get_table_and_headers(s, table_name)
+      return self.__update_rows(t, col_objs, indices, update_items,
+                                batch_size)
+
+  def __update_rows(self, table, col_objs, indices, update_items,
+                    batch_size=BATCH_SIZE):
+    col_numbers = self.__convert_col_names_to_indices(col_objs,
+                                                      update_items.keys())
+    n_rows = len(indices)
+    values = {}
+    for i in col_numbers:
+      o = col_objs[i]
+      dtype = np.dtype(convert_type(o))
+      # keep native types for strings (no truncation) and booleans
+      # (the 'b' record type is a byte)
+      keep = isinstance(o, (omero.grid.StringColumn, omero.grid.BoolColumn))
+      v = np.asarray(update_items[o.name], dtype=None if keep else dtype.base)
+      values[o.name] = np.broadcast_to(v, (n_rows,) + dtype.shape)
+    for start in xrange(0, n_rows, batch_size):
+      ids = map(int, indices[start:start+batch_size])
+      data = table.slice(col_numbers, ids)
+      for dc in data.columns:
+        dc.values = values[dc.name][start:start+batch_size].tolist()
+      table.update(data)
+    self.logger.debug('\tupdated %d rows' % n_rows)
+    return n_rows
@@ -1,6 +1,8 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
+import threading
+
 import omero.model as om
 import omero.rtypes as ort
 
@@ -31,6 +33,14 @@ WRAPPING = {
   BOOLEAN: ort.rbool,
   }
 
+# enum tables loaded so far, by (host, group, table): shared by all
+# proxies in the process, see OmeroWrapper.map_enums_values
+ENUM_CACHE = {}
+ENUM_CACHE_LOCK = threading.Lock()
+# ids still unknown after reloading their enum table, by (host, group,
+# table): see OmeroWrapper.enum_by_id
+ENUM_MISSES = {}
+
 
 def ome_wrap(v, wtype=None):
   return WRAPPING[wtype](v) if wtype else ort.wrap(v)
@@ -39,6 +49,8 @@ def ome_wrap(v, wtype=None):
 class CoreOmeroWrapper(object):
 
   OME_TABLE = None
+  # name of the field returned by the id property
+  ID_FIELD = 'vid'
 
   @classmethod
   def get_ome_type(klass):
@@ -62,8 +74,7 @@ class CoreOmeroWrapper(object):
       return False
     if not self.is_mapped() or not obj.is_mapped():
       raise KBError("non-persistent objects are not comparable")
-    return ((self.ome_obj.__class__.__name__, self.ome_obj.id._val) ==
-            (obj.ome_obj.__class__.__name__, obj.ome_obj.id._val))
+    return vluo.ome_key(self.ome_obj) == vluo.ome_key(obj.ome_obj)
 
   def __ne__(self, obj):
     return not self.__eq__(obj)
@@ -78,14 +89,12 @@ class CoreOmeroWrapper(object):
     super(CoreOmeroWrapper, self).__setattr__(name, v)
 
   def __getattr__(self, name):
-    if hasattr(self, name):
-      return getattr(self, name)
-    else:
-      raise AttributeError('object %s has no attribute %s' %
-                           (self.__class__.__name__, name))
+    # only called when the normal lookup fails: fields are descriptors
+    raise AttributeError('object %s has no attribute %s' %
+                         (self.__class__.__name__, name))
 
   def __setattr__(self, name, v):
-    if hasattr(self, name):
+    if name in self.__dict__ or hasattr(self.__class__, name):
       super(CoreOmeroWrapper, self).__setattr__(name, v)
     else:
       raise AttributeError('object %s has no attribute %s' %
@@ -154,6 +163,78 @@ class CoreOmeroWrapper(object):
     return self.ome_obj._id._val
 
 
+class Field(object):
+  """
+  Data descriptor for a wrapped field, built by MetaWrapper. How the
+  value is converted is worked out once, from the field's type code,
+  and the omero getter and setter are looked up once per omero class.
+  """
+  def __init__(self, name, tcode):
+    self.name = name
+    self.tcode = tcode
+    self.is_wrapper = isinstance(tcode, type)
+    self.is_enum = self.is_wrapper and tcode.is_enum()
+    self.wrap = WRAPPING.get(tcode)
+    self.is_timestamp = tcode is TIMESTAMP
+    cap = name[0].upper() + name[1:]
+    self.getter_names = ('get' + cap, 'is' + cap)
+    self.setter_name = 'set' + cap
+    self.getters = {}
+    self.setters = {}
+
+  def __get_method(self, cache, ome_obj, names):
+    k = ome_obj.__class__
+    try:
+      return cache[k]
+    except KeyError:
+      for n in names:
+        m = getattr(k, n, None)
+        if m is not None:
+          cache[k] = m
+          return m
+      raise AttributeError('%s has no field %s' % (k.__name__, self.name))
+
+  def __get__(self, obj, klass=None):
+    if obj is None:
+      return self
+    ome_obj = obj.ome_obj
+    v = self.__get_method(self.getters, ome_obj, self.getter_names)(ome_obj)
+    if v is None:
+      return None
+    if self.is_wrapper:
+      proxy = obj.proxy
+      if self.is_enum:
+        e = self.tcode.enum_by_id(proxy, v.id._val)
+        if e is not None:
+          return e
+      cached_v = proxy.get_from_cache(v)
+      if cached_v:
+        return cached_v
+      elif not v.loaded:
+        with proxy.rpc_hooks.timed('lazy-load %s.%s' %
+                                   (obj.__class__.__name__, self.name)):
+          v = proxy.ome_operation('getQueryService', 'find',
+                                  v.__class__.__name__[:-1], v.id.val)
+        if not v:
+          return None
+      return obj.from_omero(self.tcode, v)
+    elif self.wrap is None:
+      return obj.from_omero(self.tcode, v)  # raises for illegal codes
+    elif self.is_timestamp:
+      return vluo.rtime2time(v._val)
+    else:
+      return v._val
+
+  def __set__(self, obj, v):
+    if self.is_wrapper or self.wrap is None:
+      v = obj.to_omero(self.tcode, v)
+    else:
+      v = self.wrap(v)
+    ome_obj = obj.ome_obj
+    self.__get_method(self.setters, ome_obj, (self.setter_name,))(ome_obj, v)
+    obj.__update_constraints__()
+
+
 class MetaWrapper(type):
   
   __KNOWN_OME_KLASSES__ = {}
@@ -187,36 +268,6 @@ class MetaWrapper(type):
           raise ValueError('missing value for required field %s' % k)
     return configurator
 
-  @classmethod
-  def make_setter(klass, base, fields):
-    def setter(self, k, v):
-      if k in fields:
-        setattr(self.ome_obj, k, self.to_omero(fields[k][0], v))
-        self.__update_constraints__()
-      else:
-        base.__setattr__(self, k, v)
-    return setter
-
-  @classmethod
-  def make_getter(klass, base, fields):
-    def getter(self, k):
-      if k in fields:
-        v = getattr(self.ome_obj, k)
-        if v is None:
-          return None
-        if isinstance(fields[k][0], type):
-          cached_v = self.proxy.get_from_cache(v)
-          if cached_v:
-            return cached_v
-          elif not v.loaded:
-            v = self.proxy.ome_operation('getQueryService', 'find',
-                                         v.__class__.__name__[:-1],
-                                         v.id.val)
-        return self.from_omero(fields[k][0], v) if v else None
-      else:
-        return base.__getattr__(self, k)
-    return getter
-
   def __new__(meta, name, bases, attrs):
     if not attrs.has_key('__fields__'):
       attrs['__fields__'] = []
@@ -224,17 +275,16 @@ class MetaWrapper(type):
     attrs['__init__']   = MetaWrapper.make_initializer(bases[0])
     attrs['__config__'] = MetaWrapper.make_configurator(bases[0],
                                                         attrs['__fields__'])
-    attrs['__setattr__'] = MetaWrapper.make_setter(bases[0],
-                                                   attrs['__fields__'])
-    attrs['__getattr__'] = MetaWrapper.make_getter(bases[0],
-                                                   attrs['__fields__'])
     klass = type.__new__(meta, name, bases, attrs)
+    fields = attrs['__fields__']
     if klass.OME_TABLE:
       meta.__KNOWN_OME_KLASSES__[klass.get_ome_type()] = klass
-      fields = attrs['__fields__']
       for k in fields:
         if fields[k][0] == SELF_TYPE:
           fields[k] = (klass,) + fields[k][1:]
+    for k in fields:
+      if k not in attrs:
+        setattr(klass, k, Field(k, fields[k][0]))
     if klass.is_enum():
       enums = []
       for l in klass.__enums__:
@@ -282,11 +332,65 @@ class OmeroWrapper(CoreOmeroWrapper):
     return len(klass.__enums__) > 0
 
   @classmethod
-  def map_enums_values(klass, proxy):
+  def map_enums_values(klass, proxy, refresh=False):
+    """
+    Map the enum values of klass to the corresponding objects on the
+    server proxy is connected to. The enum table is loaded with a
+    single query the first time it's needed and kept in a process-wide
+    cache, by server and group; if refresh is True, it's loaded again.
+    The query runs without holding the cache lock, so that a slow
+    server does not block enum reads in other threads.
+    """
     assert klass.is_enum()
-    for o in klass.__enums__:
-      if not o.is_mapped():
-        proxy.update_by_example(o)
+    key = (proxy.pool.host, proxy.group_name, klass.OME_TABLE)
+    if not refresh and klass.__dict__.get('__enums_key__') == key:
+      return
+    values = None if refresh else ENUM_CACHE.get(key)
+    if values is None:
+      res = proxy.ome_operation('getQueryService', 'findAllByQuery',
+                                'from %s o' % klass.OME_TABLE, None)
+      values = dict((o.value._val, o) for o in res or [])
+    with ENUM_CACHE_LOCK:
+      if refresh:
+        ENUM_CACHE[key] = values
+        ENUM_MISSES.pop(key, None)
+      else:
+        values = ENUM_CACHE.setdefault(key, values)
+      for o in klass.__enums__:
+        try:
+          o.ome_obj = values[o.enum_label()]
+        except KeyError:
+          raise ValueError('%s.%s is not defined on the server' %
+                           (klass.__name__, o.enum_label()))
+        o.proxy = proxy
+      klass.__enums_key__ = key
+
+  @classmethod
+  def enum_by_id(klass, proxy, oid):
+    """
+    Return the enum value of klass whose omero id is oid, or None.
+    If oid is not found, the enum table is reloaded once (e.g., it
+    could have been recreated on the server since it was cached).
+    """
+    def lookup(refresh=False):
+      try:
+        klass.map_enums_values(proxy, refresh)
+      except ValueError, e:
+        proxy.logger.warning('cannot map %s values: %s' % (klass.__name__, e))
+        return None
+      for o in klass.__enums__:
+        if o.ome_obj.id._val == oid:
+          return o
+    o = lookup()
+    if o is None:
+      key = (proxy.pool.host, proxy.group_name, klass.OME_TABLE)
+      if oid in ENUM_MISSES.get(key, ()):
+        return None
+      o = lookup(refresh=True)
+      if o is None:
+        with ENUM_CACHE_LOCK:
+          ENUM_MISSES.setdefault(key, set()).add(oid)
+    return o
 
   def __preprocess_conf__(self, conf):
     return conf
@@ -310,12 +414,27 @@ class OmeroWrapper(CoreOmeroWrapper):
           source = getattr(self.action.target, relationships[type(self.action.target)])
           self.proxy.dt.create_edge(self.action, source, self)
 
-  def __cleanup__(self):
+  def __graph_cleanup__(self):
+    """
+    Return the (nodes, edges, actions) to be removed from the dependency
+    graph when this object is deleted: edges are (source, dest) pairs,
+    actions are those whose edges must all be removed.
+    """
     if hasattr(self, 'action'):
-      self.proxy.dt.destroy_node(self)
       # also delete the edge that connects the object to its source
       if hasattr(self.action, 'target'):
-        self.proxy.dt.destroy_edge(self, self.action.target)
+        return [self], [(self, self.action.target)], []
+      return [self], [], []
+    return [], [], []
+
+  def __cleanup__(self):
+    nodes, edges, actions = self.__graph_cleanup__()
+    for o in nodes:
+      self.proxy.dt.destroy_node(o)
+    for src, dest in edges:
+      self.proxy.dt.destroy_edge(src, dest)
+    for a in actions:
+      self.proxy.dt.destroy_edges(a)
 
   def configure(self, conf):
     self.__config__(self.ome_obj, conf)
@@ -63,6 +63,29 @@ def build_event(event_cls, event_conf):
             data['new_dest_node'] = ome_hash(conf['bl_dest_obj'].ome_obj)
         return data
 
+    def get_batch_creation_data(conf):
+        edges = []
+        for act, src, dest in conf['edges']:
+            data = get_edge_creation_data({'bl_act': act, 'bl_src_obj': src,
+                                           'bl_dest_obj': dest})
+            del data['action']
+            edges.append(data)
+        return {
+            'action': 'BATCH_CREATE',
+            'nodes': [get_node_creation_data({'bl_obj': o})['details']
+                      for o in conf['bl_objs']],
+            'edges': edges
+        }
+
+    def get_batch_deletion_data(conf):
+        return {
+            'action': 'BATCH_DELETE',
+            'nodes': [ome_hash(o.ome_obj) for o in conf['bl_objs']],
+            'edges': [build_edge_id(ome_hash(src.ome_obj), ome_hash(dest.ome_obj))
+                      for src, dest in conf['edges']],
+            'actions': [ome_hash(a.ome_obj) for a in conf['bl_acts']]
+        }
+
     get_data_map = {
         NodeCreationEvent: get_node_creation_data,
         EdgeCreationEvent: get_edge_creation_data,
@@ -70,6 +93,8 @@ def build_event(event_cls, event_conf):
         EdgeDeletionEvent: get_edge_deletion_data,
         EdgesDeletionEvent: get_edges_deletion_data,
         EdgeUpdateEvent: get_edge_update_data,
+        BatchCreationEvent: get_batch_creation_data,
+        BatchDeletionEvent: get_batch_deletion_data,
     }
 
     event = event_cls(get_data_map[event_cls](event_conf))
@@ -85,6 +110,8 @@ def decode_event(routing_key, msg_body):
         'graph.edge.delete': EdgeDeletionEvent,
         'graph.edges.delete': EdgesDeletionEvent,
         'graph.edge.update': EdgeUpdateEvent,
+        'graph.batch.create': BatchCreationEvent,
+        'graph.batch.delete': BatchDeletionEvent,
     }
     decode_key = '.'.join(routing_key.split('.')[-3:])
     event = decode_map[decode_key](json.loads(msg_body, object_hook=decode_dict))
@@ -217,3 +244,53 @@ class EdgeUpdateEvent(BasicEvent):
             }
         )
         super(EdgeUpdateEvent, self).validate(schema)
+
+
+class BatchCreationEvent(BasicEvent):
+
+    def __init__(self, data):
+        super(BatchCreationEvent, self).__init__('graph.batch.create', data)
+
+    def validate(self):
+        schema = Schema(
+            {
+                'action': 'BATCH_CREATE',
+                'nodes': [
+                    {
+                        'obj_class': str,
+                        'obj_id': str,
+                        'obj_hash': int
+                    }
+                ],
+                'edges': [
+                    {
+                        'details': {
+                            'edge_id': str,
+                            'act_type': str,
+                            'act_id': str,
+                            'act_hash': int
+                        },
+                        'source_node': int,
+                        'dest_node': int
+                    }
+                ]
+            }
+        )
+        super(BatchCreationEvent, self).validate(schema)
+
+
+class BatchDeletionEvent(BasicEvent):
+
+    def __init__(self, data):
+        super(BatchDeletionEvent, self).__init__('graph.batch.delete', data)
+
+    def validate(self):
+        schema = Schema(
+            {
+                'action': 'BATCH_DELETE',
+                'nodes': [int],
+                'edges': [str],
+                'actions': [int]
+            }
+        )
+        super(BatchDeletionEvent, self).validate(schema)
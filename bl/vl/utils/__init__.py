@@ -10,7 +10,7 @@ Generic utilities used by other modules.
 
 # DEV NOTE: this module must NOT use other OMERO.biobank modules.
 
-import uuid, hashlib, logging
+import uuid, hashlib, logging, threading, sys, Queue
 
 
 DEFAULT_BUFSIZE = 16777216
@@ -85,3 +85,48 @@ def decode_dict(data):
             val = decode_dict(val)
         decoded[key] = val
     return decoded
+
+
+def prefetch(iterable, depth=2):
+  """
+  Iterate over iterable in a background thread, keeping up to depth
+  items ready ahead of the consumer, so that producing the next item
+  (e.g., fetching data over the network) overlaps with processing the
+  current one. Exceptions raised by the producer are re-raised in the
+  consumer. Closing the returned generator (or letting it go out of
+  scope) stops the producer thread.
+  """
+  q = Queue.Queue(max(1, depth))
+  stop = threading.Event()
+  def put(item):
+    while not stop.is_set():
+      try:
+        q.put(item, True, 0.1)
+        return True
+      except Queue.Full:
+        pass
+    return False
+  def produce():
+    try:
+      for x in iterable:
+        if not put((True, x)):
+          return
+    except Exception:
+      put((False, sys.exc_info()))
+    else:
+      put((False, None))
+  producer = threading.Thread(target=produce)
+  producer.daemon = True
+  producer.start()
+  try:
+    while True:
+      ok, x = q.get()
+      if ok:
+        yield x
+      elif x is None:
+        return
+      else:
+        raise x[0], x[1], x[2]
+  finally:
+    stop.set()
+    producer.join()
@@ -0,0 +1,178 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Object caches
+=============
+
+Dict-like, thread-safe caches with bounded memory usage and hit/miss
+statistics. All caches share the same interface, so they can be
+plugged into any component that needs to keep objects around by key.
+"""
+
+# DEV NOTE: this module must NOT use other OMERO.biobank modules.
+
+import threading, weakref
+from collections import OrderedDict
+
+
+class CacheStats(object):
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def as_dict(self):
+    return {'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions}
+
+  def __repr__(self):
+    return '%s(hits=%d, misses=%d, evictions=%d)' % (
+      self.__class__.__name__, self.hits, self.misses, self.evictions
+      )
+
+
+class BaseCache(object):
+  """
+  Base class for all caches.
+
+  Subclasses must implement ``_get``, ``_set``, ``_del``, ``_clear``
+  and ``__len__``; locking and statistics are handled here.
+  """
+  def __init__(self):
+    self.stats = CacheStats()
+    self._lock = threading.RLock()
+
+  def get(self, key, default=None):
+    with self._lock:
+      v = self._get(key)
+      if v is None:
+        self.stats.misses += 1
+        return default
+      self.stats.hits += 1
+      return v
+
+  def __getitem__(self, key):
+    v = self.get(key)
+    if v is None:
+      raise KeyError(key)
+    return v
+
+  def __setitem__(self, key, v):
+    with self._lock:
+      self._set(key, v)
+
+  def __delitem__(self, key):
+    with self._lock:
+      self._del(key)
+
+  def __contains__(self, key):
+    with self._lock:
+      return self._get(key) is not None
+
+  def pop(self, key, default=None):
+    with self._lock:
+      v = self._get(key)
+      if v is None:
+        return default
+      self._del(key)
+      return v
+
+  def clear(self):
+    with self._lock:
+      self._clear()
+
+
+class LRUCache(BaseCache):
+  """
+  Keep at most ``max_size`` objects, evicting the least recently used
+  one when the cache is full. If ``max_size`` is None, the cache grows
+  without bounds.
+
+  If provided, ``on_evict(key, value)`` is called for each object
+  evicted to make room for new ones.
+  """
+  def __init__(self, max_size, on_evict=None):
+    super(LRUCache, self).__init__()
+    if max_size is not None and max_size < 1:
+      raise ValueError('max_size must be a positive integer or None')
+    self.max_size = max_size
+    self.on_evict = on_evict
+    self.__data = OrderedDict()
+
+  def _get(self, key):
+    try:
+      v = self.__data.pop(key)
+    except KeyError:
+      return None
+    self.__data[key] = v
+    return v
+
+  def _set(self, key, v):
+    self.__data.pop(key, None)
+    self.__data[key] = v
+    if self.max_size is not None:
+      while len(self.__data) > self.max_size:
+        k, old = self.__data.popitem(last=False)
+        self.stats.evictions += 1
+        if self.on_evict:
+          self.on_evict(k, old)
+
+  def _del(self, key):
+    del self.__data[key]
+
+  def _clear(self):
+    self.__data.clear()
+
+  def __len__(self):
+    return len(self.__data)
+
+  def values(self):
+    with self._lock:
+      return self.__data.values()
+
+
+class WeakCache(BaseCache):
+  """
+  Keep objects only as long as they are referenced somewhere else.
+  An object is counted as evicted when it is garbage collected.
+  """
+  def __init__(self):
+    super(WeakCache, self).__init__()
+    self.__data = {}
+
+  def __make_callback(self, key):
+    self_ref = weakref.ref(self)
+    def callback(ref):
+      cache = self_ref()
+      if cache is None:
+        return
+      with cache._lock:
+        if cache.__data.get(key) is ref:
+          del cache.__data[key]
+          cache.stats.evictions += 1
+    return callback
+
+  def _get(self, key):
+    ref = self.__data.get(key)
+    return None if ref is None else ref()
+
+  def _set(self, key, v):
+    self.__data[key] = weakref.ref(v, self.__make_callback(key))
+
+  def _del(self, key):
+    del self.__data[key]
+
+  def _clear(self):
+    self.__data.clear()
+
+  def __len__(self):
+    return len(self.__data)
+
+  def values(self):
+    with self._lock:
+      return [v for v in (r() for r in self.__data.values()) if v is not None]
@@ -0,0 +1,131 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Call instrumentation
+====================
+
+A registry of hooks that are notified of remote calls, with their
+name, duration and payload size. :class:`CallStats` is a hook that
+aggregates per-call statistics, logs slow calls and can print a
+summary when the process exits:
+
+.. code-block:: python
+
+  from bl.vl.utils.instrumentation import HookRegistry, CallStats
+
+  hooks = HookRegistry()
+  stats = CallStats(slow_threshold=1.0)
+  hooks.register(stats)
+  stats.report_at_exit()
+  with hooks.timed('table.read') as call:
+    data = table.read(cols, start, stop)
+    call.size = compute_size(data)
+"""
+
+# DEV NOTE: this module must NOT use other OMERO.biobank modules.
+
+import sys, time, threading, atexit, logging
+from contextlib import contextmanager
+
+
+class Call(object):
+
+  __slots__ = ('name', 'size')
+
+  def __init__(self, name):
+    self.name = name
+    self.size = 0
+
+
+class HookRegistry(object):
+  """
+  Hooks are callables with signature ``hook(name, elapsed, size)``.
+  When no hook is registered, timing is skipped altogether.
+  """
+  def __init__(self):
+    self.hooks = []
+    self.__lock = threading.Lock()
+
+  def register(self, hook):
+    with self.__lock:
+      self.hooks = self.hooks + [hook]
+
+  def unregister(self, hook):
+    with self.__lock:
+      self.hooks = [h for h in self.hooks if h is not hook]
+
+  def notify(self, name, elapsed, size=0):
+    for h in self.hooks:
+      h(name, elapsed, size)
+
+  @contextmanager
+  def timed(self, name):
+    """
+    Time the body of a ``with`` block; the yielded object's ``size``
+    attribute can be set to report the payload size. Calls that raise
+    an exception are reported as well.
+    """
+    call = Call(name)
+    if not self.hooks:
+      yield call
+      return
+    start = time.time()
+    try:
+      yield call
+    finally:
+      self.notify(call.name, time.time() - start, call.size)
+
+
+class CallStats(object):
+  """
+  Aggregate count, total and maximum latency and total payload size
+  by call name. Calls lasting at least ``slow_threshold`` seconds are
+  logged as warnings.
+  """
+  def __init__(self, slow_threshold=None, logger=None):
+    self.slow_threshold = slow_threshold
+    self.logger = logger or logging.getLogger('bl.vl.utils.instrumentation')
+    self.__lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self.__lock:
+      self.stats = {}
+
+  def __call__(self, name, elapsed, size=0):
+    with self.__lock:
+      s = self.stats.get(name)
+      if s is None:
+        s = self.stats[name] = [0, 0.0, 0.0, 0]
+      s[0] += 1
+      s[1] += elapsed
+      s[2] = max(s[2], elapsed)
+      s[3] += size
+    if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+      self.logger.warning('slow call: %s took %.3f s (size: %d)' %
+                          (name, elapsed, size))
+
+  def as_dict(self):
+    with self.__lock:
+      return dict((k, {'count': v[0], 'time': v[1], 'max_time': v[2],
+                       'size': v[3]}) for k, v in self.stats.iteritems())
+
+  def summary(self):
+    """
+    Return a table of all calls, sorted by total time.
+    """
+    stats = sorted(self.as_dict().iteritems(), key=lambda x: -x[1]['time'])
+    lines = ['%-50s %10s %12s %12s %14s' %
+             ('call', 'count', 'time (s)', 'max (s)', 'size')]
+    for name, s in stats:
+      lines.append('%-50s %10d %12.3f %12.3f %14d' % (
+        name, s['count'], s['time'], s['max_time'], s['size']
+        ))
+    return '\n'.join(lines)
+
+  def report_at_exit(self, stream=sys.stderr):
+    def report():
+      if self.stats:
+        stream.write('%s\n' % self.summary())
+    atexit.register(report)
@@ -30,3 +30,20 @@ def index_intersect(a1, a2):
   b.sort(order='item')
   mask = b[:-1]['item'] == b[1:]['item']
   return b[1:][mask]['idx'] - a2.size, b[mask]['idx']
+
+
+def contiguous_runs(a):
+  """
+  Split a sorted array of integers into runs of consecutive values.
+
+  Return a tuple of two arrays with the start (inclusive) and stop
+  (exclusive) values of each run, e.g., [1, 2, 3, 7, 9, 10] yields
+  ([1, 7, 9], [4, 8, 11]).
+  """
+  a = np.asarray(a, dtype=np.int64)
+  if a.size == 0:
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+  breaks = np.flatnonzero(np.diff(a) != 1) + 1
+  starts = a[np.r_[0, breaks]]
+  stops = a[np.r_[breaks - 1, a.size - 1]] + 1
+  return starts, stops
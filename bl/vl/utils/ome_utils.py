@@ -28,15 +28,39 @@ def rtime2time(t):
   return omero.rtypes.unwrap(t)/1000.0
 
 
+_BASE_NAMES = {}
+
+
+def ome_base_name(klass):
+  """
+  Return the (interned) name of the class right before
+  omero.model.IObject in the mro of klass, which is how objects are
+  identified regardless of their concrete class. The result is
+  memoized per class.
+  """
+  try:
+    return _BASE_NAMES[klass]
+  except KeyError:
+    base = klass
+    for i, k in enumerate(klass.__mro__):
+      if k is omero.model.IObject:
+        try:
+          base = klass.__mro__[i-1]
+        except IndexError:
+          pass
+    name = _BASE_NAMES[klass] = intern(base.__name__)
+    return name
+
+
+def ome_key(ome_obj):
+  """
+  Return the identity key of ome_obj, a (base class name, id) tuple.
+  """
+  return ome_base_name(ome_obj.__class__), ome_obj.id._val
+
+
 def ome_hash(ome_obj):
-  klass = ome_obj.__class__
-  for i, k in enumerate(ome_obj.__class__.__mro__):
-    if k is omero.model.IObject:
-      try:
-        klass = ome_obj.__class__.__mro__[i-1]
-      except IndexError:
-        pass
-  return hash((klass.__name__, ome_obj.id._val))
+  return hash(ome_key(ome_obj))
 
 
 def _ome_env_variable(name):
@@ -0,0 +1,157 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Local table cache
+=================
+
+A directory-based cache for the contents of tables that never change
+once written, such as marker set definitions. Each entry is a numpy
+structured array saved in ``.npy`` format, plus a small json file
+with its metadata; arrays are memory-mapped (copy-on-write) when read
+back, so large tables are paged in lazily.
+
+An entry is only valid for the number of rows and the header
+signature it was stored with: if the table grows or its columns
+change, the entry is discarded. When the total size of the cache goes
+over ``max_bytes``, least recently used entries are evicted.
+"""
+
+# DEV NOTE: this module must NOT use other OMERO.biobank modules.
+
+import os, json, time, hashlib, tempfile, fnmatch
+
+import numpy as np
+
+
+DEFAULT_MAX_BYTES = 2 * 1024**3
+DATA_EXT = '.npy'
+META_EXT = '.json'
+
+
+class TableDiskCache(object):
+
+  def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+    self.root = root
+    self.max_bytes = max_bytes
+    if not os.path.isdir(root):
+      os.makedirs(root)
+
+  @staticmethod
+  def make_key(table_name, selector=None, col_names=None):
+    """
+    Build the key of the entry holding the rows of table_name that
+    match selector, restricted to col_names.
+    """
+    return json.dumps([table_name, selector, list(col_names or [])])
+
+  def __base(self, key):
+    return os.path.join(self.root, hashlib.sha1(key).hexdigest())
+
+  def __read_meta(self, base):
+    try:
+      with open(base + META_EXT) as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return None
+
+  def __write_meta(self, base, meta):
+    fd, tmp = tempfile.mkstemp(dir=self.root)
+    with os.fdopen(fd, 'w') as f:
+      json.dump(meta, f)
+    os.rename(tmp, base + META_EXT)
+
+  def __remove(self, base):
+    for ext in META_EXT, DATA_EXT:
+      try:
+        os.remove(base + ext)
+      except OSError:
+        pass
+
+  def get(self, key, n_rows, signature):
+    """
+    Return the array stored for key, or None if there is no valid
+    entry for the given number of rows and header signature.
+    """
+    base = self.__base(key)
+    meta = self.__read_meta(base)
+    if meta is None:
+      return None
+    if meta['n_rows'] != n_rows or meta['signature'] != signature:
+      self.__remove(base)
+      return None
+    try:
+      a = np.load(base + DATA_EXT, mmap_mode='c')
+    except (IOError, ValueError):
+      self.__remove(base)
+      return None
+    meta['last_access'] = time.time()
+    self.__write_meta(base, meta)
+    return a
+
+  def put(self, key, n_rows, signature, a):
+    """
+    Store array a for key, then evict old entries if needed.
+    """
+    base = self.__base(key)
+    fd, tmp = tempfile.mkstemp(dir=self.root)
+    with os.fdopen(fd, 'wb') as f:
+      np.save(f, a)
+    os.rename(tmp, base + DATA_EXT)
+    now = time.time()
+    self.__write_meta(base, {
+      'key': key, 'table_name': json.loads(key)[0], 'n_rows': n_rows,
+      'signature': signature, 'size': os.path.getsize(base + DATA_EXT),
+      'created': now, 'last_access': now,
+      })
+    self.evict()
+
+  def entries(self):
+    """
+    Return the metadata of all entries, least recently used first.
+    """
+    entries = []
+    for fn in os.listdir(self.root):
+      if fn.endswith(META_EXT):
+        meta = self.__read_meta(os.path.join(self.root, fn[:-len(META_EXT)]))
+        if meta is not None:
+          entries.append(meta)
+    entries.sort(key=lambda m: m['last_access'])
+    return entries
+
+  def size(self):
+    return sum(m['size'] for m in self.entries())
+
+  def purge(self, table_pattern=None):
+    """
+    Remove all entries for tables whose name matches table_pattern
+    (a shell-style wildcard), or all entries if it's None. Return
+    the number of removed entries.
+    """
+    count = 0
+    for m in self.entries():
+      if table_pattern is None or fnmatch.fnmatch(m['table_name'],
+                                                  table_pattern):
+        self.__remove(self.__base(m['key']))
+        count += 1
+    return count
+
+  def evict(self, max_bytes=None):
+    """
+    Remove least recently used entries until the cache fits into
+    max_bytes (by default, the cache's own limit). Return the number
+    of removed entries.
+    """
+    if max_bytes is None:
+      max_bytes = self.max_bytes
+    if max_bytes is None:
+      return 0
+    entries = self.entries()
+    size, count = sum(m['size'] for m in entries), 0
+    for m in entries:
+      if size <= max_bytes:
+        break
+      self.__remove(self.__base(m['key']))
+      size -= m['size']
+      count += 1
+    return count
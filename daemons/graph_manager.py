@@ -25,6 +25,8 @@ class GraphManagerDaemon(object):
             'EDGE_DELETE': self.delete_edge,
             'EDGES_DELETE': self.delete_edges,
             'EDGE_UPDATE': self.update_edge,
+            'BATCH_CREATE': self.create_batch,
+            'BATCH_DELETE': self.delete_batch,
         }
 
         if not log_file:
@@ -97,6 +99,10 @@ class GraphManagerDaemon(object):
                                           msg['dest_node'])
         self.logger.info('Saved new edge, assigned ID is %d' % eid)
 
+    def create_batch(self, msg):
+        n = self.graph_driver.save_batch(msg['nodes'], msg['edges'])
+        self.logger.info('Batch creation completed, %d items saved' % n)
+
     def delete_node(self, msg):
         self.graph_driver.delete_node(msg['target'])
         self.logger.info('Node successfully deleted')
@@ -109,6 +115,13 @@ class GraphManagerDaemon(object):
         self.graph_driver.delete_edges(msg['target'])
         self.logger.info('Edges successfully deleted')
 
+    def delete_batch(self, msg):
+        missing = self.graph_driver.delete_batch(msg['nodes'], msg['edges'],
+                                                 msg['actions'])
+        if missing:
+            self.logger.warning('%d items of batch deletion were already missing' % missing)
+        self.logger.info('Batch deletion completed')
+
     def update_edge(self, msg):
         raise NotImplementedError()
 
@@ -0,0 +1,92 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+"""
+Wrapper field access micro-benchmark
+====================================
+
+Times reads and writes of wrapped fields, compared to direct access
+to the underlying omero objects. Scalar fields are measured on
+locally built objects, so no server is needed; if ``--host`` is
+given, reference and enum fields are also measured on individuals
+read from the KB.
+
+Run it on two different revisions to compare them::
+
+  python wrapper_fields_benchmark.py -n 100000
+"""
+
+import argparse, timeit
+
+import omero.rtypes as ort
+
+from bl.vl.kb import KnowledgeBase as KB
+from bl.vl.kb.drivers.omero.action import Study
+
+
+def make_parser():
+  parser = argparse.ArgumentParser(description="wrapper field access timings")
+  parser.add_argument('-n', '--n-objects', type=int, default=10000,
+                      help='number of objects to build/read')
+  parser.add_argument('-r', '--repeat', type=int, default=5,
+                      help='timing repetitions, the best one is reported')
+  parser.add_argument('-H', '--host', type=str, help='omero host')
+  parser.add_argument('-U', '--user', type=str, default='root',
+                      help='omero user')
+  parser.add_argument('-P', '--passwd', type=str, help='omero password')
+  return parser
+
+
+def report(label, f, n, repeat):
+  best = min(timeit.repeat(f, number=1, repeat=repeat))
+  print '%-40s %10.1f ns/access' % (label, 1e9 * best / n)
+
+
+def bench_local(n, repeat):
+  objs = []
+  for i in xrange(n):
+    s = Study(ome_obj=None, proxy=None)
+    s.ome_obj.label = ort.rstring('study-%d' % i)
+    s.ome_obj.description = ort.rstring('description')
+    objs.append(s)
+  def raw_read():
+    for s in objs:
+      ort.unwrap(s.ome_obj.label)
+  def read():
+    for s in objs:
+      s.label
+  def write():
+    for s in objs:
+      s.description = 'foo'
+  report('omero object read (baseline)', raw_read, n, repeat)
+  report('Study.label read', read, n, repeat)
+  report('Study.description write', write, n, repeat)
+
+
+def bench_remote(kb, n, repeat):
+  inds = kb.get_objects(kb.Individual)[:n]
+  if not inds:
+    print 'no individuals in the KB, skipping remote benchmark'
+    return
+  kb.prefetch(inds, ['action', 'father', 'mother'])
+  def read_enum():
+    for i in inds:
+      i.gender
+  def read_ref():
+    for i in inds:
+      i.action
+  report('Individual.gender read', read_enum, len(inds), repeat)
+  report('Individual.action read', read_ref, len(inds), repeat)
+
+
+def main():
+  parser = make_parser()
+  args = parser.parse_args()
+  bench_local(args.n_objects, args.repeat)
+  if args.host:
+    kb = KB(driver='omero')(args.host, args.user, args.passwd)
+    bench_remote(kb, args.n_objects, args.repeat)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest
+import numpy as np
+
+import bl.vl.genotype.codec as codec
+from bl.vl.genotype.algo import project_to_discrete_genotype
+
+
+def make_data(n):
+  probs = 0.5 * np.random.random((2, n)).astype(np.float32)
+  confs = np.random.random(n).astype(np.float32)
+  return probs, confs
+
+
+class TestPack(unittest.TestCase):
+
+  def test_pack(self):
+    for dtype in np.dtype('<u1'), np.dtype('<u2'):
+      for n in 1, 7, 8, 33:
+        a = np.random.randint(0, np.iinfo(dtype).max, n).astype(dtype)
+        words = codec.pack(a, dtype)
+        self.assertEqual(words.dtype, codec.WORD)
+        self.assertEqual(len(words), codec.n_words(n, 8 * dtype.itemsize))
+        self.assertTrue(np.array_equal(codec.unpack(words, dtype, n), a))
+
+  def test_pack_calls(self):
+    for n in 1, 4, 5, 63, 64, 65:
+      calls = np.random.randint(0, 4, n)
+      words = codec.pack_calls(calls)
+      self.assertEqual(len(words), codec.n_words(n, codec.CALL_BITS))
+      self.assertTrue(np.array_equal(codec.unpack_calls(words, n), calls))
+      rows = np.array([words, words])
+      self.assertTrue(np.array_equal(codec.unpack_calls(rows, n),
+                                     [calls, calls]))
+
+
+class TestEncoding(unittest.TestCase):
+
+  def test_float32(self):
+    probs, confs = make_data(10)
+    row = codec.encode(probs, confs, codec.FLOAT32)
+    self.assertFalse('calls' in row)
+    p, c = codec.decode(row['probs'], row['confidence'], codec.FLOAT32, 10)
+    self.assertTrue(np.array_equal(p, probs))
+    self.assertTrue(np.array_equal(c, confs))
+
+  def test_fixed_point(self):
+    n = 37
+    probs, confs = make_data(n)
+    probs[:, 3] = np.nan
+    for encoding, tol in (codec.UINT16, 1e-4), (codec.UINT8, 1e-2):
+      row = codec.encode(probs, confs, encoding)
+      p, c = codec.decode(row['probs'], row['confidence'], encoding, n)
+      self.assertEqual(p.shape, (2, n))
+      self.assertEqual(p.dtype, np.float32)
+      self.assertTrue(np.isnan(p[:, 3]).all())
+      self.assertEqual(np.isnan(p).sum(), 2)
+      self.assertTrue(np.nanmax(np.abs(p - probs)) < tol)
+      self.assertTrue(np.abs(c - confs).max() < tol)
+      calls = codec.unpack_calls(row['calls'], n)
+      self.assertTrue(np.array_equal(calls,
+                                     project_to_discrete_genotype(probs)))
+      rows = np.array([row['probs']] * 3), np.array([row['confidence']] * 3)
+      p3, c3 = codec.decode(rows[0], rows[1], encoding, n)
+      self.assertEqual(p3.shape, (3, 2, n))
+      self.assertEqual(c3.shape, (3, n))
+
+  def test_bad_encoding(self):
+    probs, confs = make_data(4)
+    self.assertRaises(ValueError, codec.encode, probs, confs, 'int4')
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestPack('test_pack'))
+  suite.addTest(TestPack('test_pack_calls'))
+  suite.addTest(TestEncoding('test_float32'))
+  suite.addTest(TestEncoding('test_fixed_point'))
+  suite.addTest(TestEncoding('test_bad_encoding'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
@@ -13,6 +13,7 @@ from bl.core.io import MessageStreamWriter
 import bl.core.gt.messages.SnpCall as SnpCall
 
 import bl.vl.genotype.io as gio
+import bl.vl.genotype.algo as algo
 
 
 OME_HOST = os.getenv('OME_HOST', 'localhost')
@@ -76,16 +77,15 @@ class markers_set(unittest.TestCase):
 
   def tearDown(self):
     self.kill_list.reverse()
-    for x in self.kill_list:
-      self.kb.delete(x)
+    self.kb.delete_array(self.kill_list)
     self.kill_list = []
 
-  def __create_snp_markers_set(self, N):
+  def __create_snp_markers_set(self, N, **kwargs):
     label = 'ams-%f' % time.time()
     maker, model, release = 'FOO', 'FOO1', '%f' % time.time()
     rows = [('M%d' % i, 'AC[A/G]GT', i, False) for i in xrange(N)]
     mset = self.kb.create_snp_markers_set(
-      label, maker, model, release, N, iter(rows), self.action
+      label, maker, model, release, N, iter(rows), self.action, **kwargs
       )
     self.kill_list.append(mset)
     return mset, rows
@@ -202,6 +202,147 @@ class markers_set(unittest.TestCase):
       self.assertTrue((confs[indices] == x['confidence']).all())
     self.assertEqual(i, 0)
 
+  def test_gdo_bulk(self):
+    N, n_samples = 32, 5
+    mset, _ = self.__create_snp_markers_set(N)
+    mset.load_markers()
+    gdos = []
+    for i in xrange(n_samples):
+      data_sample = self.__create_data_sample(mset, 'foo-data-%d' % i)
+      probs, confs = make_fake_data(mset)
+      gdos.append((data_sample, probs, confs))
+    # one row per addData call
+    dos = self.kb.add_gdo_data_objects(self.action, gdos, max_bytes=1)
+    self.kill_list.extend(dos)
+    self.assertEqual(len(dos), n_samples)
+    for do, (data_sample, probs, confs) in it.izip(dos, gdos):
+      self.assertEqual(do.sample, data_sample)
+      self.assertEqual(do.size, probs.nbytes + confs.nbytes)
+      probs1, confs1 = data_sample.resolve_to_data()
+      self.assertTrue((probs == probs1).all())
+      self.assertTrue((confs == confs1).all())
+
+  def test_gdo_iterator_order(self):
+    N, n_samples = 32, 5
+    mset, _ = self.__create_snp_markers_set(N)
+    mset.load_markers()
+    gdos = []
+    for i in xrange(n_samples):
+      data_sample = self.__create_data_sample(mset, 'foo-data-%d' % i)
+      probs, confs = make_fake_data(mset)
+      gdos.append((data_sample, probs, confs))
+    self.kill_list.extend(self.kb.add_gdo_data_objects(self.action, gdos))
+    gdos.reverse()
+    data_samples = [g[0] for g in gdos]
+    indices = np.array([1, 5, N-1])
+    s = self.kb.get_gdo_iterator(mset, data_samples=data_samples,
+                                 indices=indices, batch_size=2)
+    for i, x in enumerate(s):
+      _, probs, confs = gdos[i]
+      self.assertTrue((probs[:,indices] == x['probs']).all())
+      self.assertTrue((confs[indices] == x['confidence']).all())
+    self.assertEqual(i, n_samples - 1)
+
+  def test_resolve_many(self):
+    N, n_samples = 32, 5
+    mset, _ = self.__create_snp_markers_set(N)
+    mset.load_markers()
+    gdos = []
+    for i in xrange(n_samples):
+      data_sample = self.__create_data_sample(mset, 'foo-data-%d' % i)
+      probs, confs = make_fake_data(mset)
+      gdos.append((data_sample, probs, confs))
+    self.kill_list.extend(self.kb.add_gdo_data_objects(self.action, gdos))
+    data_samples = [g[0] for g in gdos]
+    probs, confs = self.kb.GenotypeDataSample.resolve_many(data_samples)
+    self.assertEqual(probs.shape, (n_samples, 2, N))
+    self.assertEqual(confs.shape, (n_samples, N))
+    for i, (_, p, c) in enumerate(gdos):
+      self.assertTrue((p == probs[i]).all())
+      self.assertTrue((c == confs[i]).all())
+    indices = np.array([1, 5, N-1])
+    fn = tempfile.NamedTemporaryFile().name
+    out = (np.memmap(fn + '.probs', np.float32, 'w+',
+                     shape=(n_samples, 2, len(indices))),
+           np.memmap(fn + '.confs', np.float32, 'w+',
+                     shape=(n_samples, len(indices))))
+    probs, confs = self.kb.GenotypeDataSample.resolve_many(
+      data_samples, marker_indices=indices, out=out
+      )
+    self.assertTrue(probs is out[0] and confs is out[1])
+    for i, (_, p, c) in enumerate(gdos):
+      self.assertTrue((p[:,indices] == probs[i]).all())
+      self.assertTrue((c[indices] == confs[i]).all())
+    for ext in '.probs', '.confs':
+      os.remove(fn + ext)
+
+  def __check_gdo_subsets(self, mset, gdos):
+    N = len(mset)
+    data_samples = [g[0] for g in gdos]
+    for indices in np.array([1, 9, N-1]), slice(N/4, N/2), np.array([3]):
+      s = self.kb.get_gdo_iterator(mset, data_samples=data_samples,
+                                   indices=indices)
+      for x, (_, probs, confs) in it.izip(s, gdos):
+        self.assertTrue((probs[:,indices] == x['probs']).all())
+        self.assertTrue((confs[indices] == x['confidence']).all())
+      s = self.kb.get_gdo_iterator(mset, indices=indices, batch_size=2)
+      for i, x in enumerate(s):
+        _, probs, confs = gdos[i]
+        self.assertTrue((probs[:,indices] == x['probs']).all())
+        self.assertTrue((confs[indices] == x['confidence']).all())
+      self.assertEqual(i, len(gdos) - 1)
+
+  def test_gdo_blocks(self):
+    N, n_samples, block_size = 42, 3, 8
+    mset, _ = self.__create_snp_markers_set(N, gdo_block_size=block_size)
+    mset.load_markers()
+    self.assertEqual(self.kb.gadpt.gdo_blocks_layout(mset.id),
+                     (N, block_size))
+    gdos = []
+    for i in xrange(n_samples):
+      data_sample = self.__create_data_sample(mset, 'foo-data-%d' % i)
+      probs, confs = make_fake_data(mset)
+      gdos.append((data_sample, probs, confs))
+    self.kill_list.extend(self.kb.add_gdo_data_objects(self.action, gdos))
+    self.__check_gdo_subsets(mset, gdos)
+    mset, _ = self.__create_snp_markers_set(N, gdo_block_size=None)
+    mset.load_markers()
+    self.assertTrue(self.kb.gadpt.gdo_blocks_layout(mset.id) is None)
+    gdos = [(self.__create_data_sample(mset, 'bar-data-%d' % i), p, c)
+            for i, (_, p, c) in enumerate(gdos)]
+    self.kill_list.extend(self.kb.add_gdo_data_objects(self.action, gdos))
+    self.kb.create_gdo_blocks_table(mset, block_size)
+    self.assertEqual(self.kb.gadpt.gdo_blocks_layout(mset.id),
+                     (N, block_size))
+    self.__check_gdo_subsets(mset, gdos)
+
+  def test_gdo_encoding(self):
+    N, n_samples = 42, 3
+    for encoding, tol in ('uint16', 1e-4), ('uint8', 1e-2):
+      mset, _ = self.__create_snp_markers_set(N, gdo_block_size=8,
+                                              gdo_encoding=encoding)
+      mset.load_markers()
+      gdos = []
+      for i in xrange(n_samples):
+        data_sample = self.__create_data_sample(mset, 'foo-data-%d' % i)
+        probs, confs = make_fake_data(mset)
+        gdos.append((data_sample, probs, confs))
+      self.kill_list.extend(self.kb.add_gdo_data_objects(self.action, gdos))
+      for data_sample, probs, confs in gdos:
+        probs1, confs1 = data_sample.resolve_to_data()
+        self.assertTrue(np.abs(probs - probs1).max() < tol)
+        self.assertTrue(np.abs(confs - confs1).max() < tol)
+      for indices in None, np.array([1, 9, N-1]):
+        s = self.kb.get_gdo_iterator(mset, indices=indices)
+        for x, (_, probs, confs) in it.izip(s, gdos):
+          if indices is not None:
+            probs, confs = probs[:,indices], confs[indices]
+          self.assertTrue(np.abs(probs - x['probs']).max() < tol)
+          self.assertTrue(np.abs(confs - x['confidence']).max() < tol)
+          self.assertTrue(np.array_equal(
+            x['calls'], algo.project_to_discrete_genotype(probs)
+            ))
+
   def test_define_range_selector(self):
     N, N_dups = 16, 0
     ref_genome = 'g' + ('%f' % time.time())[-14:]
@@ -328,6 +469,11 @@ def suite():
   suite.addTest(markers_set('test_align'))
   suite.addTest(markers_set('test_read_ssc'))
   suite.addTest(markers_set('test_gdo'))
+  suite.addTest(markers_set('test_gdo_bulk'))
+  suite.addTest(markers_set('test_gdo_iterator_order'))
+  suite.addTest(markers_set('test_resolve_many'))
+  suite.addTest(markers_set('test_gdo_blocks'))
+  suite.addTest(markers_set('test_gdo_encoding'))
   suite.addTest(markers_set('test_define_range_selector'))
   suite.addTest(markers_set('test_intersect'))
   #--
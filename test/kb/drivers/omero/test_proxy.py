@@ -0,0 +1,59 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest
+import omero.rtypes as ort
+
+from bl.vl.kb.drivers.omero.proxy import Proxy
+from bl.vl.kb.drivers.omero.action import Action
+from bl.vl.kb.drivers.omero.individual import Individual, ActionOnIndividual
+from bl.vl.kb.drivers.omero.vessels import Tube
+
+
+def make(klass, oid):
+  o = klass(ome_obj=None, proxy=None)
+  o.ome_obj.id = ort.rlong(oid)
+  return o
+
+
+class TestDeleteLevels(unittest.TestCase):
+
+  def setUp(self):
+    # no connection needed: delete levels only look at the objects
+    self.proxy = Proxy.__new__(Proxy)
+
+  def __levels(self, objs):
+    return [[o.ome_obj for o in level]
+            for level in self.proxy._Proxy__delete_levels(objs)]
+
+  def test_same_id_different_class(self):
+    ind = make(Individual, 7)
+    tube = make(Tube, 7)
+    action = make(ActionOnIndividual, 3)
+    action.ome_obj.setTarget(ind.ome_obj)
+    # the action targets Individual #7, not Tube #7
+    self.assertEqual(self.__levels([action, tube]),
+                     [[action.ome_obj, tube.ome_obj]])
+    # a real reference (tube -> action) must not turn into a cycle
+    tube.ome_obj.setAction(action.ome_obj)
+    self.assertEqual(self.__levels([action, tube]),
+                     [[tube.ome_obj], [action.ome_obj]])
+
+  def test_reference_order(self):
+    action = make(Action, 1)
+    tube = make(Tube, 1)
+    tube.ome_obj.setAction(action.ome_obj)
+    self.assertEqual(self.__levels([action, tube]),
+                     [[tube.ome_obj], [action.ome_obj]])
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestDeleteLevels('test_same_id_different_class'))
+  suite.addTest(TestDeleteLevels('test_reference_order'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
@@ -0,0 +1,112 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import os, unittest, threading
+
+from bl.vl.kb import KBError
+from bl.vl.kb.drivers.omero.proxy_core import ProxyCore, parse_rpc_stats_env
+
+
+OME_HOST = os.getenv("OME_HOST", "localhost")
+OME_USER = os.getenv("OME_USER", "root")
+OME_PASS = os.getenv("OME_PASS", "romeo")
+
+POOL_SIZE = 2
+N_THREADS = 8
+
+
+class TestSessionPool(unittest.TestCase):
+
+  def setUp(self):
+    self.pc = ProxyCore(OME_HOST, OME_USER, OME_PASS, pool_size=POOL_SIZE)
+
+  def tearDown(self):
+    self.pc.pool.close()
+
+  def test_nested_sessions(self):
+    with self.pc.session() as s1:
+      with self.pc.session() as s2:
+        self.assertTrue(s1 is s2)
+      self.assertTrue(self.pc.connect() is s1)
+      self.pc.disconnect()
+    stats = self.pc.pool.stats()[(OME_USER, None)]
+    self.assertEqual(stats['open'], 0)
+
+  def test_concurrent_operations(self):
+    errors = []
+    def worker():
+      try:
+        for _ in xrange(10):
+          self.pc.ome_operation('getConfigService', 'getConfigValue',
+                                'omero.version')
+          stats = self.pc.pool.stats()[(OME_USER, None)]
+          self.assertTrue(stats['open'] <= POOL_SIZE)
+      except Exception, e:
+        errors.append(e)
+    threads = [threading.Thread(target=worker) for _ in xrange(N_THREADS)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(errors, [])
+    stats = self.pc.pool.stats()[(OME_USER, None)]
+    self.assertEqual(stats['open'], stats['idle'])
+
+  def test_recycle(self):
+    self.pc.ome_operation('getConfigService', 'getConfigValue',
+                          'omero.version')
+    self.assertEqual(self.pc.pool.stats()[(OME_USER, None)]['idle'], 1)
+    self.pc.pool.recycle()
+    self.assertEqual(self.pc.pool.stats()[(OME_USER, None)]['open'], 0)
+
+  def test_acquire_timeout(self):
+    pc = ProxyCore(OME_HOST, OME_USER, OME_PASS, pool_size=1,
+                   session_acquire_timeout=0.5)
+    try:
+      errors = []
+      def other():
+        try:
+          with pc.session():
+            pass
+        except Exception, e:
+          errors.append(e)
+      with pc.session():
+        t = threading.Thread(target=other)
+        t.start()
+        t.join()
+      self.assertEqual(len(errors), 1)
+      self.assertTrue(isinstance(errors[0], KBError))
+    finally:
+      pc.pool.close()
+
+
+class TestRpcStatsEnv(unittest.TestCase):
+
+  def test_parse(self):
+    for value, expected in [
+      (None, (False, None)),
+      ('off', (False, None)),
+      ('No', (False, None)),
+      ('', (True, None)),
+      ('yes', (True, None)),
+      ('on', (True, None)),
+      ('1 second', (True, None)),
+      ('2.5', (True, 2.5)),
+      (' 0 ', (True, 0.0)),
+      ]:
+      self.assertEqual(parse_rpc_stats_env(value), expected)
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestSessionPool('test_nested_sessions'))
+  suite.addTest(TestSessionPool('test_concurrent_operations'))
+  suite.addTest(TestSessionPool('test_recycle'))
+  suite.addTest(TestSessionPool('test_acquire_timeout'))
+  suite.addTest(TestRpcStatsEnv('test_parse'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
@@ -1,11 +1,11 @@
 # BEGIN_COPYRIGHT
 # END_COPYRIGHT
 
-import os, unittest, uuid
+import os, unittest, uuid, threading
 import itertools as it
 import numpy as np
 
-from bl.vl.kb.drivers.omero.proxy_core import ProxyCore
+from bl.vl.kb.drivers.omero.proxy_core import ProxyCore, TableSelection
 
 
 OME_HOST = os.getenv("OME_HOST", "localhost")
@@ -106,6 +106,33 @@ class TestProxyCore(unittest.TestCase):
     for i, row in enumerate(row_it):
       self.assertTrue(row == data[i])
 
+  def test_table_rows_prefetch(self):
+    fields = self.__make_fields()
+    table_name = get_random_table_name()
+    try:
+      pc = ProxyCore(OME_HOST, OME_USER, OME_PASS, pool_size=1)
+      pc.create_table(table_name, fields)
+      data = self.__fill_table(pc, table_name, N_ROWS)
+      batch_size = N_ROWS/4
+      batches = list(pc.get_table_rows_iterator(
+        table_name, batch_size=batch_size, prefetch=2, batches=True,
+        col_names=['r_id']
+        ))
+      row_it = pc.get_table_rows_iterator(table_name, batch_size=2)
+      first = row_it.next()
+      # open iterators must not take the only pooled session
+      n_rows = pc.get_number_of_rows(table_name)
+      row_it.close()
+      rows = pc.get_table_rows(table_name, None)
+    finally:
+      pc.delete_table(table_name)
+    self.assertEqual(len(batches), 4)
+    self.assertEqual(batches[0].dtype.names, ('r_id',))
+    self.assertTrue(np.all(np.concatenate(batches)['r_id'] == data['r_id']))
+    self.assertTrue(first == data[0])
+    self.assertEqual(n_rows, N_ROWS)
+    self.assertTrue(np.all(rows == data))
+
   def test_update_row(self):
     fields = self.__make_fields()
     table_name = get_random_table_name()
@@ -127,6 +154,56 @@ class TestProxyCore(unittest.TestCase):
     self.assertEqual(len(r), 1)
     self.assertTrue(urow == r[0])
 
+  def test_update_rows(self):
+    fields = self.__make_fields()
+    table_name = get_random_table_name()
+    try:
+      pc = ProxyCore(OME_HOST, OME_USER, OME_PASS)
+      pc.create_table(table_name, fields)
+      data = self.__fill_table(pc, table_name, N_ROWS)
+      indices = range(1, N_ROWS, 2)
+      new_ids = np.arange(len(indices)) + N_ROWS
+      n = pc.update_table_rows_by_indices(
+        table_name, indices, {'r_id': new_ids, 'o_vid': 'foo'}, batch_size=3
+        )
+      selector = ['(r_id == %d)' % i for i in xrange(N_ROWS/2)]
+      m = pc.update_table_rows(table_name, selector, {'a_l_type': 0})
+      rows = pc.get_table_rows(table_name, None)
+    finally:
+      pc.delete_table(table_name)
+    self.assertEqual(n, len(indices))
+    self.assertTrue(np.all(rows['r_id'][indices] == new_ids))
+    self.assertTrue(np.all(rows['o_vid'][indices] == 'foo'))
+    self.assertTrue(np.all(rows['t_vid'] == data['t_vid']))
+    even = range(0, N_ROWS/2, 2)
+    self.assertEqual(m, len(even))
+    self.assertTrue(np.all(rows['a_l_type'][even] == 0))
+    self.assertTrue(np.all(rows['a_l_type'][indices] == data['a_l_type'][indices]))
+
+  def test_table_cache(self):
+    fields = self.__make_fields()
+    table_name = get_random_table_name()
+    pc = ProxyCore(OME_HOST, OME_USER, OME_PASS, pool_size=1)
+    try:
+      pc.create_table(table_name, fields)
+      data = self.__fill_table(pc, table_name, N_ROWS)
+      with pc.session() as s:
+        t1, h1 = pc._get_table_and_headers(s, table_name)
+      with pc.session() as s:
+        t2, h2 = pc._get_table_and_headers(s, table_name)
+      pc.delete_table(table_name)
+      pc.create_table(table_name, fields)
+      with pc.session() as s:
+        t3, h3 = pc._get_table_and_headers(s, table_name)
+        n_rows = t3.getNumberOfRows()
+    finally:
+      pc.delete_table(table_name)
+    self.assertTrue(t1 is t2)
+    self.assertFalse(h1 is h2)
+    self.assertEqual([c.name for c in h1], [c.name for c in h2])
+    self.assertFalse(t3 is t1)
+    self.assertEqual(n_rows, 0)
+
   def test_selections(self):
     fields = self.__make_fields()
     table_name = get_random_table_name()
@@ -151,6 +228,111 @@ class TestProxyCore(unittest.TestCase):
     for i, r in it.izip(irange, rows_lite):
       self.assertTrue(data[i] == r)
 
+  def test_selection_round_trips(self):
+    fields = self.__make_fields()
+    table_name = get_random_table_name()
+    try:
+      pc = ProxyCore(OME_HOST, OME_USER, OME_PASS)
+      pc.create_table(table_name, fields)
+      data = self.__fill_table(pc, table_name, N_ROWS)
+      irange = range(N_ROWS/4, (3*N_ROWS)/4) + [N_ROWS-1]
+      selectors = ['(r_vid == "%s")' % data[i]['r_vid'] for i in irange]
+      with pc.session() as s:
+        t = pc._get_table(s, table_name)
+        col_objs = t.getHeaders()
+        sel = TableSelection(t, window=N_ROWS, min_run=2)
+        ids = sel.where(selectors)
+        rows = sel.fetch(ids, col_objs, range(len(col_objs)))
+    finally:
+      pc.delete_table(table_name)
+    self.assertEqual(list(ids), irange)
+    self.assertTrue(np.all(rows == data[irange]))
+    # getNumberOfRows + getWhereList + one read + one slice
+    self.assertEqual(sel.round_trips, 4)
+
+  def test_columnar(self):
+    fields = self.__make_fields()
+    table_name = get_random_table_name()
+    try:
+      pc = ProxyCore(OME_HOST, OME_USER, OME_PASS)
+      pc.create_table(table_name, fields)
+      data = self.__fill_table(pc, table_name, N_ROWS)
+      cols = pc.get_table_rows(table_name, None, col_names=['r_id', 'a_f_type'],
+                               batch_size=N_ROWS/3, columnar=True)
+      sel = '(r_id >= %d)' % (N_ROWS/2)
+      sel_cols = pc.get_table_rows(table_name, sel, columnar=True)
+    finally:
+      pc.delete_table(table_name)
+    self.assertEqual(sorted(cols), ['a_f_type', 'r_id'])
+    self.assertTrue(np.all(cols['r_id'] == data['r_id']))
+    self.assertEqual(cols['a_f_type'].shape, (N_ROWS, ARRAY_SIZE))
+    self.assertTrue(cols['a_f_type'].flags.c_contiguous)
+    self.assertTrue(np.all(cols['a_f_type'] == data['a_f_type']))
+    for k in data.dtype.names:
+      self.assertTrue(np.all(sel_cols[k] == data[N_ROWS/2:][k]))
+
+  def test_columnar_write(self):
+    fields = self.__make_fields()
+    table_name = get_random_table_name()
+    try:
+      pc = ProxyCore(OME_HOST, OME_USER, OME_PASS)
+      pc.create_table(table_name, fields)
+      data = self.__fill_table(pc, table_name, N_ROWS)
+      cols = dict((k, data[k]) for k in data.dtype.names)
+      indices = pc.add_table_rows(table_name, cols, batch_size=N_ROWS/3)
+      rows = pc.get_table_rows(table_name, None)
+    finally:
+      pc.delete_table(table_name)
+    self.assertEqual(indices, range(N_ROWS, 2*N_ROWS))
+    self.assertTrue(np.all(rows[:N_ROWS] == data))
+    self.assertTrue(np.all(rows[N_ROWS:] == data))
+
+  def test_parallel_read(self):
+    fields = self.__make_fields()
+    table_name = get_random_table_name()
+    try:
+      pc = ProxyCore(OME_HOST, OME_USER, OME_PASS, pool_size=3)
+      pc.create_table(table_name, fields)
+      data = self.__fill_table(pc, table_name, N_ROWS)
+      rows = pc.get_table_rows_parallel(table_name, batch_size=N_ROWS/5)
+      cols = pc.get_table_rows_parallel(table_name, col_names=['r_id'],
+                                        n_workers=2, batch_size=3,
+                                        columnar=True)
+    finally:
+      pc.delete_table(table_name)
+    self.assertTrue(np.all(data == rows))
+    self.assertTrue(np.all(cols['r_id'] == data['r_id']))
+
+  def test_concurrent_append(self):
+    fields = [('long', 'r_id', 'Result object ID', None)]
+    table_name = get_random_table_name()
+    n_threads, n_batches = 4, 5
+    try:
+      pc = ProxyCore(OME_HOST, OME_USER, OME_PASS, pool_size=n_threads)
+      pc.create_table(table_name, fields)
+      indices, errors = {}, []
+      def writer(w):
+        try:
+          for b in xrange(n_batches):
+            r_ids = w * n_batches * N_ROWS + b * N_ROWS + np.arange(N_ROWS)
+            idx = pc.add_table_rows(table_name, {'r_id': r_ids}, N_ROWS/2)
+            indices.update(it.izip(r_ids, idx))
+        except Exception, e:
+          errors.append(e)
+      threads = [threading.Thread(target=writer, args=(w,))
+                 for w in xrange(n_threads)]
+      for t in threads:
+        t.start()
+      for t in threads:
+        t.join()
+      rows = pc.get_table_rows(table_name, None)
+    finally:
+      pc.delete_table(table_name)
+    self.assertEqual(errors, [])
+    self.assertEqual(len(rows), n_threads * n_batches * N_ROWS)
+    for r_id, i in indices.iteritems():
+      self.assertEqual(rows[i]['r_id'], r_id)
+
   def test_array_size(self):
     print
     exp = 5  # large values may trigger a mem overflow (see Ice.MessageSizeMax)
@@ -174,8 +356,16 @@ def suite():
   suite.addTest(TestProxyCore('test_create_delete'))
   suite.addTest(TestProxyCore('test_table_rows'))
   suite.addTest(TestProxyCore('test_table_rows_iterator'))
+  suite.addTest(TestProxyCore('test_table_rows_prefetch'))
   suite.addTest(TestProxyCore('test_update_row'))
+  suite.addTest(TestProxyCore('test_update_rows'))
+  suite.addTest(TestProxyCore('test_table_cache'))
   suite.addTest(TestProxyCore('test_selections'))
+  suite.addTest(TestProxyCore('test_selection_round_trips'))
+  suite.addTest(TestProxyCore('test_columnar'))
+  suite.addTest(TestProxyCore('test_columnar_write'))
+  suite.addTest(TestProxyCore('test_parallel_read'))
+  suite.addTest(TestProxyCore('test_concurrent_append'))
   suite.addTest(TestProxyCore('test_array_size'))
   return suite
 
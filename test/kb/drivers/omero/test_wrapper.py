@@ -2,7 +2,11 @@
 # END_COPYRIGHT
 
 import unittest
-from bl.vl.kb.drivers.omero.wrapper import OmeroWrapper
+import omero.model as om
+import omero.rtypes as ort
+from bl.vl.utils.ome_utils import ome_key, ome_hash, ome_base_name
+from bl.vl.kb.drivers.omero.wrapper import OmeroWrapper, Field, STRING, \
+     REQUIRED, OPTIONAL
 
 
 class Foo(OmeroWrapper):
@@ -20,6 +24,16 @@ class Foo(OmeroWrapper):
     self.bare_setattr('bar', v)
 
 
+class Bar(OmeroWrapper):
+
+  __fields__ = [('label', STRING, REQUIRED)]
+
+
+class Baz(Bar):
+
+  __fields__ = [('description', STRING, OPTIONAL)]
+
+
 class TestOmeroWrapper(unittest.TestCase):
 
   def test_bare_attrs(self):
@@ -29,10 +43,36 @@ class TestOmeroWrapper(unittest.TestCase):
     self.assertTrue(hasattr(f, 'bar'))
     self.assertEqual(f.get_bar(), 22)
 
+  def test_fields(self):
+    self.assertTrue(isinstance(Baz.label, Field))
+    self.assertTrue(isinstance(Baz.description, Field))
+    b = Baz(om.StudyI(), None)
+    self.assertEqual(b.label, None)
+    b.label = 'foo'
+    b.description = 'bar'
+    self.assertEqual(b.label, 'foo')
+    self.assertEqual(b.description, 'bar')
+    self.assertEqual(b.ome_obj.label.val, 'foo')
+    self.assertRaises(AttributeError, getattr, b, 'foo')
+    self.assertRaises(AttributeError, setattr, b, 'foo', 1)
+
+  def test_identity(self):
+    s1, s2, s3 = om.StudyI(), om.StudyI(), om.StudyI()
+    s1.id, s2.id, s3.id = ort.rlong(1), ort.rlong(1), ort.rlong(2)
+    self.assertEqual(ome_key(s1), ome_key(s2))
+    self.assertNotEqual(ome_key(s1), ome_key(s3))
+    self.assertEqual(ome_hash(s1), hash(ome_key(s1)))
+    self.assertTrue(ome_base_name(om.StudyI) is ome_base_name(om.StudyI))
+    self.assertEqual(Bar(s1, None), Bar(s2, None))
+    self.assertNotEqual(Bar(s1, None), Bar(s3, None))
+    self.assertEqual(hash(Bar(s1, None)), hash(Bar(s2, None)))
+
 
 def suite():
   suite = unittest.TestSuite()
   suite.addTest(TestOmeroWrapper('test_bare_attrs'))
+  suite.addTest(TestOmeroWrapper('test_fields'))
+  suite.addTest(TestOmeroWrapper('test_identity'))
   return suite
 
 
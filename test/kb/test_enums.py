@@ -5,6 +5,7 @@ import os, unittest, logging
 logging.basicConfig(level=logging.ERROR)
 
 from bl.vl.kb import KnowledgeBase as KB
+from bl.vl.utils.instrumentation import CallStats
 from enum_base import EnumBase
 
 
@@ -30,13 +31,58 @@ class TestEnums(EnumBase):
   def setUp(self):
     self.kb = KB(driver='omero')(OME_HOST, OME_USER, OME_PASS)
 
+  def tearDown(self):
+    self.kill_list.reverse()
+    self.kb.delete_array(self.kill_list)
+    self.kill_list = []
+
   def test_enums(self):
     self._check_enums()
 
+  def test_enum_cache(self):
+    self.kb.Gender.map_enums_values(self.kb)
+    aconf, action = self.create_action()
+    self.kill_list.append(action.save())
+    stats = CallStats()
+    self.kb.rpc_hooks.register(stats)
+    try:
+      for _ in xrange(10):
+        self.kb.Gender.map_enums_values(self.kb)
+        self.create_individual(action=action, gender=self.kb.Gender.FEMALE)
+      self.assertEqual(stats.as_dict(), {})
+      self.kb.Gender.map_enums_values(self.kb, refresh=True)
+      self.assertEqual(
+        stats.as_dict()['getQueryService.findAllByQuery']['count'], 1
+        )
+    finally:
+      self.kb.rpc_hooks.unregister(stats)
+    for x in self.kb.Gender.__enums__:
+      self.assertEqual(x.enum_label(), x.ome_obj.value.val)
+
+  def test_enum_miss(self):
+    self.kb.Gender.map_enums_values(self.kb, refresh=True)
+    stats = CallStats()
+    self.kb.rpc_hooks.register(stats)
+    try:
+      # unknown ids reload the enum table only once
+      for _ in xrange(3):
+        self.assertTrue(self.kb.Gender.enum_by_id(self.kb, -1) is None)
+      self.assertEqual(
+        stats.as_dict()['getQueryService.findAllByQuery']['count'], 1
+        )
+      female = self.kb.Gender.FEMALE
+      self.assertTrue(
+        self.kb.Gender.enum_by_id(self.kb, female.ome_obj.id.val) is female
+        )
+    finally:
+      self.kb.rpc_hooks.unregister(stats)
+
 
 def suite():
   suite = unittest.TestSuite()
   suite.addTest(TestEnums('test_enums'))
+  suite.addTest(TestEnums('test_enum_cache'))
+  suite.addTest(TestEnums('test_enum_miss'))
   return suite
 
 
@@ -5,6 +5,7 @@ import os, unittest, logging
 logging.basicConfig(level=logging.ERROR)
 
 from bl.vl.kb import KnowledgeBase as KB
+from bl.vl.utils.instrumentation import CallStats
 from kb_object_creator import KBObjectCreator
 
 
@@ -24,8 +25,7 @@ class TestKB(KBObjectCreator):
 
   def tearDown(self):
     self.kill_list.reverse()
-    for x in self.kill_list:
-      self.kb.delete(x)
+    self.kb.delete_array(self.kill_list)
     self.kill_list = []
 
   def check_object(self, o, conf, otype):
@@ -64,12 +64,36 @@ class TestKB(KBObjectCreator):
     self.kb.delete(e)
     self.assertEqual(self.kb.get_enrollment(study, conf['studyCode']), None)
 
+  def test_prefetch(self):
+    conf, father = self.create_individual(gender=self.kb.Gender.MALE)
+    self.kill_list.append(father.save())
+    conf, mother = self.create_individual(gender=self.kb.Gender.FEMALE)
+    self.kill_list.append(mother.save())
+    children = [self.create_individual(father=father, mother=mother)[1]
+                for _ in xrange(3)]
+    self.kill_list.extend(self.kb.save_array(children))
+    self.kb.clear_cache()
+    vids = [c.id for c in children]
+    inds = self.kb.get_by_vids(self.kb.Individual, vids).values()
+    self.kb.prefetch(inds, ['father', 'mother', 'action.setup'])
+    stats = CallStats()
+    self.kb.rpc_hooks.register(stats)
+    try:
+      for i in inds:
+        self.assertEqual(i.father.id, father.id)
+        self.assertEqual(i.mother.id, mother.id)
+        self.assertFalse(i.action.setup is None)
+    finally:
+      self.kb.rpc_hooks.unregister(stats)
+    self.assertEqual(stats.as_dict(), {})
+
 
 def suite():
   suite = unittest.TestSuite()
   suite.addTest(TestKB('test_individual'))
   suite.addTest(TestKB('test_enrollment'))
   suite.addTest(TestKB('test_enrollment_ops'))
+  suite.addTest(TestKB('test_prefetch'))
   return suite
 
 
@@ -4,7 +4,8 @@
 import os, unittest, logging
 logging.basicConfig(level=logging.ERROR)
 
-from bl.vl.kb import KnowledgeBase as KB
+from bl.vl.kb import KnowledgeBase as KB, KBError
+from bl.vl.utils.instrumentation import CallStats
 from kb_object_creator import KBObjectCreator
 
 
@@ -24,8 +25,7 @@ class TestKB(KBObjectCreator):
 
   def tearDown(self):
     self.kill_list.reverse()
-    for x in self.kill_list:
-      self.kb.delete(x)
+    self.kb.delete_array(self.kill_list)
     self.kill_list = []
 
   def check_object(self, o, conf, otype):
@@ -61,12 +61,103 @@ class TestKB(KBObjectCreator):
     self.kill_list.append(v.save())
     self.check_object(v, conf, self.kb.PlateWell)
 
+  def test_bulk_lookup(self):
+    tubes = []
+    for i in xrange(3):
+      conf, v = self.create_tube()
+      self.kill_list.append(v.save())
+      tubes.append(v)
+    conf, p = self.create_titer_plate()
+    self.kill_list.append(p.save())
+    conf, w = self.create_plate_well(p)
+    self.kill_list.append(w.save())
+    well_label = '%s:%s' % (p.label, w.label)
+    labels = [t.label for t in tubes] + [well_label, 'no-such-tube']
+    by_label = self.kb.get_by_labels(self.kb.Vessel, labels)
+    self.assertEqual(sorted(by_label), sorted(labels[:-1]))
+    for t in tubes:
+      self.assertEqual(by_label[t.label].id, t.id)
+    self.assertEqual(by_label[well_label].id, w.id)
+    by_vid = self.kb.get_by_vids(self.kb.Tube, [t.id for t in tubes])
+    self.assertEqual(sorted(by_vid), sorted(t.id for t in tubes))
+
+  def test_objects_iterator(self):
+    vids = set()
+    for i in xrange(3):
+      conf, v = self.create_tube()
+      self.kill_list.append(v.save())
+      vids.add(v.id)
+    tubes = list(self.kb.get_objects_iterator(self.kb.Tube, page_size=2))
+    self.assertEqual(len(tubes), len(self.kb.get_objects(self.kb.Tube)))
+    self.assertTrue(vids <= set(t.id for t in tubes))
+    first = self.kb.get_objects_iterator(self.kb.Tube, page_size=2).next()
+    self.assertTrue(isinstance(first, self.kb.Tube))
+
+  def test_fields(self):
+    labels = {}
+    for i in xrange(3):
+      conf, v = self.create_tube()
+      self.kill_list.append(v.save())
+      labels[v.label] = v.id
+    rows = self.kb.get_fields(self.kb.Tube, ['label', 'id'])
+    self.assertTrue(all(type(r) is tuple for r in rows))
+    mapping = dict(rows)
+    for l, vid in labels.iteritems():
+      self.assertEqual(mapping[l], vid)
+    a = self.kb.get_fields(self.kb.Tube, ['label', 'id'],
+                           dtype=[('label', '|S64'), ('vid', '|S34')])
+    self.assertEqual(len(a), len(rows))
+    self.assertEqual(set(a['vid']), set(mapping.itervalues()))
+
+  def test_batched_graph_updates(self):
+    aconf, action = self.create_action_on_vessel()
+    self.kill_list.append(action.save())
+    tubes = [self.create_tube(action=action)[1] for _ in xrange(10)]
+    stats = CallStats()
+    self.kb.rpc_hooks.register(stats)
+    try:
+      with self.kb.deferred_graph_updates():
+        self.kb.save_array(tubes[:5])
+        self.kb.save_array(tubes[5:])
+    finally:
+      self.kb.rpc_hooks.unregister(stats)
+    self.kill_list.extend(tubes)
+    calls = stats.as_dict()
+    self.assertFalse('getQueryService.get' in calls)
+    self.assertEqual(calls['getQueryService.findAllByQuery']['count'], 2)
+
+  def test_delete_array(self):
+    aconf, action = self.create_action_on_vessel()
+    action.save()
+    tubes = [self.create_tube(action=action)[1] for _ in xrange(5)]
+    self.kb.save_array(tubes)
+    vids = [t.id for t in tubes]
+    self.assertEqual(self.kb.delete_array([action] + tubes), [])
+    self.assertEqual(self.kb.get_by_vids(self.kb.Tube, vids), {})
+    self.assertRaises(ValueError, self.kb.get_by_vid, self.kb.Action,
+                      action.id)
+    # an action still referenced by a tube cannot be deleted
+    aconf, action = self.create_action_on_vessel()
+    action.save()
+    tconf, tube = self.create_tube(action=action)
+    tube.save()
+    self.kill_list.extend([tube, action])
+    failed = self.kb.delete_array([action], ignore_errors=True)
+    self.assertEqual(len(failed), 1)
+    self.assertEqual(failed[0][0], action)
+    self.assertRaises(KBError, self.kb.delete_array, [action])
+
 
 def suite():
   suite = unittest.TestSuite()
   suite.addTest(TestKB('test_vessel'))
   suite.addTest(TestKB('test_tube'))
   suite.addTest(TestKB('test_plate_well'))
+  suite.addTest(TestKB('test_bulk_lookup'))
+  suite.addTest(TestKB('test_objects_iterator'))
+  suite.addTest(TestKB('test_fields'))
+  suite.addTest(TestKB('test_batched_graph_updates'))
+  suite.addTest(TestKB('test_delete_array'))
   return suite
 
 
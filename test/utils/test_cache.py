@@ -0,0 +1,84 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest, gc
+
+from bl.vl.utils.cache import LRUCache, WeakCache
+
+
+class Obj(object):
+
+  def __init__(self, v):
+    self.v = v
+
+
+class TestLRUCache(unittest.TestCase):
+
+  def test_eviction(self):
+    evicted = []
+    c = LRUCache(2, on_evict=lambda k, v: evicted.append(k))
+    objs = [Obj(i) for i in xrange(3)]
+    c[0] = objs[0]
+    c[1] = objs[1]
+    self.assertTrue(c.get(0) is objs[0])  # 0 is now the most recent
+    c[2] = objs[2]
+    self.assertEqual(len(c), 2)
+    self.assertEqual(evicted, [1])
+    self.assertTrue(1 not in c)
+    self.assertTrue(c[2] is objs[2])
+    self.assertRaises(KeyError, c.__getitem__, 1)
+
+  def test_stats(self):
+    c = LRUCache(1)
+    c['a'] = Obj('a')
+    c.get('a')
+    c.get('b')
+    c['b'] = Obj('b')
+    self.assertEqual(c.stats.as_dict(),
+                     {'hits': 1, 'misses': 1, 'evictions': 1})
+
+  def test_unbounded(self):
+    c = LRUCache(None)
+    for i in xrange(1000):
+      c[i] = Obj(i)
+    self.assertEqual(len(c), 1000)
+    self.assertEqual(c.stats.evictions, 0)
+    c.clear()
+    self.assertEqual(len(c), 0)
+
+
+class TestWeakCache(unittest.TestCase):
+
+  def test_weak_eviction(self):
+    c = WeakCache()
+    o = Obj(0)
+    c[0] = o
+    self.assertTrue(c.get(0) is o)
+    del o
+    gc.collect()
+    self.assertTrue(c.get(0) is None)
+    self.assertEqual(len(c), 0)
+    self.assertEqual(c.stats.as_dict(),
+                     {'hits': 1, 'misses': 1, 'evictions': 1})
+
+  def test_pop(self):
+    c = WeakCache()
+    o = Obj(0)
+    c[0] = o
+    self.assertTrue(c.pop(0) is o)
+    self.assertTrue(c.pop(0) is None)
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestLRUCache('test_eviction'))
+  suite.addTest(TestLRUCache('test_stats'))
+  suite.addTest(TestLRUCache('test_unbounded'))
+  suite.addTest(TestWeakCache('test_weak_eviction'))
+  suite.addTest(TestWeakCache('test_pop'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
@@ -0,0 +1,67 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest, logging
+
+from bl.vl.utils.instrumentation import HookRegistry, CallStats
+
+
+class ListHandler(logging.Handler):
+
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+  def setUp(self):
+    self.hooks = HookRegistry()
+    self.handler = ListHandler()
+    logger = logging.getLogger('test_instrumentation')
+    logger.addHandler(self.handler)
+    self.stats = CallStats(slow_threshold=0.0, logger=logger)
+
+  def test_timed(self):
+    with self.hooks.timed('a'):
+      pass
+    self.hooks.register(self.stats)
+    for size in 1, 2:
+      with self.hooks.timed('a') as call:
+        call.size = size
+    try:
+      with self.hooks.timed('b'):
+        raise ValueError
+    except ValueError:
+      pass
+    self.hooks.unregister(self.stats)
+    with self.hooks.timed('b'):
+      pass
+    stats = self.stats.as_dict()
+    self.assertEqual(sorted(stats), ['a', 'b'])
+    self.assertEqual(stats['a']['count'], 2)
+    self.assertEqual(stats['a']['size'], 3)
+    self.assertEqual(stats['b']['count'], 1)
+    self.assertEqual(len(self.handler.records), 3)
+    self.assertEqual(len(self.stats.summary().splitlines()), 3)
+
+  def test_notify(self):
+    calls = []
+    self.hooks.register(lambda *args: calls.append(args))
+    self.hooks.notify('x', 1.0, 10)
+    self.assertEqual(calls, [('x', 1.0, 10)])
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestInstrumentation('test_timed'))
+  suite.addTest(TestInstrumentation('test_notify'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
@@ -61,12 +61,33 @@ class TestIndexIntersect(unittest.TestCase):
     print "finished in %.1f s" % (time.time()-t0)
 
 
+class TestContiguousRuns(unittest.TestCase):
+
+  def test_runs(self):
+    starts, stops = np_ext.contiguous_runs([1, 2, 3, 7, 9, 10])
+    self.assertEqual(starts.tolist(), [1, 7, 9])
+    self.assertEqual(stops.tolist(), [4, 8, 11])
+
+  def test_edge_cases(self):
+    starts, stops = np_ext.contiguous_runs([])
+    self.assertEqual(starts.size, 0)
+    self.assertEqual(stops.size, 0)
+    starts, stops = np_ext.contiguous_runs(np.arange(5, 10))
+    self.assertEqual(starts.tolist(), [5])
+    self.assertEqual(stops.tolist(), [10])
+    starts, stops = np_ext.contiguous_runs([0, 2, 4])
+    self.assertEqual(starts.tolist(), [0, 2, 4])
+    self.assertEqual(stops.tolist(), [1, 3, 5])
+
+
 def suite():
   suite = unittest.TestSuite()
   suite.addTest(TestIndexIntersect('test_simple_array'))
   suite.addTest(TestIndexIntersect('test_record_array'))
   suite.addTest(TestIndexIntersect('test_exceptions'))
   #suite.addTest(TestIndexIntersect('test_performance'))
+  suite.addTest(TestContiguousRuns('test_runs'))
+  suite.addTest(TestContiguousRuns('test_edge_cases'))
   return suite
 
 
@@ -0,0 +1,50 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest, time, threading
+
+from bl.vl.utils import prefetch
+
+
+class TestPrefetch(unittest.TestCase):
+
+  def test_order(self):
+    self.assertEqual(list(prefetch(xrange(100), depth=3)), range(100))
+    self.assertEqual(list(prefetch([])), [])
+
+  def test_error(self):
+    def gen():
+      yield 1
+      raise ValueError('boom')
+    it = prefetch(gen())
+    self.assertEqual(it.next(), 1)
+    self.assertRaises(ValueError, it.next)
+
+  def test_early_stop(self):
+    produced = []
+    def gen():
+      for i in xrange(1000):
+        produced.append(i)
+        yield i
+    n_threads = threading.active_count()
+    it = prefetch(gen(), depth=2)
+    self.assertEqual(it.next(), 0)
+    it.close()
+    self.assertEqual(threading.active_count(), n_threads)
+    n = len(produced)
+    time.sleep(0.2)
+    self.assertEqual(len(produced), n)
+    self.assertTrue(n < 10)
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestPrefetch('test_order'))
+  suite.addTest(TestPrefetch('test_error'))
+  suite.addTest(TestPrefetch('test_early_stop'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))
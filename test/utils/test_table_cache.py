@@ -0,0 +1,64 @@
+# BEGIN_COPYRIGHT
+# END_COPYRIGHT
+
+import unittest, tempfile, shutil, os
+import numpy as np
+
+from bl.vl.utils.table_cache import TableDiskCache
+
+
+DTYPE = [('vid', '|S34'), ('index', 'i8'), ('probs', '(4,)float32')]
+
+
+def make_data(n):
+  a = np.zeros(n, dtype=DTYPE)
+  a['vid'] = ['V%04d' % i for i in xrange(n)]
+  a['index'] = np.arange(n)
+  a['probs'] = np.random.random((n, 4))
+  return a
+
+
+class TestTableDiskCache(unittest.TestCase):
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp(prefix='bl_vl_')
+    self.cache = TableDiskCache(os.path.join(self.root, 'cache'))
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def test_get_put(self):
+    a = make_data(10)
+    k = TableDiskCache.make_key('mset-V01.h5', '(index > 2)', ['vid'])
+    self.assertTrue(self.cache.get(k, 10, 'sig') is None)
+    self.cache.put(k, 10, 'sig', a)
+    b = self.cache.get(k, 10, 'sig')
+    self.assertTrue(np.all(a == b))
+    b['index'][0] = 100  # copy-on-write
+    self.assertTrue(np.all(self.cache.get(k, 10, 'sig') == a))
+    self.assertTrue(self.cache.get(k, 11, 'sig') is None)
+    self.assertEqual(self.cache.entries(), [])
+
+  def test_eviction(self):
+    a = make_data(100)
+    for i in xrange(3):
+      self.cache.put(TableDiskCache.make_key('t%d' % i), 100, 'sig', a)
+    size = self.cache.entries()[0]['size']
+    self.cache.get(TableDiskCache.make_key('t0'), 100, 'sig')
+    self.assertEqual(self.cache.evict(2 * size), 1)
+    names = [m['table_name'] for m in self.cache.entries()]
+    self.assertEqual(sorted(names), ['t0', 't2'])
+    self.assertEqual(self.cache.purge('t*'), 2)
+    self.assertEqual(self.cache.size(), 0)
+
+
+def suite():
+  suite = unittest.TestSuite()
+  suite.addTest(TestTableDiskCache('test_get_put'))
+  suite.addTest(TestTableDiskCache('test_eviction'))
+  return suite
+
+
+if __name__ == '__main__':
+  runner = unittest.TextTestRunner(verbosity=2)
+  runner.run((suite()))